@@ -1,5 +1,18 @@
 from django.apps import AppConfig
+from django.core.signals import request_finished
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from core.db import apply_pragmas
+        from core.storage import discard_rolled_back
+
+        connection_created.connect(
+            apply_pragmas, dispatch_uid='core.db.apply_pragmas'
+        )
+        request_finished.connect(
+            discard_rolled_back, dispatch_uid='core.storage.discard'
+        )
@@ -0,0 +1,283 @@
+import os
+import pickle
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+GENERATION_KEY = 'tiered-generation:{}'
+MISSING = object()
+
+
+class LocalTier:
+    """Bounded LRU of pickled values, private to the process."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            return entry
+
+    def set(self, key, expires, generation, data):
+        if len(data) > self.max_bytes:
+            self.delete(key)
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (expires, generation, data)
+            self.size += len(data)
+            while (
+                len(self._data) > self.max_entries
+                or self.size > self.max_bytes
+            ):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+
+class TieredCache(BaseCache):
+    """In-process LRU in front of a cache shared by all worker processes.
+
+    The shared tier is any Django backend, a FileBasedCache in LOCATION by
+    default, holding up to SHARED_MAX_ENTRIES and dropping a random
+    1/SHARED_CULL_FREQUENCY of them when full. Keys are spread over
+    GENERATION_BUCKETS buckets whose generation counters live next to
+    it, in the same backend at LOCATION/generations, where nothing else
+    is written and so nothing is culled: every write stamps the bucket of
+    the key with a new generation, and a local copy is only served while
+    its bucket generation is current. Processes reread the counters at
+    most every GENERATION_INTERVAL seconds, which bounds how long
+    another process can serve a value overwritten elsewhere.
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        shared = options.get('SHARED', {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location,
+            'OPTIONS': {
+                'MAX_ENTRIES': options.get('SHARED_MAX_ENTRIES', 100000),
+                'CULL_FREQUENCY': options.get('SHARED_CULL_FREQUENCY', 10),
+            },
+        })
+        self.shared = import_string(shared['BACKEND'])(
+            shared.get('LOCATION', ''), shared
+        )
+        self.buckets = options.get('GENERATION_BUCKETS', 64)
+        generations = {
+            'BACKEND': shared['BACKEND'],
+            'LOCATION': os.path.join(
+                shared.get('LOCATION', ''), 'generations'
+            ),
+            # Room for every counter: a cull would unstamp local copies.
+            'OPTIONS': {'MAX_ENTRIES': 2 * self.buckets},
+        }
+        self.generations = import_string(generations['BACKEND'])(
+            generations['LOCATION'], generations
+        )
+        self.local = LocalTier(
+            options.get('LOCAL_MAX_ENTRIES', 1000),
+            options.get('LOCAL_MAX_BYTES', 16 * 1024 * 1024),
+        )
+        self.interval = options.get('GENERATION_INTERVAL', 1.0)
+        self._generations = None
+        self._checked = 0
+        self._stats = Counter()
+
+    def _bucket(self, key):
+        return zlib.crc32(key.encode()) % self.buckets
+
+    def _current_generations(self):
+        now = time.monotonic()
+        if self._generations is None or now - self._checked >= self.interval:
+            keys = [GENERATION_KEY.format(i) for i in range(self.buckets)]
+            found = self.generations.get_many(keys)
+            self._generations = [found.get(key) for key in keys]
+            self._checked = now
+        return self._generations
+
+    def _invalidate(self, keys):
+        """Announce new values of the keys to every process."""
+        return self._announce({self._bucket(key) for key in keys})
+
+    def _announce(self, buckets):
+        generation = time.time_ns()
+        self.generations.set_many(
+            {GENERATION_KEY.format(bucket): generation for bucket in buckets},
+            timeout=None,
+        )
+        generations = list(self._current_generations())
+        for bucket in buckets:
+            generations[bucket] = generation
+        self._generations = generations
+        return generations
+
+    def _shared_timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def _fetch(self, keys):
+        """Pickled values of the keys, from the local tier where current."""
+        generations = self._current_generations()
+        now = time.time()
+        found, wanted = {}, []
+        for key in keys:
+            entry = self.local.get(key)
+            if entry is not None:
+                expires, generation, data = entry
+                if (
+                    generation == generations[self._bucket(key)]
+                    and (expires is None or expires > now)
+                ):
+                    self._stats['local_hits'] += 1
+                    found[key] = data
+                    continue
+                self.local.delete(key)
+            self._stats['local_misses'] += 1
+            wanted.append(key)
+        shared = self.shared.get_many(wanted) if wanted else {}
+        for key in wanted:
+            if key not in shared:
+                self._stats['shared_misses'] += 1
+                continue
+            self._stats['shared_hits'] += 1
+            expires, data = shared[key]
+            self.local.set(
+                key, expires, generations[self._bucket(key)], data
+            )
+            found[key] = data
+        return found
+
+    def _pack(self, data, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return {
+            key: (expires, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+            for key, value in data.items()
+        }
+
+    def _keep(self, packed, generations):
+        for key, (expires, data) in packed.items():
+            self.local.set(key, expires, generations[self._bucket(key)], data)
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        data = self._fetch([key]).get(key)
+        if data is None:
+            return default
+        return pickle.loads(data)
+
+    def get_many(self, keys, version=None):
+        made = {self.make_key(key, version=version): key for key in keys}
+        for key in made:
+            self.validate_key(key)
+        return {
+            made[key]: pickle.loads(data)
+            for key, data in self._fetch(list(made)).items()
+        }
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout=timeout, version=version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        data = {
+            self.make_key(key, version=version): value
+            for key, value in data.items()
+        }
+        for key in data:
+            self.validate_key(key)
+        if not data:
+            return []
+        packed = self._pack(data, timeout)
+        self.shared.set_many(packed, timeout=self._shared_timeout(timeout))
+        self._keep(packed, self._invalidate(packed))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # The shared tier decides, so that locks work across processes.
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        packed = self._pack({key: value}, timeout)
+        if not self.shared.add(
+            key, packed[key], timeout=self._shared_timeout(timeout)
+        ):
+            self.local.delete(key)
+            return False
+        self._keep(packed, self._invalidate(packed))
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        value = self.get(key, MISSING, version=version)
+        if value is MISSING:
+            return False
+        self.set(key, value, timeout=timeout, version=version)
+        return True
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = [self.make_key(key, version=version) for key in keys]
+        for key in keys:
+            self.validate_key(key)
+            self.local.delete(key)
+        if keys:
+            self.shared.delete_many(keys)
+            self._invalidate(keys)
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+        self._generations = None
+        self._announce(range(self.buckets))
+
+    def close(self, **kwargs):
+        self.shared.close(**kwargs)
+        self.generations.close(**kwargs)
+
+    def stats(self):
+        """Hit and miss counts of both tiers in this process."""
+        return {
+            'local': {
+                'hits': self._stats['local_hits'],
+                'misses': self._stats['local_misses'],
+                'entries': len(self.local),
+                'bytes': self.local.size,
+                'evictions': self.local.evictions,
+            },
+            'shared': {
+                'hits': self._stats['shared_hits'],
+                'misses': self._stats['shared_misses'],
+            },
+        }
@@ -0,0 +1,99 @@
+import logging
+import re
+import sqlite3
+from contextlib import closing
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PRAGMA_VALUE_RE = re.compile(r'^-?\w+$')
+# Names PRAGMA reads back as numbers, however they were set.
+SYNCHRONOUS = {'0': 'off', '1': 'normal', '2': 'full', '3': 'extra'}
+TEMP_STORE = {'0': 'default', '1': 'file', '2': 'memory'}
+
+_checked = set()
+
+
+def _normalized(name, value):
+    value = str(value).lower()
+    if name == 'synchronous':
+        return SYNCHRONOUS.get(value, value)
+    if name == 'temp_store':
+        return TEMP_STORE.get(value, value)
+    return value
+
+
+def is_in_memory(connection):
+    name = connection.settings_dict['NAME']
+    return not name or name == ':memory:' or 'mode=memory' in str(name)
+
+
+def effective_pragmas(connection):
+    """Values the connection reads back for the SQLITE_PRAGMAS."""
+    values = {}
+    with connection.cursor() as cursor:
+        for name in settings.SQLITE_PRAGMAS:
+            cursor.execute(f'PRAGMA {name}')
+            row = cursor.fetchone()
+            values[name] = _normalized(name, row[0] if row else None)
+    return values
+
+
+def apply_pragmas(sender, connection, **kwargs):
+    """connection_created receiver setting SQLITE_PRAGMAS on SQLite.
+
+    Connections live for CONN_MAX_AGE, so this runs once per connection,
+    not per request. The first connection of the process to every
+    database also reports what is in effect.
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            if not PRAGMA_VALUE_RE.match(str(value)):
+                raise ValueError(f'Bad value of SQLite pragma {name}: {value}')
+            cursor.execute(f'PRAGMA {name} = {value}')
+    if connection.alias not in _checked:
+        _checked.add(connection.alias)
+        check_pragmas(connection)
+
+
+def check_pragmas(connection):
+    """Log the effective settings and warn about those not applied.
+
+    An in-memory database, as in tests, has no WAL and no mmap.
+    """
+    effective = effective_pragmas(connection)
+    logger.info(
+        'SQLite %s, CONN_MAX_AGE=%s: %s',
+        connection.alias,
+        connection.settings_dict.get('CONN_MAX_AGE'),
+        ', '.join(f'{name}={value}' for name, value in effective.items()),
+    )
+    skipped = set()
+    if is_in_memory(connection):
+        skipped = {'journal_mode', 'mmap_size'}
+    mismatches = {
+        name: value for name, value in effective.items()
+        if name not in skipped
+        and value != _normalized(name, settings.SQLITE_PRAGMAS[name])
+    }
+    for name, value in mismatches.items():
+        logger.warning(
+            'SQLite %s: %s is %s, not %s', connection.alias, name, value,
+            settings.SQLITE_PRAGMAS[name],
+        )
+    return mismatches
+
+
+def copy_database(source, target, pages=1024):
+    """Copy the SQLite file ``source`` over ``target`` in one snapshot.
+
+    The online backup API copies ``pages`` pages per step without
+    blocking writers of the source for long, and readers of the target
+    see either the old copy or the new one.
+    """
+    with closing(sqlite3.connect(source)) as src, \
+            closing(sqlite3.connect(target)) as dst:
+        src.backup(dst, pages=pages)
@@ -0,0 +1,6 @@
+def microcache(ttl):
+    """Let MicrocacheMiddleware serve anonymous GETs of the view for ttl."""
+    def decorator(view_func):
+        view_func.microcache_ttl = ttl
+        return view_func
+    return decorator
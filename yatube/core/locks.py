@@ -0,0 +1,52 @@
+import os
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+def _path(name):
+    return os.path.join(settings.LOCK_DIR, name)
+
+
+def acquire(name, ttl):
+    """Take the lock ``name`` for the processes of this host.
+
+    The lock is a file created with O_EXCL, which fails atomically when
+    another process has created it, unlike an add() to a file cache
+    checking for the key before writing it. A lock older than ``ttl``
+    seconds is taken as left by a holder that died, and broken. Returns
+    whether the lock was taken.
+    """
+    path = _path(name)
+    os.makedirs(settings.LOCK_DIR, exist_ok=True)
+    for _ in range(2):
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if os.path.getmtime(path) + ttl > time.time():
+                    return False
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+    return False
+
+
+def release(name):
+    try:
+        os.unlink(_path(name))
+    except FileNotFoundError:
+        pass
+
+
+@contextmanager
+def locked(name, ttl):
+    """Hold the lock ``name``, waiting for it as long as it is held."""
+    while not acquire(name, ttl):
+        time.sleep(0.01)
+    try:
+        yield
+    finally:
+        release(name)
@@ -0,0 +1,168 @@
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+from core import locks, routers
+from core.queries import QueryBudgetExceeded, QueryRecorder
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'primary_until'
+
+
+class ReplicaMiddleware:
+    """Send the reads of GET requests to DATABASE_REPLICAS.
+
+    A response to a request that wrote sets a cookie keeping the browser
+    on the primary for REPLICA_PIN_SECONDS, two REPLICA_REFRESH_INTERVAL
+    by default, until the replicas are copied again, so users read their
+    own writes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            pinned = float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            pinned = False
+        enabled = request.method in ('GET', 'HEAD') and not pinned
+        with routers.replica_reads(enabled):
+            response = self.get_response(request)
+            wrote = routers.wrote()
+        if wrote and settings.DATABASE_REPLICAS:
+            response.set_cookie(
+                PIN_COOKIE,
+                str(time.time() + settings.REPLICA_PIN_SECONDS),
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
+
+
+class QueryBudgetMiddleware:
+    """Checks each view against settings.QUERY_BUDGETS.
+
+    The budgets are for one database and are multiplied by the number of
+    databases QUERY_BUDGET_DATABASES returns, that sharded and archived
+    feeds read one after another. Overruns and repeated statement shapes
+    (N+1) are logged in production and raised when QUERY_BUDGET_RAISE is
+    on, as in the test settings, so tests fail on them.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is None:
+            return response
+        budget = settings.QUERY_BUDGETS.get(match.view_name)
+        if budget is not None:
+            budget *= len(import_string(settings.QUERY_BUDGET_DATABASES)())
+        problems = recorder.problems(budget)
+        if problems:
+            message = f'{match.view_name} {request.path}: ' + '; '.join(
+                problems
+            )
+            if settings.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class MicrocacheMiddleware:
+    """Whole-response cache for anonymous GETs of @microcache views.
+
+    A fresh entry is served as is. An expired one is served stale for
+    MICROCACHE_STALE_TTL more seconds while the single request holding
+    the lock of the key, a core.locks file, renders the page again, so
+    an expiry costs one render instead of one per concurrent request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        key = getattr(request, 'microcache_key', None)
+        if key is not None:
+            try:
+                if self.cacheable(response):
+                    self.store(key, request.microcache_ttl, response)
+                    response['X-Microcache'] = 'MISS'
+            finally:
+                locks.release(self.lock_key(key))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        ttl = getattr(view_func, 'microcache_ttl', None)
+        if (
+            ttl is None
+            or not settings.MICROCACHE_ENABLED
+            or request.method != 'GET'
+            or request.user.is_authenticated
+        ):
+            return None
+        key = self.cache_key(request.get_full_path())
+        entry = cache.get(key)
+        if entry is not None and entry[0] > time.time():
+            return self.restore(entry, 'HIT')
+        if locks.acquire(self.lock_key(key), settings.MICROCACHE_LOCK_TTL):
+            request.microcache_key = key
+            request.microcache_ttl = ttl
+            return None
+        if entry is not None:
+            return self.restore(entry, 'STALE')
+        deadline = time.time() + settings.MICROCACHE_WAIT
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return self.restore(entry, 'HIT')
+        return None
+
+    @staticmethod
+    def cache_key(path):
+        return 'microcache:' + hashlib.md5(path.encode()).hexdigest()
+
+    @staticmethod
+    def lock_key(key):
+        return key.replace(':', '-') + '.lock'
+
+    @staticmethod
+    def cacheable(response):
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+        )
+
+    @staticmethod
+    def store(key, ttl, response):
+        entry = (
+            time.time() + ttl,
+            response.status_code,
+            list(response.items()),
+            response.content,
+        )
+        cache.set(key, entry, ttl + settings.MICROCACHE_STALE_TTL)
+
+    @staticmethod
+    def restore(entry, state):
+        _, status, headers, content = entry
+        response = HttpResponse(content, status=status)
+        for header, value in headers:
+            response[header] = value
+        response['X-Microcache'] = state
+        return response
@@ -1,6 +1,21 @@
 from django.db import models
 
 
+class RoutedQuerySet(models.QuerySet):
+    """QuerySet whose create() lets the routers see the new object.
+
+    QuerySet.create() saves on the database chosen for the model alone;
+    here, unless using() chose one, the object is saved as save() would,
+    so a router may place it by its fields.
+    """
+
+    def create(self, **kwargs):
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+
 class CreatedModel(models.Model):
     pub_date = models.DateTimeField(
         'Дата публикации',
@@ -11,3 +26,19 @@ class CreatedModel(models.Model):
     class Meta:
         abstract = True
         ordering = ('-pub_date', '-pk')
+
+
+class StoredFile(models.Model):
+    """References to a file of core.storage.ContentAddressedStorage."""
+    name = models.CharField(
+        'Файл',
+        max_length=255,
+        primary_key=True,
+    )
+    refcount = models.PositiveIntegerField(
+        'Количество ссылок',
+        default=0,
+    )
+
+    def __str__(self):
+        return self.name
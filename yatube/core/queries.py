@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+NUMBER_RE = re.compile(r'\b\d+\b')
+# EXPLAIN QUERY PLAN lines, "SCAN TABLE t" before SQLite 3.36.
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?(?: AS \w+)?(.*)$')
+TEMP_SORT = 'USE TEMP B-TREE FOR'
+
+_state = threading.local()
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def statement_shape(sql):
+    """SQL with literals collapsed, equal for every N+1 repetition."""
+    shape = IN_LIST_RE.sub('IN (...)', sql)
+    return NUMBER_RE.sub('?', ' '.join(shape.split()))
+
+
+class QueryRecorder:
+    """execute_wrapper that remembers every statement run inside record().
+
+    Statements are kept with the database they ran on: the same one run
+    once on each of several databases is not an N+1.
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if getattr(_state, 'unbudgeted', False):
+            return execute(sql, params, many, context)
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                (sql, time.monotonic() - start, context['connection'].alias)
+            )
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def __len__(self):
+        return len(self.queries)
+
+    def repeated(self, threshold=None):
+        """Statement shapes run at least threshold times: likely N+1."""
+        if threshold is None:
+            threshold = settings.QUERY_BUDGET_REPEAT_THRESHOLD
+        shapes = Counter(
+            (alias, statement_shape(sql)) for sql, _, alias in self.queries
+        )
+        return {
+            shape: times for (_, shape), times in shapes.items()
+            if times >= threshold
+        }
+
+    def problems(self, budget=None):
+        problems = []
+        if budget is not None and len(self) > budget:
+            problems.append(
+                f'{len(self)} queries, budget is {budget}'
+            )
+        for shape, times in self.repeated().items():
+            problems.append(f'N+1: {times} x {shape}')
+        return problems
+
+
+@contextmanager
+def unbudgeted():
+    """Leave the queries of the block out of the budgets being recorded.
+
+    For work done in the request only because MEDIA_BACKGROUND is off,
+    which a worker process does otherwise.
+    """
+    previous = getattr(_state, 'unbudgeted', False)
+    _state.unbudgeted = True
+    try:
+        yield
+    finally:
+        _state.unbudgeted = previous
+
+
+@contextmanager
+def query_budget(budget):
+    """Fail the block when it runs more queries than allowed or N+1 ones.
+
+        with query_budget(4):
+            client.get(url)
+    """
+    recorder = QueryRecorder()
+    with recorder.record():
+        yield recorder
+    problems = recorder.problems(budget)
+    if problems:
+        raise QueryBudgetExceeded('; '.join(problems))
+
+
+def explain(sql, using='default'):
+    """Detail lines of EXPLAIN QUERY PLAN for an SQLite statement."""
+    with connections[using].cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def plan_problems(plan, tables):
+    """(kind, table, detail) of the full scans and temporary sorts.
+
+    Only scans of the given tables count; the table of a sort is not in
+    the plan and is None.
+    """
+    problems = []
+    for detail in plan:
+        match = SCAN_RE.match(detail)
+        if match is not None:
+            table, rest = match.groups()
+            if table in tables and 'INDEX' not in rest:
+                problems.append(('scan', table, detail))
+        elif detail.startswith(TEMP_SORT):
+            problems.append(('sort', None, detail))
+    return problems
+
+
+def index_columns(sql, table):
+    """Columns of an index serving the statement on the table.
+
+    A heuristic: the columns the statement compares to literals, then
+    those it orders by, in their order and direction.
+    """
+    where, _, order = sql.partition(' ORDER BY ')
+    where = where.partition(' WHERE ')[2]
+    columns = []
+    # Compared to literals only: joins and subqueries select no range.
+    for column in re.findall(
+        rf'"{table}"\."(\w+)" (?:= (?!")|IN \((?!SELECT))', where
+    ):
+        if column not in columns:
+            columns.append(column)
+    for term in order.split(', ') if order else []:
+        # Only a leading run of the table's own columns can be indexed.
+        match = re.match(rf'"{table}"\."(\w+)" (ASC|DESC)', term.strip())
+        if match is None:
+            break
+        column, direction = match.groups()
+        if column not in columns:
+            columns.append(column)
+            if direction == 'DESC':
+                columns[-1] += ' DESC'
+    return columns
+
+
+def order_tables(sql):
+    """Tables of the ORDER BY columns of a statement."""
+    order = sql.partition(' ORDER BY ')[2]
+    return sorted(set(re.findall(r'"(\w+)"\."\w+" (?:ASC|DESC)', order)))
+
+
+def covered(columns, indexes):
+    """Whether an index starts with the columns, directions ignored."""
+    names = [column.split()[0] for column in columns]
+    return any(index[:len(names)] == names for index in indexes)
@@ -0,0 +1,115 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+WRITTEN_KEY = 'replicas-written'
+REFRESHED_KEY = 'replica-refreshed:{}'
+
+_state = threading.local()
+
+
+def written():
+    """Note a committed write that cached pages were invalidated for.
+
+    Replicas copied before it would render the old rows under the new
+    version stamps, so reads stay on the primary until the next copy.
+    """
+    if settings.DATABASE_REPLICAS:
+        cache.set(WRITTEN_KEY, time.time(), timeout=None)
+
+
+def refreshed(alias, since):
+    """Note that the replica holds every write committed before ``since``."""
+    cache.set(REFRESHED_KEY.format(alias), since, timeout=None)
+
+
+def fresh_replicas():
+    """The DATABASE_REPLICAS copied since the last noted write."""
+    keys = {
+        REFRESHED_KEY.format(alias): alias
+        for alias in settings.DATABASE_REPLICAS
+    }
+    if not keys:
+        return []
+    found = cache.get_many([WRITTEN_KEY, *keys])
+    if WRITTEN_KEY not in found:
+        # Lost with the cache: none is known to be fresh until copied.
+        cache.add(WRITTEN_KEY, time.time(), timeout=None)
+        return []
+    return [
+        alias for key, alias in keys.items()
+        if found.get(key, 0) >= found[WRITTEN_KEY]
+    ]
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Let reads in the block go to fresh replicas and track writes.
+
+    ReplicaMiddleware enables it for GET requests of sessions that did
+    not write lately. Elsewhere (POST requests, commands, workers) every
+    query stays on the primary, which is always up to date.
+    """
+    _state.replicas = fresh_replicas() if enabled else []
+    _state.wrote = False
+    try:
+        yield _state
+    finally:
+        _state.replicas = []
+
+
+def wrote():
+    """Whether a write was routed since replica_reads() began."""
+    return getattr(_state, 'wrote', False)
+
+
+class ReplicaRouter:
+    """Writes to the primary, reads to a random replica when allowed.
+
+    After the first write of a request, and inside transactions, reads
+    go to the primary too, so a request always sees its own writes.
+    Replicas older than the last write noted by written() are not read.
+    """
+
+    def _elsewhere(self, hints):
+        # Objects of other databases keep their relations there.
+        instance = hints.get('instance')
+        alias = instance._state.db if instance is not None else None
+        if alias in (None, DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS):
+            return None
+        return alias
+
+    def db_for_read(self, model, **hints):
+        elsewhere = self._elsewhere(hints)
+        if elsewhere:
+            return elsewhere
+        replicas = getattr(_state, 'replicas', None)
+        if (
+            not replicas
+            or getattr(_state, 'wrote', False)
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return self._elsewhere(hints) or DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas are copies of the primary: the same rows everywhere.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema with the data, from the primary.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
@@ -0,0 +1,238 @@
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+import threading
+from functools import partial
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler, TemporaryFileUploadHandler,
+)
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+from core import locks
+from core.models import StoredFile
+
+HASHED_NAME = re.compile(
+    r'^(?:(.*)/)?([0-9a-f]{2})/([0-9a-f]{2})/([0-9a-f]{64})(\.[^./]*)?$'
+)
+# Longest a save or a delete holds the lock of a stored file.
+LOCK_TTL = 30
+
+_state = threading.local()
+
+
+def _pending():
+    """Files this thread created in transactions not committed yet."""
+    if not hasattr(_state, 'pending'):
+        _state.pending = {}
+    return _state.pending
+
+
+def discard_rolled_back(**kwargs):
+    """Delete the files created by transactions since rolled back.
+
+    A commit takes its files off the pending ones, a rollback forgets
+    to, so those left once the transaction is over were rolled back.
+    Also a request_finished receiver.
+    """
+    pending = _pending()
+    if not pending or transaction.get_connection().in_atomic_block:
+        return
+    files = list(pending.items())
+    pending.clear()
+    for name, storage in files:
+        storage.discard(name)
+
+
+class HashingUploadMixin:
+    """Hash the uploaded file while its chunks arrive.
+
+    The digest is kept on the file as ``content_hash``, so that
+    ContentAddressedStorage does not have to read the file again.
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.hasher = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.content_hash = self.hasher.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(
+    HashingUploadMixin, MemoryFileUploadHandler
+):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(
+    HashingUploadMixin, TemporaryFileUploadHandler
+):
+    pass
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Files named by the SHA-256 of their content and reference-counted.
+
+    ``posts/cat.jpg`` is stored as ``posts/ab/cd/abcd….jpg``: two levels
+    of 256 directories keep every directory small, and saving a file
+    that is stored already only adds a reference to it. delete() drops
+    one reference and removes the file with the last one. Files saved
+    before, under their upload names, are not counted and are deleted
+    as usual.
+
+    The content is hashed as it is written, in a single pass, or not
+    read at all when an upload handler hashed it on arrival. Saves and
+    deletes of a stored file hold its core.locks lock, so a save never
+    references a file a delete is about to remove. A file created by a
+    transaction that is rolled back is deleted after it.
+    """
+
+    def hashed_name(self, name, digest):
+        """Name of the content with the digest, saved as ``name``."""
+        prefix, extension = self._split(name)
+        return posixpath.join(
+            prefix, digest[:2], digest[2:4], digest + extension
+        )
+
+    def _split(self, name):
+        name = name.replace('\\', '/')
+        extension = posixpath.splitext(name)[1].lower()
+        match = HASHED_NAME.match(name)
+        if match is not None and match.group(4).startswith(
+            match.group(2) + match.group(3)
+        ):
+            # A stored file saved again, e.g. rewritten in place.
+            return match.group(1) or '', extension
+        return posixpath.dirname(name), extension
+
+    def save(self, name, content, max_length=None):
+        discard_rolled_back()
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = getattr(content, 'content_hash', None)
+        if digest is not None and hasattr(content, 'temporary_file_path'):
+            name = self.hashed_name(name, digest)
+            self._make_directory(name)
+            self._put(name, partial(
+                file_move_safe, content.temporary_file_path(),
+                self.path(name), allow_overwrite=True,
+            ))
+        else:
+            name = self._store(name, content)
+        return name
+
+    def _store(self, name, content):
+        prefix, _ = self._split(name)
+        directory = self.path(prefix)
+        os.makedirs(directory, exist_ok=True)
+        hasher = hashlib.sha256()
+        fd, temporary = tempfile.mkstemp(prefix='.upload-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as stored:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    hasher.update(chunk)
+                    stored.write(chunk)
+            name = self.hashed_name(name, hasher.hexdigest())
+            self._make_directory(name)
+            # Atomic, so a concurrent reader never sees half a file.
+            self._put(name, partial(os.replace, temporary, self.path(name)))
+        finally:
+            # Left when the content was stored already.
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return name
+
+    @staticmethod
+    def lock_name(name):
+        return 'storage-' + name.replace('/', '-') + '.lock'
+
+    def _put(self, name, move):
+        """Move the content in as ``name`` unless stored, and reference it."""
+        with locks.locked(self.lock_name(name), LOCK_TTL):
+            if not self.exists(name):
+                move()
+                self._set_permissions(name)
+                self._created(name)
+            self._reference(name)
+
+    def _created(self, name):
+        if not transaction.get_connection().in_atomic_block:
+            return
+        pending = _pending()
+        pending[name] = self
+        transaction.on_commit(partial(pending.pop, name, None))
+
+    def discard(self, name):
+        """Delete the file unless it is referenced."""
+        with locks.locked(self.lock_name(name), LOCK_TTL):
+            if not StoredFile.objects.filter(name=name).exists():
+                super().delete(name)
+
+    def _make_directory(self, name):
+        directory = os.path.dirname(self.path(name))
+        if self.directory_permissions_mode is None:
+            os.makedirs(directory, exist_ok=True)
+            return
+        old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+        try:
+            os.makedirs(
+                directory, self.directory_permissions_mode, exist_ok=True
+            )
+        finally:
+            os.umask(old_umask)
+
+    def _set_permissions(self, name):
+        # Temporary files are private to their owner, stored ones are not.
+        os.chmod(self.path(name), self.file_permissions_mode or 0o644)
+
+    def _reference(self, name):
+        counted = StoredFile.objects.filter(name=name)
+        if counted.update(refcount=F('refcount') + 1):
+            return
+        try:
+            with transaction.atomic():
+                StoredFile.objects.create(name=name, refcount=1)
+        except IntegrityError:
+            # Saved concurrently by another upload of the same content.
+            counted.update(refcount=F('refcount') + 1)
+
+    def delete(self, name):
+        discard_rolled_back()
+        counted = StoredFile.objects.filter(name=name)
+        with locks.locked(self.lock_name(name), LOCK_TTL):
+            if counted.filter(refcount__gt=1).update(
+                refcount=F('refcount') - 1
+            ):
+                return
+            counted.delete()
+            super().delete(name)
+
+    def references(self, name):
+        """How many saved files share the stored one, None if not counted."""
+        return (
+            StoredFile.objects.filter(name=name)
+            .values_list('refcount', flat=True).first()
+        )
+
+
+content_storage = ContentAddressedStorage()
@@ -0,0 +1,22 @@
+from django.test import SimpleTestCase
+
+from core.bloom import BloomFilter
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_added_items_found(self):
+        """Добавленные строки всегда находятся."""
+        names = BloomFilter(1000)
+        items = [f'posts/{number}.jpg' for number in range(1000)]
+        names.update(items)
+        self.assertTrue(all(item in names for item in items))
+
+    def test_false_positives_rare(self):
+        """Ложные срабатывания не чаще заданной вероятности."""
+        names = BloomFilter(1000, error_rate=0.01)
+        names.update(f'posts/{number}.jpg' for number in range(1000))
+        found = sum(
+            f'cache/{number}.jpg' in names for number in range(10000)
+        )
+        self.assertLess(found, 200)
+        self.assertLess(len(names.bits), 1300)
@@ -0,0 +1,93 @@
+from django.test import SimpleTestCase
+
+from core.cache import GENERATION_KEY, TieredCache
+
+
+def tiered_cache(**options):
+    """Кеш процесса поверх общего LocMemCache, как у второго воркера."""
+    return TieredCache('', {
+        'OPTIONS': {
+            'SHARED': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'tiered-cache-tests',
+            },
+            **options,
+        },
+    })
+
+
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.first = tiered_cache(GENERATION_INTERVAL=0)
+        self.second = tiered_cache(GENERATION_INTERVAL=0)
+        self.first.clear()
+
+    def test_value_shared_between_processes(self):
+        """Значение, записанное одним процессом, видно другому."""
+        self.first.set('key', {'value': 1})
+        self.assertEqual(self.second.get('key'), {'value': 1})
+        self.assertEqual(self.second.get('key'), {'value': 1})
+        stats = self.second.stats()
+        self.assertEqual(stats['shared']['hits'], 1)
+        self.assertEqual(stats['local']['hits'], 1)
+        self.assertEqual(stats['local']['misses'], 1)
+
+    def test_write_invalidates_local_copies(self):
+        """Запись или удаление в одном процессе сбрасывает копии других."""
+        self.first.set('key', 'old')
+        self.second.get('key')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_generations_checked_once_per_interval(self):
+        """Счетчики поколений перечитываются не чаще интервала."""
+        lazy = tiered_cache(GENERATION_INTERVAL=3600)
+        self.first.set('key', 'old')
+        lazy.get('key')
+        self.first.set('key', 'new')
+        self.assertEqual(lazy.get('key'), 'old')
+        lazy.set('key', 'own')
+        self.assertEqual(lazy.get('key'), 'own')
+
+    def test_local_tier_is_bounded(self):
+        """Локальный уровень вытесняет давно не читанные записи."""
+        small = tiered_cache(LOCAL_MAX_ENTRIES=2, GENERATION_INTERVAL=0)
+        small.set_many({'a': 1, 'b': 2})
+        small.get('a')
+        small.set('c', 3)
+        stats = small.stats()
+        self.assertEqual(stats['local']['entries'], 2)
+        self.assertEqual(stats['local']['evictions'], 1)
+        self.assertEqual(small.get_many(['a', 'b', 'c']), {
+            'a': 1, 'b': 2, 'c': 3,
+        })
+        self.assertEqual(small.stats()['shared']['hits'], 1)
+
+    def test_add_decided_by_shared_tier(self):
+        """add() срабатывает только в одном из процессов."""
+        self.assertTrue(self.first.add('lock', True))
+        self.assertFalse(self.second.add('lock', True))
+        self.first.delete('lock')
+        self.assertTrue(self.second.add('lock', True))
+
+    def test_invalidation_survives_culls(self):
+        """Вытеснение из переполненного общего уровня не возвращает
+        старые значения."""
+        shared = {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'tiered-cache-cull-tests',
+            'OPTIONS': {'MAX_ENTRIES': 20, 'CULL_FREQUENCY': 2},
+        }
+        first = tiered_cache(SHARED=shared, GENERATION_INTERVAL=0)
+        second = tiered_cache(SHARED=shared, GENERATION_INTERVAL=0)
+        first.clear()
+        first.set('key', 'old')
+        self.assertEqual(second.get('key'), 'old')
+        first.set('key', 'new')
+        for number in range(100):
+            first.set(f'filler{number}', number)
+        self.assertNotEqual(second.get('key'), 'old')
+        keys = [GENERATION_KEY.format(i) for i in range(first.buckets)]
+        self.assertEqual(len(first.generations.get_many(keys)), len(keys))
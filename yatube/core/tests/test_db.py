@@ -0,0 +1,85 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import SimpleTestCase, override_settings
+
+from core import db
+
+WAL_PRAGMAS = {'journal_mode': 'wal', **settings.SQLITE_PRAGMAS}
+
+
+class SqlitePragmasTests(SimpleTestCase):
+    # Connections of its own, to files of its own.
+    databases = '__all__'
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.connection = DatabaseWrapper({
+            **connection.settings_dict,
+            'NAME': os.path.join(self.directory, 'db.sqlite3'),
+        }, alias='pragmas-test')
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @override_settings(SQLITE_PRAGMAS=WAL_PRAGMAS)
+    def test_pragmas_applied_to_new_connection(self):
+        """Новое соединение получает WAL и остальные настройки."""
+        self.connection.ensure_connection()
+        self.assertEqual(db.effective_pragmas(self.connection), {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'mmap_size': str(256 * 1024 * 1024),
+            'cache_size': '-64000',
+            'temp_store': 'memory',
+            'busy_timeout': '20000',
+        })
+        self.assertEqual(db.check_pragmas(self.connection), {})
+
+    def test_mismatch_reported(self):
+        """Настройка, которая не применилась, попадает в предупреждение."""
+        self.connection.ensure_connection()
+        with override_settings(SQLITE_PRAGMAS={'synchronous': 'full'}):
+            with self.assertLogs('core.db', 'WARNING') as logs:
+                mismatches = db.check_pragmas(self.connection)
+        self.assertEqual(mismatches, {'synchronous': 'normal'})
+        self.assertIn('synchronous is normal, not full', logs.output[0])
+
+    def test_bad_value_refused(self):
+        """Значение прагмы не может содержать лишний SQL."""
+        with override_settings(SQLITE_PRAGMAS={'cache_size': '1; DROP'}):
+            with self.assertRaises(ValueError):
+                self.connection.ensure_connection()
+
+    def test_journal_mode_kept(self):
+        """Без journal_mode в настройках режим журнала файла не меняется."""
+        self.connection.ensure_connection()
+        with self.connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'delete')
+
+    @override_settings(SQLITE_PRAGMAS=WAL_PRAGMAS)
+    def test_writer_not_blocked_by_reader(self):
+        """Запись не ждет, пока читающий закончит транзакцию."""
+        reader = DatabaseWrapper(
+            self.connection.settings_dict, alias='pragmas-reader'
+        )
+        self.addCleanup(reader.close)
+        with self.connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE feed (id integer)')
+            cursor.execute('INSERT INTO feed VALUES (1)')
+            cursor.execute('PRAGMA busy_timeout = 0')
+        with reader.cursor() as read:
+            read.execute('BEGIN')
+            read.execute('SELECT count(*) FROM feed')
+            with self.connection.cursor() as cursor:
+                cursor.execute('INSERT INTO feed VALUES (2)')
+            # The reader keeps its snapshot until its transaction ends.
+            read.execute('SELECT count(*) FROM feed')
+            self.assertEqual(read.fetchone()[0], 1)
+            read.execute('COMMIT')
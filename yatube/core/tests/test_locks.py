@@ -0,0 +1,27 @@
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from core import locks
+
+
+class LocksTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        settings = override_settings(LOCK_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_lock_taken_once(self):
+        """Блокировку получает только первый, до ее освобождения."""
+        self.assertTrue(locks.acquire('page.lock', 10))
+        self.assertFalse(locks.acquire('page.lock', 10))
+        locks.release('page.lock')
+        self.assertTrue(locks.acquire('page.lock', 10))
+
+    def test_expired_lock_broken(self):
+        """Блокировку, которую держат дольше ttl, можно забрать."""
+        self.assertTrue(locks.acquire('page.lock', 10))
+        self.assertTrue(locks.acquire('page.lock', 0))
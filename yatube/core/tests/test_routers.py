@@ -0,0 +1,169 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core import routers
+from core.db import copy_database
+from core.middleware import PIN_COOKIE, ReplicaMiddleware
+from posts.models import Group
+
+router = routers.ReplicaRouter()
+
+
+def refresh_replica():
+    """Реплика скопирована после последней записи."""
+    cache.clear()
+    routers.written()
+    routers.refreshed('replica', time.time())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        refresh_replica()
+
+    def test_reads_stay_on_primary_by_default(self):
+        """Вне replica_reads чтение идет в основную базу."""
+        self.assertEqual(router.db_for_read(Group), DEFAULT_DB_ALIAS)
+        with routers.replica_reads(enabled=False):
+            self.assertEqual(router.db_for_read(Group), DEFAULT_DB_ALIAS)
+
+    def test_reads_go_to_replica_until_write(self):
+        """В replica_reads чтение идет в реплику до первой записи."""
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Group), 'replica')
+            self.assertFalse(routers.wrote())
+            self.assertEqual(router.db_for_write(Group), DEFAULT_DB_ALIAS)
+            self.assertTrue(routers.wrote())
+            self.assertEqual(router.db_for_read(Group), DEFAULT_DB_ALIAS)
+        self.assertEqual(router.db_for_read(Group), DEFAULT_DB_ALIAS)
+
+    def test_stale_replica_not_read(self):
+        """Реплика, скопированная до записи, не читается до обновления."""
+        routers.written()
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Group), DEFAULT_DB_ALIAS)
+        routers.refreshed('replica', time.time())
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Group), 'replica')
+        cache.clear()
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Group), DEFAULT_DB_ALIAS)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        """Без реплик все идет в основную базу."""
+        with routers.replica_reads():
+            self.assertEqual(router.db_for_read(Group), DEFAULT_DB_ALIAS)
+
+    def test_other_database_kept(self):
+        """Связи объекта из другой базы читаются и пишутся там же."""
+        group = Group(slug='group')
+        group._state.db = 'other'
+        with routers.replica_reads():
+            self.assertEqual(
+                router.db_for_read(Group, instance=group), 'other'
+            )
+            self.assertEqual(
+                router.db_for_write(Group, instance=group), 'other'
+            )
+
+    def test_relations_and_migrations(self):
+        """Реплики связаны с основной базой, но не мигрируются."""
+        group = Group(slug='group')
+        group._state.db = DEFAULT_DB_ALIAS
+        copy = Group(slug='copy')
+        copy._state.db = 'replica'
+        self.assertTrue(router.allow_relation(group, copy))
+        self.assertFalse(router.allow_migrate('replica', 'posts'))
+        self.assertIsNone(router.allow_migrate(DEFAULT_DB_ALIAS, 'posts'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=5)
+class ReplicaMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        refresh_replica()
+
+    def run_request(self, method='get', write=False, cookies=None):
+        used = []
+
+        def view(request):
+            used.append(router.db_for_read(Group))
+            if write:
+                router.db_for_write(Group)
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        response = ReplicaMiddleware(view)(request)
+        return used[0], response
+
+    def test_get_reads_replica(self):
+        """GET без записи читает из реплики и не закрепляется."""
+        database, response = self.run_request()
+        self.assertEqual(database, 'replica')
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_post_reads_primary(self):
+        """POST читает из основной базы."""
+        database, _ = self.run_request('post')
+        self.assertEqual(database, DEFAULT_DB_ALIAS)
+
+    def test_write_pins_to_primary(self):
+        """После записи браузер читает из основной базы, пока не истечет
+        срок закрепления."""
+        _, response = self.run_request('post', write=True)
+        cookie = response.cookies[PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+        database, _ = self.run_request(cookies={PIN_COOKIE: cookie.value})
+        self.assertEqual(database, DEFAULT_DB_ALIAS)
+        expired = str(time.time() - 1)
+        database, _ = self.run_request(cookies={PIN_COOKIE: expired})
+        self.assertEqual(database, 'replica')
+        database, _ = self.run_request(cookies={PIN_COOKIE: 'junk'})
+        self.assertEqual(database, 'replica')
+
+
+class RefreshReplicasTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source = os.path.join(self.directory, 'primary.sqlite3')
+        self.target = os.path.join(self.directory, 'replica.sqlite3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_copy_database(self):
+        """Реплика получает снимок основной базы поверх старых данных."""
+        with closing(sqlite3.connect(self.target)) as target:
+            target.execute('CREATE TABLE stale (id INTEGER)')
+        with closing(sqlite3.connect(self.source)) as source:
+            source.execute('CREATE TABLE post (text TEXT)')
+            source.execute("INSERT INTO post VALUES ('Текст')")
+            source.commit()
+        copy_database(self.source, self.target)
+        with closing(sqlite3.connect(self.target)) as target:
+            self.assertEqual(
+                target.execute('SELECT name FROM sqlite_master').fetchall(),
+                [('post',)],
+            )
+            self.assertEqual(
+                target.execute('SELECT text FROM post').fetchall(),
+                [('Текст',)],
+            )
+
+    def test_primary_is_not_a_replica(self):
+        """Основную базу нельзя перезаписать как реплику."""
+        with self.assertRaises(CommandError):
+            call_command('refresh_replicas', DEFAULT_DB_ALIAS)
+        with self.assertRaises(CommandError):
+            call_command('refresh_replicas', 'missing')
@@ -0,0 +1,158 @@
+import os
+import shutil
+import tempfile
+import threading
+from hashlib import sha256
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import (
+    SimpleUploadedFile, TemporaryUploadedFile,
+)
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from core import locks, storage
+from core.models import StoredFile
+from core.storage import (
+    ContentAddressedStorage, HashingMemoryFileUploadHandler,
+)
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+CONTENT = b'content of the picture'
+DIGEST = sha256(CONTENT).hexdigest()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.storage = ContentAddressedStorage()
+
+    def test_named_by_content_hash(self):
+        """Файл хранится под хешем содержимого во вложенных каталогах."""
+        name = self.storage.save('posts/cat.JPG', ContentFile(CONTENT))
+        self.assertEqual(
+            name, f'posts/{DIGEST[:2]}/{DIGEST[2:4]}/{DIGEST}.jpg'
+        )
+        with self.storage.open(name) as stored:
+            self.assertEqual(stored.read(), CONTENT)
+        self.assertEqual(
+            [entry for entry in os.listdir(self.storage.path('posts'))
+             if entry.startswith('.')],
+            [],
+        )
+
+    def test_duplicates_share_one_file(self):
+        """Одинаковые файлы хранятся один раз и считаются ссылками."""
+        first = self.storage.save('posts/cat.jpg', ContentFile(CONTENT))
+        second = self.storage.save('posts/copy.jpg', ContentFile(CONTENT))
+        self.assertEqual(first, second)
+        self.assertEqual(self.storage.references(first), 2)
+        self.storage.delete(first)
+        self.assertTrue(self.storage.exists(first))
+        self.assertEqual(self.storage.references(first), 1)
+        self.storage.delete(first)
+        self.assertFalse(self.storage.exists(first))
+        self.assertFalse(StoredFile.objects.filter(name=first).exists())
+
+    def test_stored_name_saved_again(self):
+        """Сохранение под хешированным именем не вкладывает каталоги."""
+        name = self.storage.save('posts/cat.jpg', ContentFile(CONTENT))
+        other = self.storage.save(name, ContentFile(b'other content'))
+        self.assertTrue(other.startswith('posts/'))
+        self.assertEqual(other.count('/'), 3)
+
+    def test_upload_hashed_on_arrival(self):
+        """Загружаемый файл хешируется по мере получения частей."""
+        handler = HashingMemoryFileUploadHandler()
+        handler.handle_raw_input(None, {}, len(CONTENT), None)
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('image', 'cat.jpg', 'image/jpeg', len(CONTENT))
+        handler.receive_data_chunk(CONTENT[:5], 0)
+        handler.receive_data_chunk(CONTENT[5:], 5)
+        uploaded = handler.file_complete(len(CONTENT))
+        self.assertEqual(uploaded.content_hash, DIGEST)
+
+    def test_untracked_file_deleted(self):
+        """Файлы, загруженные до хеширования, удаляются как обычно."""
+        path = self.storage.path('posts/old.gif')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as old:
+            old.write(CONTENT)
+        self.assertIsNone(self.storage.references('posts/old.gif'))
+        self.storage.delete('posts/old.gif')
+        self.assertFalse(os.path.exists(path))
+
+    def test_uploaded_file_saved(self):
+        """Загруженный через форму файл сохраняется под хешем."""
+        uploaded = SimpleUploadedFile('cat.jpg', CONTENT)
+        name = self.storage.save('posts/cat.jpg', uploaded)
+        self.assertTrue(name.endswith(f'{DIGEST}.jpg'))
+
+    def test_hashed_temporary_upload_moved(self):
+        """Хешированный при загрузке временный файл не читается заново."""
+        uploaded = TemporaryUploadedFile(
+            'cat.jpg', 'image/jpeg', len(CONTENT), None
+        )
+        uploaded.write(CONTENT)
+        uploaded.flush()
+        uploaded.content_hash = DIGEST
+        with mock.patch.object(
+            uploaded, 'chunks', side_effect=AssertionError
+        ):
+            name = self.storage.save('posts/cat.jpg', uploaded)
+        self.assertFalse(os.path.exists(uploaded.temporary_file_path()))
+        uploaded.close()
+        with self.storage.open(name) as stored:
+            self.assertEqual(stored.read(), CONTENT)
+
+
+class ContentAddressedStorageTransactionTests(TransactionTestCase):
+    def setUp(self):
+        # Files outlive the rows TransactionTestCase flushes.
+        directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        media_root = override_settings(MEDIA_ROOT=directory)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.storage = ContentAddressedStorage()
+
+    def test_file_of_rolled_back_upload_deleted(self):
+        """Файл отмененной транзакции удаляется, сохраненной - остается."""
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                name = self.storage.save(
+                    'posts/cat.jpg', ContentFile(CONTENT)
+                )
+                raise RuntimeError
+        self.assertTrue(self.storage.exists(name))
+        storage.discard_rolled_back()
+        self.assertFalse(self.storage.exists(name))
+        with transaction.atomic():
+            name = self.storage.save('posts/cat.jpg', ContentFile(CONTENT))
+        storage.discard_rolled_back()
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.references(name), 1)
+
+    def test_delete_waits_for_save(self):
+        """Удаление ждет, пока сохранение того же файла не закончится."""
+        name = self.storage.save('posts/cat.jpg', ContentFile(CONTENT))
+        lock = self.storage.lock_name(name)
+        locks.acquire(lock, storage.LOCK_TTL)
+        deleting = threading.Thread(target=self.storage.delete, args=[name])
+        deleting.start()
+        deleting.join(0.2)
+        self.assertTrue(deleting.is_alive())
+        # The save holding the lock adds its reference.
+        StoredFile.objects.filter(name=name).update(refcount=2)
+        locks.release(lock)
+        deleting.join()
+        self.assertTrue(self.storage.exists(name))
+        self.assertEqual(self.storage.references(name), 1)
@@ -0,0 +1,113 @@
+import os
+import shutil
+import tempfile
+from http import HTTPStatus
+
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+HASHED = 'posts/ab/cd/' + 'abcd' * 16 + '.txt'
+CONTENT = b'0123456789'
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, MEDIA_SENDFILE=None)
+class ServeMediaTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name in (HASHED, 'img/avatars/plain.txt'):
+            path = os.path.join(TEMP_MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as media_file:
+                media_file.write(CONTENT)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def get(self, name, **headers):
+        return self.client.get(
+            reverse('media', kwargs={'path': name}), **headers
+        )
+
+    def test_whole_file(self):
+        """Файл отдается целиком с валидаторами и типом."""
+        response = self.get(HASHED)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response['Content-Length'], str(len(CONTENT)))
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_plain_name_revalidated(self):
+        """Файл без хеша в имени кешируется ненадолго."""
+        response = self.get('img/avatars/plain.txt')
+        self.assertEqual(
+            response['Cache-Control'],
+            f'public, max-age={settings.MEDIA_MAX_AGE}',
+        )
+
+    def test_not_modified(self):
+        """Повторный запрос с ETag получает 304."""
+        etag = self.get(HASHED)['ETag']
+        response = self.get(HASHED, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_byte_range(self):
+        """Запрос диапазона получает только его."""
+        response = self.get(HASHED, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, HTTPStatus.PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+        response = self.get(HASHED, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+    def test_range_not_satisfiable(self):
+        """Диапазон за концом файла получает 416."""
+        response = self.get(HASHED, HTTP_RANGE='bytes=20-')
+        self.assertEqual(
+            response.status_code, HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+    def test_stale_if_range(self):
+        """Диапазон устаревшей версии файла не отдается."""
+        response = self.get(
+            HASHED, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"other"'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_missing_and_outside_files(self):
+        """Несуществующие файлы и пути вне MEDIA_ROOT дают 404."""
+        self.assertEqual(
+            self.get('posts/missing.txt').status_code, HTTPStatus.NOT_FOUND
+        )
+        self.assertEqual(
+            self.get('../settings.py').status_code, HTTPStatus.NOT_FOUND
+        )
+        self.assertEqual(self.get('posts').status_code, HTTPStatus.NOT_FOUND)
+
+    @override_settings(MEDIA_SENDFILE='x-accel-redirect')
+    def test_accel_redirect(self):
+        """За nginx файл отдает он по X-Accel-Redirect."""
+        response = self.get(HASHED)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            settings.MEDIA_ACCEL_PREFIX + HASHED,
+        )
+        self.assertEqual(response.content, b'')
+        self.assertTrue(response.has_header('ETag'))
+
+    @override_settings(MEDIA_SENDFILE='x-sendfile')
+    def test_sendfile(self):
+        """За Apache файл отдает он по X-Sendfile."""
+        response = self.get(HASHED)
+        self.assertEqual(
+            response['X-Sendfile'], os.path.join(TEMP_MEDIA_ROOT, HASHED)
+        )
@@ -1,6 +1,22 @@
+import mimetypes
+import os
+import re
 from http import HTTPStatus
+from stat import S_ISREG
+from urllib.parse import quote
 
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotAllowed,
+)
 from django.shortcuts import render
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+# Content-addressed uploads and sorl thumbnails are named by a hash.
+HASHED_PATH = re.compile(r'(^|/)[0-9a-f]{32,}(\.|/|$)')
 
 
 def page_not_found(request, exception):
@@ -24,3 +40,135 @@ def server_error(request):
 
 def permission_denied(request, exception):
     return render(request, 'core/403.html', status=HTTPStatus.FORBIDDEN)
+
+
+class FileRange:
+    """Read at most ``length`` bytes of an open file from ``start``."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def _byte_range(header, size):
+    """(start, end) of a single ``bytes=`` range, None for the whole file.
+
+    Raises ValueError for a range outside the file. Several ranges are
+    answered with the whole file, as RFC 7233 allows.
+    """
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size - 1
+        else:
+            start, end = size - int(last), size - 1
+    except ValueError:
+        return None
+    start, end = max(start, 0), min(end, size - 1)
+    if start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _cache_control(path):
+    if HASHED_PATH.search(path):
+        # The name changes with the content: cache it for good.
+        return 'public, max-age=31536000, immutable'
+    return f'public, max-age={settings.MEDIA_MAX_AGE}'
+
+
+def serve_media(request, path):
+    """Files of MEDIA_ROOT, for when no front-end server serves them.
+
+    Whole files go out as a FileResponse, which WSGI servers send with
+    sendfile(). Single byte ranges, conditional requests on an ETag and
+    Last-Modified made from the file stats, and long-lived caching of
+    content-hashed names are supported. With MEDIA_SENDFILE set, the
+    front-end server is told to send the file instead.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not S_ISREG(stat.st_mode):
+        raise Http404
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': _cache_control(path),
+        'Accept-Ranges': 'bytes',
+    }
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        ranged = not if_range or if_range in (
+            etag, headers['Last-Modified']
+        )
+        response = _file_response(
+            request, full_path, path, stat.st_size, ranged
+        )
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def _file_response(request, full_path, path, size, ranged):
+    content_type = (
+        mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    )
+    sendfile = settings.MEDIA_SENDFILE
+    if sendfile == 'x-accel-redirect':
+        # nginx serves ranges itself from an internal location.
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(
+            settings.MEDIA_ACCEL_PREFIX + path
+        )
+        return response
+    if sendfile == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = full_path
+        return response
+    byte_range = None
+    header = request.META.get('HTTP_RANGE')
+    if header and size and ranged:
+        try:
+            byte_range = _byte_range(header, size)
+        except ValueError:
+            response = HttpResponse(
+                status=HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+            )
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+    if byte_range is None:
+        return FileResponse(open(full_path, 'rb'), content_type=content_type)
+    start, end = byte_range
+    response = FileResponse(
+        FileRange(open(full_path, 'rb'), start, end - start + 1),
+        status=HTTPStatus.PARTIAL_CONTENT,
+        content_type=content_type,
+    )
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from posts.models import Comment, Follow, Group, Post, Profile
+from posts.models import (
+    Comment, Follow, Group, ImageVariant, Post, Profile, UserStats,
+)
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -8,6 +10,7 @@ class PostAdmin(admin.ModelAdmin):
         'pk',
         'text',
         'pub_date',
+        'updated_at',
         'author',
         'group',
     )
@@ -22,3 +25,5 @@ admin.site.register(Comment)
 admin.site.register(Group)
 admin.site.register(Follow)
 admin.site.register(Profile)
+admin.site.register(UserStats)
+admin.site.register(ImageVariant)
@@ -0,0 +1,36 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from posts import shards
+from posts.models import Post
+
+
+def archive_posts(days=None, batch_size=500, report=None):
+    """Move posts older than ``days`` to POST_ARCHIVE with their comments.
+
+    Posts go oldest first, ``batch_size`` at a time, each batch copied
+    and then deleted, so the run may be stopped at any point. Comments
+    stay with their post whatever their age. ``report`` is called with
+    the database and the number of posts of every batch. Returns the
+    posts moved from each database.
+    """
+    if days is None:
+        days = settings.POST_ARCHIVE_AFTER_DAYS
+    cutoff = timezone.now() - timedelta(days=days)
+    moved = Counter()
+    for source in shards.databases():
+        while True:
+            posts = list(
+                Post.objects.using(source).filter(pub_date__lt=cutoff)
+                .order_by('pub_date', 'pk')[:batch_size]
+            )
+            if not posts:
+                break
+            shards.move_posts(posts, source, settings.POST_ARCHIVE)
+            moved[source] += len(posts)
+            if report is not None:
+                report(source, len(posts))
+    return moved
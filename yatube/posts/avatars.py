@@ -0,0 +1,55 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+
+from posts import variants
+from posts.models import Profile
+
+logger = logging.getLogger(__name__)
+
+AVATAR_KEY = 'header-avatar:{}'
+
+
+def prerender(avatar):
+    """Make every variant of the avatar now, not on its first request."""
+    for width in variants.variant_widths(avatar, 'avatar'):
+        for fmt in variants.FORMATS:
+            try:
+                variants.make_variant('avatar', width, fmt, avatar.name)
+            except Exception:
+                logger.exception('Variant of avatar %s failed', avatar.name)
+
+
+def _header_avatar(user_id):
+    profile = (
+        Profile.objects.filter(user_id=user_id)
+        .only('avatar', 'avatar_width', 'avatar_height').first()
+    )
+    if profile is None or not profile.avatar:
+        return None
+    urls = variants.variant_urls([profile.avatar], 'avatar')[
+        profile.avatar.name
+    ]
+    avatar = {fmt: variants.srcset(fmt_urls) for fmt, fmt_urls in urls.items()}
+    # The smallest JPEG for browsers without srcset.
+    avatar['src'] = urls['jpeg'][0][1]
+    return avatar
+
+
+def header_avatar(user_id):
+    """src and srcsets of the small avatar sizes of the user, or None.
+
+    Cached per user, so the header costs no query on most pages.
+    """
+    key = AVATAR_KEY.format(user_id)
+    avatar = cache.get(key)
+    if avatar is None:
+        # Users without an avatar are cached too, as an empty dict.
+        avatar = _header_avatar(user_id) or {}
+        cache.set(key, avatar, settings.AVATAR_CACHE_TIMEOUT)
+    return avatar or None
+
+
+def forget(user_id):
+    cache.delete(AVATAR_KEY.format(user_id))
@@ -0,0 +1,194 @@
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+
+from core import routers
+from posts import shards
+from posts.models import Follow
+
+VERSION_KEY = 'feed-version:{}'
+FOLLOWED_CHECKED_KEY = 'followed-checked:{}'
+LAST_CHANGE_KEY = 'last-change:{}'
+
+
+def scope(*parts):
+    return ':'.join(str(part) for part in parts)
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """Version stamps of the scopes, milliseconds of their last change.
+
+    A stamp evicted from the cache comes back as the current time, so an
+    old fragment can never be matched again.
+    """
+    keys = [VERSION_KEY.format(name) for name in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: _now_ms() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    keys = [VERSION_KEY.format(name) for name in set(scopes)]
+    if not keys:
+        return
+    now = _now_ms()
+    current = cache.get_many(keys)
+    cache.set_many(
+        {key: max(now, current.get(key, 0) + 1) for key in keys},
+        timeout=None,
+    )
+    routers.written()
+
+
+def post_scopes(post):
+    """Every feed a post is shown in."""
+    scopes = [
+        scope('global'),
+        scope('author', post.author_id),
+        scope('post', post.pk),
+    ]
+    for group_id in {post.group_id, getattr(post, '_loaded_group_id', None)}:
+        if group_id is not None:
+            scopes.append(scope('group', group_id))
+    return scopes
+
+
+def follow_feed_scopes(user, author_ids=None):
+    """The follows of the user and one stamp of the authors followed.
+
+    Follow feeds are versioned by the authors in them, so a post bumps
+    its author alone, however many followers read it. The newest stamp
+    of the authors is kept as the "followed" stamp of the user and
+    looked up again at most every FOLLOW_STAMP_TTL seconds: a feed
+    costs two stamps, and the posts show up in it that much later.
+    ``author_ids`` is the queryset of the authors, when the caller has
+    one to reuse.
+    """
+    followed = scope('followed', user.pk)
+    if cache.add(
+        FOLLOWED_CHECKED_KEY.format(user.pk), True, settings.FOLLOW_STAMP_TTL
+    ):
+        if author_ids is None:
+            author_ids = Follow.objects.filter(user=user).values_list(
+                'author_id', flat=True
+            )
+        newest = max(
+            get_versions(*(scope('author', pk) for pk in author_ids)),
+            default=0,
+        )
+        key = VERSION_KEY.format(followed)
+        if cache.get(key) != newest:
+            cache.set(key, newest, timeout=None)
+    return [scope('follow', user.pk), followed]
+
+
+def last_change(queryset, field='updated_at'):
+    """The newest date of the rows, on every database they are on."""
+    dates = [
+        date for date in (
+            queryset.aggregate(newest=Max(field))['newest']
+            for queryset in shards.everywhere(queryset.order_by())
+        )
+        if date is not None
+    ]
+    return max(dates, default=None)
+
+
+def feed_cache(request, *scopes):
+    """Context for the {% cache %} block of a feed template."""
+    versions = get_versions(*scopes)
+    key = ','.join(
+        f'{name}={version}' for name, version in zip(scopes, versions)
+    )
+    return {
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+        'feed_key': scope(
+            key,
+            request.GET.get('cursor', ''),
+            request.GET.get('page', ''),
+            request.GET.get('srch', ''),
+        ),
+    }
+
+
+def _last_modified(scopes, versions, last_change):
+    # The date only moves with the rows, so it is kept for as long as
+    # the stamps are: a stamp evicted from the cache reads it again.
+    key = LAST_CHANGE_KEY.format(hashlib.md5(
+        f'{scopes}:{versions}'.encode()
+    ).hexdigest())
+    modified = cache.get(key)
+    if modified is None:
+        date = last_change()
+        if date is not None:
+            modified = int(date.timestamp())
+        else:
+            modified = max(versions) // 1000
+        cache.set(key, modified, settings.FEED_CACHE_TIMEOUT)
+    return modified
+
+
+def conditional_page(get_scopes):
+    """Answer conditional GETs from the version stamps of the page scopes.
+
+    ``get_scopes(request, *args, **kwargs)`` returns the scopes the page
+    is built from and a function reading the last change of its rows,
+    from their updated_at or pub_date, or None to leave the request to
+    the view (a missing object, say). It runs before the view, so a 304
+    costs no main query and no rendering. The ETag is made of the stamps
+    and also covers the viewer, whose name, avatar and follow buttons are
+    part of the page. The last change is the Last-Modified date, read
+    once per stamps, so a stamp evicted from the cache does not move it;
+    a page without rows is as old as its newest stamp.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view_func(request, *args, **kwargs)
+            page = get_scopes(request, *args, **kwargs)
+            if page is None:
+                return view_func(request, *args, **kwargs)
+            page_scopes, last_change = page
+            scopes = page_scopes
+            personal = request.user.is_authenticated
+            if personal:
+                scopes = [*scopes, scope('user', request.user.pk)]
+            versions = get_versions(*scopes)
+            etag = quote_etag(hashlib.md5(
+                f'{request.user.pk}:{versions}'.encode()
+            ).hexdigest())
+            last_modified = _last_modified(
+                page_scopes, versions[:len(page_scopes)], last_change
+            )
+            response = get_conditional_response(
+                request, etag=etag, last_modified=last_modified
+            )
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response['ETag'] = etag
+                response['Last-Modified'] = http_date(last_modified)
+                if personal:
+                    patch_cache_control(response, private=True, max_age=0)
+                else:
+                    patch_cache_control(response, public=True, max_age=0)
+                patch_vary_headers(response, ('Cookie',))
+            return response
+        return wrapper
+    return decorator
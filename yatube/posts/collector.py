@@ -0,0 +1,196 @@
+import os
+import time
+from collections import Counter
+
+from django.conf import settings
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    KVStore as CachedDBKVStore,
+)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.bloom import BloomFilter
+from core.models import StoredFile
+from posts import shards, thumbnails
+from posts.models import ImageVariant, Post, Profile
+
+VARIANTS_PREFIX = 'variants/'
+
+
+def prefixes():
+    """Directories of MEDIA_ROOT the collector looks into."""
+    return (
+        Post._meta.get_field('image').upload_to,
+        Profile._meta.get_field('avatar').upload_to,
+        sorl_settings.THUMBNAIL_PREFIX,
+        VARIANTS_PREFIX,
+    )
+
+
+def _referenced():
+    """Names of the images in use and of their thumbnails.
+
+    A thumbnail is named after its source, so it is computed, not looked
+    up in sorl's store.
+    """
+    posts = shards.iterator(Post.objects.exclude(image='').only('pk', 'image'))
+    for post in posts:
+        yield post.image.name
+        yield thumbnails.thumbnail_file(post.image).name
+    yield from (
+        Profile.objects.exclude(avatar='')
+        .values_list('avatar', flat=True).iterator()
+    )
+
+
+def referenced_filter(error_rate=0.001):
+    """BloomFilter of the names in use, in memory bounded by their count.
+
+    Variants count only while their source is in use. A false positive
+    only keeps an orphan until the next run.
+    """
+    capacity = (
+        2 * sum(
+            queryset.count()
+            for queryset in shards.everywhere(Post.objects.exclude(image=''))
+        )
+        + Profile.objects.exclude(avatar='').count()
+        + ImageVariant.objects.count()
+    )
+    names = BloomFilter(capacity, error_rate)
+    names.update(_referenced())
+    variants = (
+        ImageVariant.objects.values_list('source', 'name').iterator()
+    )
+    for source, name in variants:
+        if source in names:
+            names.add(name)
+    return names
+
+
+def media_files(root, directories):
+    """(name, stat) of the files under the directories, walked lazily.
+
+    os.scandir() gives the stats without a call per file, and only the
+    directories not walked yet are held in memory.
+    """
+    pending = [
+        directory.rstrip('/') for directory in directories
+        if os.path.isdir(os.path.join(root, directory))
+    ]
+    while pending:
+        directory = pending.pop()
+        with os.scandir(os.path.join(root, directory)) as entries:
+            for entry in entries:
+                name = f'{directory}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(name)
+                elif entry.is_file(follow_symlinks=False):
+                    yield name, entry.stat(follow_symlinks=False)
+
+
+def still_referenced(names):
+    """The names in use right now, checked exactly with a query each."""
+    return set().union(
+        *(
+            queryset.values_list('image', flat=True)
+            for queryset in shards.everywhere(
+                Post.objects.filter(image__in=names)
+            )
+        ),
+        Profile.objects.filter(avatar__in=names)
+        .values_list('avatar', flat=True),
+        ImageVariant.objects.filter(name__in=names)
+        .values_list('name', flat=True),
+        StoredFile.objects.filter(name__in=names, refcount__gt=0)
+        .values_list('name', flat=True),
+    )
+
+
+def _forget(names):
+    """Drop what the database and sorl remember about deleted files."""
+    ImageVariant.objects.filter(name__in=names).delete()
+    keys = [
+        add_prefix(ImageFile(name, default.storage).key) for name in names
+        if name.startswith(sorl_settings.THUMBNAIL_PREFIX)
+    ]
+    if not keys:
+        return
+    if isinstance(default.kvstore, CachedDBKVStore):
+        KVStoreModel.objects.filter(key__in=keys).delete()
+        default.kvstore.cache.delete_many(keys)
+    else:
+        for key in keys:
+            default.kvstore._delete(key)
+
+
+def _batches(files, size):
+    batch = []
+    for item in files:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _throttle(started, done, rate):
+    """Wait until the next of ``rate`` operations per second is due."""
+    if rate:
+        delay = started + done / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _remove(root, name):
+    try:
+        os.remove(os.path.join(root, name))
+    except FileNotFoundError:
+        # Deleted meanwhile, by a post or another run.
+        pass
+
+
+def collect(batch_size=1000, min_age=3600, rate=0, dry_run=False,
+            report=None):
+    """Delete media files no post, profile or variant refers to.
+
+    Files younger than ``min_age`` seconds are left alone, as their rows
+    may not be committed yet, and at most ``rate`` files are deleted per
+    second, 0 meaning no limit. Candidates the filter rules out are
+    checked again with a query per batch before they go. ``report`` is
+    called with the name of every orphan found. Returns the counts.
+    """
+    root = settings.MEDIA_ROOT
+    names = referenced_filter()
+    deadline = time.time() - min_age
+    stats = Counter()
+    started = time.monotonic()
+    for batch in _batches(media_files(root, prefixes()), batch_size):
+        stats['scanned'] += len(batch)
+        candidates = {
+            name: stat.st_size for name, stat in batch
+            if stat.st_mtime < deadline and name not in names
+        }
+        if not candidates:
+            continue
+        kept = still_referenced(list(candidates))
+        orphans = [name for name in candidates if name not in kept]
+        deleted = []
+        for name in orphans:
+            stats['orphans'] += 1
+            stats['bytes'] += candidates[name]
+            if report is not None:
+                report(name)
+            if dry_run:
+                continue
+            _throttle(started, stats['deleted'], rate)
+            _remove(root, name)
+            stats['deleted'] += 1
+            deleted.append(name)
+        if deleted:
+            _forget(deleted)
+    return stats
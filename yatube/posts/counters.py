@@ -0,0 +1,112 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from posts import shards
+from posts.models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+# (model, counter field, counted model, its foreign key, field it points to)
+COUNTERS = (
+    (UserStats, 'posts_count', Post, 'author', 'user'),
+    (UserStats, 'followers_count', Follow, 'author', 'user'),
+    (UserStats, 'following_count', Follow, 'user', 'user'),
+    (Post, 'comments_count', Comment, 'post', 'pk'),
+    (Group, 'posts_count', Post, 'group', 'pk'),
+)
+
+
+def increment(model, lookup, field, delta=1, using=None):
+    queryset = model.objects.using(using).filter(**lookup)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    queryset.update(**{field: F(field) + delta})
+
+
+def shift_user(user_id, field, delta):
+    increment(UserStats, {'user_id': user_id}, field, delta)
+
+
+def shift_group(group_id, delta):
+    if group_id is not None:
+        increment(Group, {'pk': group_id}, 'posts_count', delta)
+
+
+def shift_post(post_id, delta, using=None):
+    # On the database of the comment: sharded posts keep theirs there.
+    increment(Post, {'pk': post_id}, 'comments_count', delta, using)
+
+
+def actual_count(counted, foreign_key, outer):
+    return Coalesce(
+        Subquery(
+            counted.objects.filter(**{foreign_key: OuterRef(outer)})
+            .order_by()
+            .values(foreign_key)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+def actual_counts(counted, foreign_key):
+    """Rows of the counted model by the key, over shards and archive."""
+    totals = Counter()
+    for queryset in shards.everywhere(counted.objects.order_by()):
+        totals.update(dict(
+            queryset.values_list(foreign_key).annotate(total=Count('pk'))
+        ))
+    return totals
+
+
+def reconcile_across(model, field, counted, foreign_key, outer):
+    """Fix counters of sharded or archived rows on default, row by row."""
+    totals = actual_counts(counted, foreign_key)
+    fixed = 0
+    rows = model.objects.values_list(outer, field).iterator()
+    for key, value in rows:
+        if value != totals[key]:
+            model.objects.filter(**{outer: key}).update(
+                **{field: totals[key]}
+            )
+            fixed += 1
+    return fixed
+
+
+def create_missing_stats():
+    missing = User.objects.filter(stats__isnull=True).values_list(
+        'pk', flat=True
+    )
+    return len(UserStats.objects.bulk_create(
+        UserStats(user_id=user_id) for user_id in missing
+    ))
+
+
+def _elsewhere(model):
+    return shards.is_sharded(model) or shards.is_archived(model)
+
+
+def reconcile():
+    """Fix drifted counters with one UPDATE per counter and database.
+
+    Counts of sharded or archived rows kept on default cannot be a
+    subquery there.
+    """
+    fixed = {'userstats': create_missing_stats()}
+    for model, field, counted, foreign_key, outer in COUNTERS:
+        name = f'{model._meta.model_name}.{field}'
+        if _elsewhere(counted) and not _elsewhere(model):
+            fixed[name] = reconcile_across(
+                model, field, counted, foreign_key, outer
+            )
+            continue
+        actual = actual_count(counted, foreign_key, outer)
+        fixed[name] = sum(
+            queryset.exclude(**{field: actual}).update(**{field: actual})
+            for queryset in shards.everywhere(model.objects.all())
+        )
+    return fixed
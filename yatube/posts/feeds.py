@@ -0,0 +1,149 @@
+from functools import partial
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from posts import shards, workers
+from posts.models import Follow, Post, Timeline, UserStats
+
+
+def is_fan_in_author(author_id):
+    """Authors with huge audiences are read at query time, not fanned out."""
+    return UserStats.objects.filter(user_id=author_id, fan_in=True).exists()
+
+
+def fan_in_authors(user):
+    return Follow.objects.filter(
+        user=user, author__stats__fan_in=True
+    ).values('author')
+
+
+def _insert_entries(entries):
+    # bulk_create() materializes its argument, so feed it bounded chunks.
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, settings.FEED_BATCH_SIZE))
+        if not batch:
+            break
+        Timeline.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    # Sharded posts are never fanned out, see follow_feed().
+    if shards.is_enabled() or is_fan_in_author(post.author_id):
+        return
+    followers = (
+        Follow.objects.filter(author_id=post.author_id)
+        .values_list('user_id', flat=True)
+        .iterator()
+    )
+    _insert_entries(
+        Timeline(user_id=user_id, post=post) for user_id in followers
+    )
+
+
+def backfill_timeline(user_id, author_id, check_fan_in=True):
+    if shards.is_enabled() or check_fan_in and is_fan_in_author(author_id):
+        return
+    posts = (
+        Post.objects.filter(author_id=author_id)
+        .values_list('pk', flat=True)
+        .iterator()
+    )
+    _insert_entries(
+        Timeline(user_id=user_id, post_id=post_id) for post_id in posts
+    )
+
+
+def enter_fan_in(author_id):
+    """Read the author at query time once over the follower limit.
+
+    Call after the follow is counted.
+    """
+    UserStats.objects.filter(
+        user_id=author_id,
+        fan_in=False,
+        followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).update(fan_in=True)
+
+
+def fan_out_author(author_id):
+    followers = list(
+        Follow.objects.filter(author_id=author_id)
+        .values_list('user_id', flat=True)
+    )
+    for user_id in followers:
+        backfill_timeline(user_id, author_id)
+
+
+def leave_fan_in(author_id):
+    """Fan out the author again once down to FEED_FANOUT_RESUME_FOLLOWERS.
+
+    Their posts written in fan-in have no timeline rows, and follow_feed()
+    stops reading them at query time. Call after the unfollow is counted;
+    the rows are written by a worker once it is committed, the new posts
+    fanned out by themselves meanwhile.
+    """
+    left = UserStats.objects.filter(
+        user_id=author_id,
+        fan_in=True,
+        followers_count__lte=settings.FEED_FANOUT_RESUME_FOLLOWERS,
+    ).update(fan_in=False)
+    if left and not shards.is_enabled():
+        transaction.on_commit(
+            partial(workers.submit, fan_out_author, author_id)
+        )
+
+
+def prune_timeline(user_id, author_id):
+    Timeline.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild_timelines():
+    # Counters fixed by reconcile_counters may have crossed the limits.
+    stats = UserStats.objects.all()
+    stats.filter(
+        followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).update(fan_in=True)
+    stats.filter(
+        followers_count__lte=settings.FEED_FANOUT_RESUME_FOLLOWERS
+    ).update(fan_in=False)
+    Timeline.objects.all().delete()
+    if shards.is_enabled():
+        return
+    follows = (
+        Follow.objects.exclude(author__stats__fan_in=True)
+        .values_list('user_id', 'author_id')
+        .iterator()
+    )
+    for user_id, author_id in follows:
+        backfill_timeline(user_id, author_id, check_fan_in=False)
+
+
+def follow_feed(user):
+    if shards.is_enabled():
+        # Timeline rows cannot point at posts on other databases: read
+        # the posts of the authors followed from their shards instead.
+        author_ids = list(
+            Follow.objects.filter(user=user).values_list('author', flat=True)
+        )
+        return shards.merged(
+            Post.objects.filter(author_id__in=author_ids),
+            sorted({shards.shard_for(author_id) for author_id in author_ids}),
+        )
+    posts = Post.objects.filter(
+        Q(pk__in=Timeline.objects.filter(user=user).values('post'))
+        | Q(author__in=fan_in_authors(user))
+    )
+    if not settings.POST_ARCHIVE:
+        return posts
+    # Archiving drops the timeline rows, the archive has no follows.
+    return shards.merged(posts, archived=Post.objects.filter(
+        author_id__in=list(
+            Follow.objects.filter(user=user).values_list('author', flat=True)
+        )
+    ))
@@ -0,0 +1,121 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+
+from core.queries import (
+    covered, explain, index_columns, order_tables, plan_problems,
+    statement_shape,
+)
+from posts import views
+from posts.models import Follow, Group, Post
+from posts.utils import CursorPaginator
+
+User = get_user_model()
+
+
+def samples():
+    """(label, view, kwargs, user, GET data) of the pages to look at.
+
+    The objects are the first found in the database; pages that need
+    a missing one are left out.
+    """
+    anonymous = AnonymousUser()
+    post = Post.objects.order_by('-pub_date', '-pk').first()
+    yield 'index', views.index, {}, anonymous, {}
+    if post is None:
+        return
+    cursor = CursorPaginator(
+        Post.objects.all(), settings.POSTS_ON_PAGE
+    ).encode_cursor(2, post)
+    yield 'index, keyset page', views.index, {}, anonymous, {
+        'cursor': cursor,
+    }
+    word = post.text.split()[0] if post.text.split() else 'a'
+    yield 'index, search', views.index, {}, anonymous, {'srch': word}
+    group = Group.objects.filter(posts_count__gt=0).first()
+    if group is not None:
+        yield 'group_posts', views.group_posts, {'url': group.slug}, (
+            anonymous
+        ), {}
+    yield 'profile', views.profile, {'username': post.author.username}, (
+        anonymous
+    ), {}
+    yield 'post_detail', views.post_detail, {'post_id': post.pk}, (
+        anonymous
+    ), {}
+    follow = Follow.objects.select_related('user').first()
+    if follow is not None:
+        yield 'follow_index', views.follow_index, {}, follow.user, {}
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает полные просмотры таблиц и сортировки во временных '
+        'B-деревьях в запросах страниц posts.views и предлагает индексы.'
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            self.stderr.write('Нужна база SQLite.')
+            return
+        tables = set(connection.introspection.table_names())
+        factory = RequestFactory()
+        # An unseen page number keeps cached feed fragments from hiding
+        # the feed queries.
+        nonce = f'advise-{time.time_ns()}'
+        suggested = {}
+        problems = 0
+        for label, view, kwargs, user, data in samples():
+            request = factory.get('/', {'page': nonce, **data})
+            request.user = user
+            with transaction.atomic(), CaptureQueriesContext(
+                connection
+            ) as queries:
+                view(request, **kwargs)
+                transaction.set_rollback(True)
+            statements = [
+                query['sql'] for query in queries.captured_queries
+                if query['sql'].lstrip().upper().startswith('SELECT')
+            ]
+            self.stdout.write(f'{label}: запросов {len(statements)}')
+            for sql in statements:
+                found = plan_problems(explain(sql), tables)
+                for kind, table, detail in found:
+                    problems += 1
+                    self.stdout.write(f'  {detail}')
+                    self.stdout.write(f'    {statement_shape(sql)[:200]}')
+                    for table in [table] if table else order_tables(sql):
+                        self.suggest(sql, table, suggested)
+        for statement in suggested.values():
+            self.stdout.write(f'Предлагаемый индекс: {statement}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Проблем найдено: {problems}, '
+            f'индексов предложено: {len(suggested)}.'
+        ))
+
+    def suggest(self, sql, table, suggested):
+        columns = index_columns(sql, table)
+        if not columns:
+            return
+        indexes = [
+            constraint['columns']
+            for constraint in connection.introspection.get_constraints(
+                connection.cursor(), table
+            ).values()
+            if constraint['index'] or constraint['unique']
+        ]
+        if covered(columns, indexes):
+            return
+        name = '_'.join(
+            [table] + [column.split()[0] for column in columns]
+        )[:60] + '_idx'
+        suggested.setdefault(
+            (table, tuple(columns)),
+            f'CREATE INDEX "{name}" ON "{table}" ({", ".join(columns)});',
+        )
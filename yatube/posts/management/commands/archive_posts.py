@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import archive
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит старые посты с комментариями в архивную базу '
+        'POST_ARCHIVE.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=settings.POST_ARCHIVE_AFTER_DAYS,
+            help='Переносить посты старше стольких дней.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not settings.POST_ARCHIVE:
+            raise CommandError('Архивная база POST_ARCHIVE не задана.')
+        report = None
+        if options['verbosity'] > 1:
+            def report(source, count):
+                self.stdout.write(f'{source}: постов {count}.')
+        moved = archive.archive_posts(
+            options['days'], options['batch_size'], report
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Постов перенесено в архив: {sum(moved.values())}.'
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from posts import collector
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки, миниатюры и варианты, на которые больше '
+        'не ссылаются посты и профили.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Не трогать файлы моложе стольких секунд.',
+        )
+        parser.add_argument(
+            '--rate', type=float, default=0,
+            help='Удалять не больше стольких файлов в секунду; 0 - без '
+                 'ограничения.',
+        )
+
+    def handle(self, *args, **options):
+        report = None
+        if options['dry_run'] or options['verbosity'] > 1:
+            report = self.stdout.write
+        stats = collector.collect(
+            batch_size=options['batch_size'],
+            min_age=options['min_age'],
+            rate=options['rate'],
+            dry_run=options['dry_run'],
+            report=report,
+        )
+        self.stdout.write(
+            f'Файлов просмотрено: {stats["scanned"]}, '
+            f'лишних: {stats["orphans"]} ({stats["bytes"]} байт).'
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Файлов удалено: {stats["deleted"]}.'
+        ))
@@ -0,0 +1,35 @@
+from itertools import chain
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import shards, uploads, workers
+from posts.models import Post, Profile
+
+
+class Command(BaseCommand):
+    help = 'Сохраняет размеры картинок, загруженных до появления этих полей.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.MEDIA_WORKERS,
+            help='Число процессов; 0 - в текущем процессе.',
+        )
+
+    def handle(self, *args, **options):
+        sources = chain(
+            (('post', pk) for pk in shards.iterator(Post.objects.filter(
+                image__gt='', image_width__isnull=True
+            ).values_list('pk', flat=True))),
+            (('avatar', pk) for pk in Profile.objects.filter(
+                avatar__gt='', avatar_width__isnull=True
+            ).values_list('pk', flat=True).iterator()),
+        )
+        measured = sum(
+            done for _, done in workers.run_all(
+                uploads.measure, sources, options['workers']
+            )
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Размеры сохранены для картинок: {measured}.'
+        ))
@@ -0,0 +1,43 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import shards, uploads, workers
+from posts.models import Post
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = 'Создает размытые заглушки картинок постов, у которых их нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.MEDIA_WORKERS,
+            help='Число процессов; 0 - в текущем процессе.',
+        )
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        post_ids = shards.iterator(
+            Post.objects.filter(image__gt='', image_placeholder='')
+            .values_list('pk', flat=True)
+        )
+        filled = sum(
+            count for _, count in workers.run_all(
+                uploads.fill_placeholders,
+                batches(post_ids, options['batch_size']),
+                options['workers'],
+            )
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Заглушки созданы для постов: {filled}.'
+        ))
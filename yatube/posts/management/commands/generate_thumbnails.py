@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import shards, thumbnails, workers
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Создает недостающие миниатюры картинок постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.MEDIA_WORKERS,
+            help='Число процессов; 0 - в текущем процессе.',
+        )
+
+    def handle(self, *args, **options):
+        post_ids = shards.iterator(
+            Post.objects.exclude(image='').values_list('pk', flat=True)
+        )
+        failed = 0
+        for post_id, ok in workers.run_all(
+            thumbnails.generate, post_ids, options['workers']
+        ):
+            if not ok:
+                failed += 1
+                self.stderr.write(f'Пост {post_id}: миниатюра не создана.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Миниатюры созданы, ошибок: {failed}.'
+        ))
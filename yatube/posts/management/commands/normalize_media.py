@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts import shards, uploads, workers
+from posts.models import Post, Profile
+
+
+class Command(BaseCommand):
+    help = (
+        'Уменьшает, поворачивает по EXIF и очищает от метаданных '
+        'загруженные картинки постов и аватарки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.MEDIA_WORKERS,
+            help='Число процессов; 0 - в текущем процессе.',
+        )
+
+    def handle(self, *args, **options):
+        jobs = (
+            (uploads.process_post_image, Post.objects.exclude(image='')),
+            (uploads.process_avatar, Profile.objects.filter(avatar__gt='')),
+        )
+        normalized = 0
+        for job, queryset in jobs:
+            ids = shards.iterator(queryset.values_list('pk', flat=True))
+            for _, done in workers.run_all(job, ids, options['workers']):
+                normalized += done
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок обработано: {normalized}.'
+        ))
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import shards
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит посты с комментариями на шард их автора из '
+        'POST_SHARDS после изменения списка шардов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'drained', nargs='*',
+            help='Базы, убранные из POST_SHARDS, посты с которых '
+                 'нужно перенести.',
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for alias in options['drained']:
+            if alias not in settings.DATABASES:
+                raise CommandError(f'Нет базы {alias}.')
+        report = None
+        if options['verbosity'] > 1:
+            def report(author_id, source, target, count):
+                self.stdout.write(
+                    f'Автор {author_id}: {source} -> {target}, '
+                    f'постов: {count}.'
+                )
+        moved = shards.rebalance(
+            options['drained'], options['batch_size'], report
+        )
+        for (source, target), count in sorted(moved.items()):
+            self.stdout.write(f'{source} -> {target}: {count}.')
+        self.stdout.write(self.style.SUCCESS(
+            f'Постов перенесено: {sum(moved.values())}.'
+        ))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from posts import search, shards
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает полнотекстовый индекс постов (SQLite FTS5).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        aliases = shards.all_databases()
+        if not all(search.is_available(alias) for alias in aliases):
+            raise CommandError('Полнотекстовый индекс есть только у SQLite.')
+        for alias in aliases:
+            with transaction.atomic(using=alias):
+                search.rebuild_index(options['batch_size'], using=alias)
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс пересобран.'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.feeds import rebuild_timelines
+from posts.models import Timeline
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересобирает ленты подписок с нуля. Авторы с числом подписчиков '
+        'больше FEED_FANOUT_MAX_FOLLOWERS читаются при запросе и в ленты '
+        'не раскладываются, пока подписчиков не станет '
+        'FEED_FANOUT_RESUME_FOLLOWERS, поэтому сначала запустите '
+        'reconcile_counters.'
+    )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rebuild_timelines()
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {Timeline.objects.count()}'
+        ))
@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from core import routers
+from core.db import copy_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплики из DATABASE_REPLICAS '
+        'или указанные базы.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'aliases', nargs='*',
+            help='Базы из DATABASES; по умолчанию DATABASE_REPLICAS.',
+        )
+        parser.add_argument(
+            '--interval', type=float,
+            default=settings.REPLICA_REFRESH_INTERVAL,
+            help=(
+                'Повторять раз в столько секунд; 0 - один раз. '
+                'По умолчанию REPLICA_REFRESH_INTERVAL.'
+            ),
+        )
+
+    def handle(self, *args, **options):
+        aliases = options['aliases'] or settings.DATABASE_REPLICAS
+        source = settings.DATABASES[DEFAULT_DB_ALIAS]
+        for alias in aliases:
+            target = settings.DATABASES.get(alias)
+            if (
+                alias == DEFAULT_DB_ALIAS or target is None
+                or 'sqlite' not in target['ENGINE']
+                or 'sqlite' not in source['ENGINE']
+            ):
+                raise CommandError(f'{alias} не реплика SQLite.')
+        while True:
+            for alias in aliases:
+                since = time.time()
+                copy_database(
+                    source['NAME'], settings.DATABASES[alias]['NAME']
+                )
+                routers.refreshed(alias, since)
+                self.stdout.write(f'Реплика {alias} обновлена.')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
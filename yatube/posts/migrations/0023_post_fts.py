@@ -0,0 +1,63 @@
+import re
+from itertools import islice
+
+from django.conf import settings
+from django.db import migrations
+
+FTS_TABLE = 'posts_post_fts'
+WORD_RE = re.compile(r'\w+')
+BATCH_SIZE = 1000
+
+
+def terms(text):
+    # posts.search.terms() as of this migration, so that later changes
+    # of the app do not change what it writes.
+    words = WORD_RE.findall(text.casefold())
+    if settings.SEARCH_STEMMING:
+        import snowballstemmer
+        words = snowballstemmer.stemmer('russian').stemWords(words)
+    return words
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5('
+        f"text, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    # Indexed as search.index_post() does, so old and new posts match
+    # the same way.
+    posts = apps.get_model('posts', 'Post').objects.using(
+        schema_editor.connection.alias
+    )
+    rows = posts.values_list('pk', 'text').iterator()
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            batch = [
+                (pk, ' '.join(terms(text)))
+                for pk, text in islice(rows, BATCH_SIZE)
+            ]
+            if not batch:
+                break
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+                batch,
+            )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_timeline'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
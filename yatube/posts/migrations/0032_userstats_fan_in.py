@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 05:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_fan_in(apps, schema_editor):
+    UserStats = apps.get_model('posts', 'UserStats')
+    UserStats.objects.using(schema_editor.connection.alias).filter(
+        followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS,
+    ).update(fan_in=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0031_post_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userstats',
+            name='fan_in',
+            field=models.BooleanField(default=False, verbose_name='Читается без раскладки по лентам'),
+        ),
+        migrations.RunPython(mark_fan_in, migrations.RunPython.noop),
+    ]
@@ -3,7 +3,8 @@ from django.db import models
 from django.db.models.constraints import UniqueConstraint
 from pytils.translit import slugify
 
-from core.models import CreatedModel
+from core.models import CreatedModel, RoutedQuerySet
+from core.storage import content_storage
 
 User = get_user_model()
 
@@ -20,6 +21,11 @@ class Group(models.Model):
         verbose_name='URL'
     )
     description = models.TextField(verbose_name='Описание группы')
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество постов',
+    )
 
     def __str__(self):
         return self.title
@@ -35,38 +41,104 @@ class Post(CreatedModel):
         verbose_name='Текст',
         help_text='Введите текст поста',
     )
+    # Sharded posts live apart from users and groups: no foreign key
+    # constraints across databases, see posts.shards.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='posts',
-        verbose_name='Автор'
+        verbose_name='Автор',
+        db_constraint=False,
     )
     group = models.ForeignKey(
         Group,
         blank=True,
         null=True,
         on_delete=models.SET_NULL,
+        db_constraint=False,
         related_name='posts',
         verbose_name='Группа',
         help_text='Группа, к которой будет относиться пост',
     )
     image = models.ImageField(
         upload_to='posts/',
+        storage=content_storage,
         blank=True,
+        width_field='image_width',
+        height_field='image_height',
         verbose_name='Картинка',
         help_text='Картинка для поста',
     )
+    image_width = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Ширина картинки',
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Высота картинки',
+    )
+    image_placeholder = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='Заглушка картинки',
+        help_text='Крошечная копия картинки в виде data URI',
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество комментариев',
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
+
+    # Placed on the shard of the author, see posts.shards.
+    objects = RoutedQuerySet.as_manager()
+
+    class Meta(CreatedModel.Meta):
+        # Feeds of an author and of a group are filtered by it and read in
+        # (-pub_date, -pk) order, keyset pages start inside the index.
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='post_feed_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_feed_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_feed_idx',
+            ),
+            # The Last-Modified date of the main feed, see posts.caching.
+            models.Index(fields=['updated_at'], name='post_updated_idx'),
+        ]
 
     def __str__(self):
         return self.text[:15]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the group to move the counters when it is changed.
+        instance._loaded_group_id = instance.__dict__.get('group_id')
+        # And the image, to process only a new one.
+        image = instance.__dict__.get('image')
+        instance._loaded_image = getattr(image, 'name', image)
+        return instance
+
 
 class Comment(CreatedModel):
+    # Stored with its post, see posts.shards.
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='comments',
-        verbose_name='Автор комментария'
+        verbose_name='Автор комментария',
+        db_constraint=False,
     )
     post = models.ForeignKey(
         Post,
@@ -79,10 +151,38 @@ class Comment(CreatedModel):
         help_text='Введите текст комментария',
     )
 
+    # Placed on the shard of the post, see posts.shards.
+    objects = RoutedQuerySet.as_manager()
+
+    class Meta(CreatedModel.Meta):
+        indexes = [
+            models.Index(
+                fields=['post', '-pub_date', '-id'],
+                name='comment_post_date_idx',
+            ),
+        ]
+
     def __str__(self):
         return self.text[:15]
 
 
+class PostLocation(models.Model):
+    """Directory of posts, kept in the default database.
+
+    Ids of all new posts are allocated here, so they stay unique across
+    the shards and across turning sharding on, and the author tells
+    which shard holds a post.
+    """
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+
+    def __str__(self):
+        return f'post {self.pk} of {self.author_id}'
+
+
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
@@ -99,6 +199,13 @@ class Follow(models.Model):
         constraints = [
             UniqueConstraint(fields=['user', 'author'], name='unique_follow'),
         ]
+        # unique_follow serves lookups by user, this one those by author:
+        # followers of an author, fan-out of a new post.
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='follow_author_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user.username} follower of {self.author.username}'
@@ -110,9 +217,113 @@ class Profile(models.Model):
         upload_to='img/avatars/',
         null=True,
         blank=True,
+        width_field='avatar_width',
+        height_field='avatar_height',
         verbose_name='Аватарка',
         help_text='Аватарка пользователя',
     )
+    avatar_width = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Ширина аватарки',
+    )
+    avatar_height = models.PositiveIntegerField(
+        null=True,
+        editable=False,
+        verbose_name='Высота аватарки',
+    )
 
     def __str__(self):
         return f'{self.user.username} profile'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the avatar to process only a new one.
+        avatar = instance.__dict__.get('avatar')
+        instance._loaded_avatar = getattr(avatar, 'name', avatar)
+        return instance
+
+
+class UserStats(models.Model):
+    """Denormalized counters of a user, kept up to date by signals."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество постов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество подписчиков',
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество подписок',
+    )
+    # Posts of the user are read by follow feeds at query time.
+    fan_in = models.BooleanField(
+        default=False,
+        verbose_name='Читается без раскладки по лентам',
+    )
+
+    def __str__(self):
+        return f'{self.user.username} stats'
+
+
+class Timeline(models.Model):
+    """Materialized follow feed: one row per post delivered to a reader."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+    )
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'post'], name='unique_timeline'),
+        ]
+
+    def __str__(self):
+        return f'{self.post_id} in timeline of {self.user_id}'
+
+
+class ImageVariant(models.Model):
+    """Resized copy of a post image or an avatar, stored next to it."""
+    source = models.CharField(
+        max_length=255,
+        verbose_name='Исходная картинка',
+    )
+    kind = models.CharField(
+        max_length=16,
+        verbose_name='Вид картинки',
+    )
+    width = models.PositiveIntegerField(verbose_name='Ширина')
+    format = models.CharField(
+        max_length=8,
+        verbose_name='Формат',
+    )
+    name = models.CharField(
+        max_length=255,
+        verbose_name='Файл',
+    )
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(
+                fields=['source', 'kind', 'width', 'format'],
+                name='unique_image_variant',
+            ),
+        ]
+
+    def __str__(self):
+        return self.name
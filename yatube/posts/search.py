@@ -0,0 +1,116 @@
+import re
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from posts.models import Post
+
+try:
+    import snowballstemmer
+except ImportError:  # stemming is optional
+    snowballstemmer = None
+
+FTS_TABLE = 'posts_post_fts'
+WORD_RE = re.compile(r'\w+')
+
+
+def is_available(using=DEFAULT_DB_ALIAS):
+    return connections[using].vendor == 'sqlite'
+
+
+def _stemmer():
+    if not settings.SEARCH_STEMMING:
+        return None
+    if snowballstemmer is None:
+        raise ImproperlyConfigured(
+            'SEARCH_STEMMING needs the snowballstemmer package.'
+        )
+    return snowballstemmer.stemmer('russian')
+
+
+def terms(text):
+    """Casefolded (and optionally stemmed) words, the same for both sides."""
+    words = WORD_RE.findall(text.casefold())
+    stemmer = _stemmer()
+    if stemmer is not None:
+        words = stemmer.stemWords(words)
+    return words
+
+
+def match_expression(keyword):
+    return ' '.join(
+        '"{}"*'.format(term.replace('"', '""')) for term in terms(keyword)
+    )
+
+
+def index_post(post):
+    # Into the database of the post: every shard has its own index.
+    using = post._state.db or DEFAULT_DB_ALIAS
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, ' '.join(terms(post.text))],
+        )
+
+
+def unindex_post(post_id, using=DEFAULT_DB_ALIAS):
+    if not is_available(using):
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def rebuild_index(batch_size=1000, using=DEFAULT_DB_ALIAS):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        rows = Post.objects.using(using).values_list('pk', 'text').iterator()
+        batch = []
+        for pk, text in rows:
+            batch.append((pk, ' '.join(terms(text))))
+            if len(batch) == batch_size:
+                cursor.executemany(
+                    f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+                    batch,
+                )
+                batch = []
+        if batch:
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+                batch,
+            )
+
+
+def search_posts(keyword):
+    """Posts matching every word of keyword, best BM25 score first."""
+    expression = match_expression(keyword)
+    if not expression:
+        return Post.objects.none()
+    if not is_available():
+        condition = Q()
+        for word in WORD_RE.findall(keyword):
+            condition &= Q(text__icontains=word)
+        return Post.objects.filter(condition)
+    rank = RawSQL(
+        f'SELECT bm25({FTS_TABLE}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s AND rowid = posts_post.id',
+        (expression,),
+    )
+    # Not pk__in=RawSQL(...): the extra parentheses it adds turn the
+    # subquery into a scalar one in SQLite.
+    return (
+        Post.objects.extra(
+            where=[
+                f'posts_post.id IN (SELECT rowid FROM {FTS_TABLE} '
+                f'WHERE {FTS_TABLE} MATCH %s)'
+            ],
+            params=[expression],
+        )
+        .annotate(rank=rank)
+        .order_by('rank', '-pk')
+    )
@@ -0,0 +1,591 @@
+"""Optional sharding of posts and their comments by author.
+
+With POST_SHARDS listing database aliases, all posts of an author and
+the comments on them are stored on one of them, picked by a stable hash
+of the author id, so writers of different shards do not wait for each
+other's lock. Users, groups, follows and counters stay on default, where
+PostLocation allocates post ids and maps them to their authors.
+
+Reads that name an author or a post go to its shard alone; feeds of
+everyone merge the shards. Rows never join across databases, so the
+authors and groups of sharded posts are prefetched rather than joined.
+
+POST_ARCHIVE names one more database, holding old posts moved there by
+posts.archive with or without shards. Lookups of a post fall back on it
+and feeds read it once a page reaches past its newest post.
+"""
+import hashlib
+import heapq
+from collections import Counter, defaultdict
+from itertools import chain, islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import Max, prefetch_related_objects
+
+from core.routers import ReplicaRouter
+from posts import search
+from posts.models import Comment, Post, PostLocation, Timeline
+
+User = get_user_model()
+
+LOCATION_KEY = 'post-author:{}'
+# Fields telling a row copied by an interrupted move from another one.
+IDENTITY = {
+    Post: ('author_id', 'pub_date'),
+    Comment: ('post_id', 'author_id', 'pub_date'),
+}
+ARCHIVE_NEWEST_KEY = 'post-archive-newest'
+
+
+def is_enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def is_sharded(model):
+    return is_enabled() and model in (Post, Comment)
+
+
+def is_archived(model):
+    return bool(settings.POST_ARCHIVE) and model in (Post, Comment)
+
+
+def archive_newest():
+    """pub_date of the newest archived post, None if there is none."""
+    newest = cache.get(ARCHIVE_NEWEST_KEY, False)
+    if newest is False:
+        newest = Post.objects.using(settings.POST_ARCHIVE).aggregate(
+            newest=Max('pub_date')
+        )['newest']
+        cache.set(ARCHIVE_NEWEST_KEY, newest, timeout=None)
+    return newest
+
+
+def _archived(posts):
+    # Before the posts leave their source, or feeds skip the archive
+    # they are in.
+    newest = max(post.pub_date for post in posts)
+    current = archive_newest()
+    if current is None or current < newest:
+        cache.set(ARCHIVE_NEWEST_KEY, newest, timeout=None)
+
+
+def shard_for(author_id, shards=None):
+    """Database of the author's posts: rendezvous hashing of the id.
+
+    Unlike a modulo, adding a shard only moves the authors it wins,
+    about 1/N of them, and the choice is the same in every process.
+    """
+    shards = settings.POST_SHARDS if shards is None else shards
+    if not shards:
+        return DEFAULT_DB_ALIAS
+    return max(shards, key=lambda alias: hashlib.blake2b(
+        f'{alias}:{author_id}'.encode(), digest_size=8
+    ).digest())
+
+
+def databases():
+    """Every database new posts are written to."""
+    return list(settings.POST_SHARDS) or [DEFAULT_DB_ALIAS]
+
+
+def authors(post_ids):
+    """Authors of the posts by the post id, cached as they never change."""
+    keys = {post_id: LOCATION_KEY.format(post_id) for post_id in post_ids}
+    cached = cache.get_many(keys.values())
+    found = {
+        post_id: cached[key] for post_id, key in keys.items()
+        if key in cached
+    }
+    missing = [post_id for post_id in keys if post_id not in found]
+    if missing:
+        located = dict(
+            PostLocation.objects.using(DEFAULT_DB_ALIAS)
+            .filter(pk__in=missing).values_list('pk', 'author_id')
+        )
+        cache.set_many({
+            keys[post_id]: author_id
+            for post_id, author_id in located.items()
+        })
+        found.update(located)
+    return found
+
+
+def locate(post_id):
+    """Database the post belongs on, None when posts are not sharded.
+
+    Posts written before sharding stay on default until rebalance()
+    moves them, find_post() looks there too; those loaded raw are not in
+    the directory and are located on default.
+    """
+    if not is_enabled():
+        return None
+    author_id = authors([post_id]).get(post_id)
+    if author_id is None:
+        return DEFAULT_DB_ALIAS
+    return shard_for(author_id)
+
+
+def by_database(post_ids):
+    """The post ids grouped by the database holding them."""
+    if not is_enabled():
+        return {None: list(post_ids)}
+    located = authors(post_ids)
+    groups = defaultdict(list)
+    for post_id in post_ids:
+        author_id = located.get(post_id)
+        alias = (
+            DEFAULT_DB_ALIAS if author_id is None else shard_for(author_id)
+        )
+        groups[alias].append(post_id)
+    return groups
+
+
+def for_post(queryset, post_id):
+    """The queryset of posts or comments on the database of the post."""
+    if not is_sharded(queryset.model):
+        return queryset
+    return queryset.using(locate(post_id))
+
+
+def find_post(queryset, post_id, related=()):
+    """The post from the database holding it, default or the archive.
+
+    ``related`` are the relations to load with it. None if there is no
+    such post.
+    """
+    candidates = [for_post(queryset, post_id)]
+    if candidates[0].db != DEFAULT_DB_ALIAS and is_sharded(queryset.model):
+        # Not moved to its shard yet.
+        candidates.append(queryset.using(DEFAULT_DB_ALIAS))
+    if is_archived(queryset.model):
+        candidates.append(queryset.using(settings.POST_ARCHIVE))
+    for candidate in candidates:
+        candidate = candidate.filter(pk=post_id)
+        if related:
+            candidate = select_related(candidate, *related)
+        post = candidate.first()
+        if post is not None:
+            return post
+    return None
+
+
+def all_databases():
+    """Every database posts are kept on, the archive included."""
+    aliases = databases()
+    if settings.POST_ARCHIVE:
+        aliases.append(settings.POST_ARCHIVE)
+    return aliases
+
+
+def everywhere(queryset):
+    """The queryset on every database its rows may be on."""
+    model = queryset.model
+    if not is_sharded(model) and not is_archived(model):
+        return [queryset]
+    return [queryset.using(alias) for alias in all_databases()]
+
+
+def iterator(queryset):
+    """Rows of the queryset from every database, one after another."""
+    return chain.from_iterable(
+        queryset.iterator() for queryset in everywhere(queryset)
+    )
+
+
+def select_related(queryset, *fields):
+    """select_related() where the relations are in the same database."""
+    if is_sharded(queryset.model) or queryset.db not in (
+        DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS,
+    ):
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def author_databases(author_id):
+    """Databases to read the posts of the author from, but the archive."""
+    return [shard_for(author_id)] if is_enabled() else None
+
+
+def merged(queryset, shards=None, archived=None):
+    """The queryset over all shards, or ``shards``, as one ordered feed.
+
+    The archive comes last, when the feed reaches it. ``archived`` is
+    read there instead of the queryset, when that filters on rows the
+    archive does not have.
+    """
+    model = queryset.model
+    if not is_sharded(model) and not is_archived(model):
+        return queryset
+    if not shards:
+        # Unsharded, the router picks default or a replica.
+        shards = databases() if is_sharded(model) else [None]
+    archive = settings.POST_ARCHIVE if is_archived(model) else None
+    return ShardedQuerySet(queryset, shards, archive, archived=archived)
+
+
+def allocate_id(author_id):
+    location = PostLocation.objects.using(DEFAULT_DB_ALIAS).create(
+        author_id=author_id
+    )
+    cache.set(LOCATION_KEY.format(location.pk), author_id)
+    return location.pk
+
+
+def _elsewhere(queryset):
+    # Deletes of users and groups cascade on default by themselves.
+    return [
+        queryset for queryset in everywhere(queryset)
+        if queryset.db != DEFAULT_DB_ALIAS
+    ]
+
+
+def delete_user_content(user_id):
+    """Delete the posts and comments of a user on other databases."""
+    for queryset in _elsewhere(Comment.objects.filter(author_id=user_id)):
+        queryset.delete()
+    for queryset in _elsewhere(Post.objects.filter(author_id=user_id)):
+        queryset.delete()
+
+
+def ungroup_posts(group_id):
+    """SET_NULL of a deleted group, for the posts on other databases."""
+    for queryset in _elsewhere(Post.objects.filter(group_id=group_id)):
+        queryset.update(group=None)
+
+
+def _register(source, batch_size):
+    """Add the posts of the database missing from the directory."""
+    rows = (
+        PostLocation(pk=pk, author_id=author_id)
+        for pk, author_id in source.values_list('pk', 'author_id')
+        .order_by().iterator()
+    )
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        PostLocation.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            batch, ignore_conflicts=True
+        )
+
+
+def _copy(rows, target):
+    # Saved raw, as loaddata does: dates and files are kept as they are
+    # and the receivers only index the text on the target.
+    if not rows:
+        return
+    model = type(rows[0])
+    fields = IDENTITY[model]
+    existing = {
+        values[0]: values[1:]
+        for values in model._base_manager.using(target)
+        .filter(pk__in=[row.pk for row in rows])
+        .values_list('pk', *fields)
+    }
+    for row in rows:
+        if row.pk not in existing:
+            row.save_base(using=target, raw=True, force_insert=True)
+        elif existing[row.pk] != tuple(getattr(row, name) for name in fields):
+            # Deleting the source would lose one of the two.
+            raise IntegrityError(
+                f'{model.__name__} {row.pk} is another row on {target}.'
+            )
+
+
+def move_posts(posts, source, target):
+    """Move the posts, read from ``source``, to ``target`` with comments."""
+    post_ids = [post.pk for post in posts]
+    comments = list(
+        Comment.objects.using(source).filter(post_id__in=post_ids)
+    )
+    # Copied first: a run stopped in between is finished by the next.
+    with transaction.atomic(using=target):
+        _copy(posts, target)
+        _copy(comments, target)
+    if target == settings.POST_ARCHIVE:
+        _archived(posts)
+    # The rows live on, so no signals: no counters, files or caches
+    # to release.
+    with transaction.atomic(using=source):
+        for model, lookup in (
+            (Timeline, 'post_id__in'),
+            (Comment, 'post_id__in'),
+            (Post, 'pk__in'),
+        ):
+            model.objects.using(source).filter(
+                **{lookup: post_ids}
+            )._raw_delete(source)
+        for post_id in post_ids:
+            search.unindex_post(post_id, using=source)
+
+
+def _move(author_id, source, target, batch_size):
+    """Move the posts of the author with their comments, by batches."""
+    moved = 0
+    while True:
+        posts = list(
+            Post.objects.using(source).filter(author_id=author_id)
+            .order_by('pk')[:batch_size]
+        )
+        if not posts:
+            return moved
+        move_posts(posts, source, target)
+        moved += len(posts)
+
+
+def rebalance(drained=(), batch_size=500, report=None):
+    """Move every post not on the shard of its author there.
+
+    Needed after POST_SHARDS changes, and once after sharding is turned
+    on, for the posts written before. ``drained`` are databases dropped
+    from POST_SHARDS; without shards everything goes back to default.
+    ``report`` is called with (author id, source, target, posts moved).
+    Returns the posts moved between each pair of databases.
+    """
+    moved = Counter()
+    sources = dict.fromkeys(
+        [DEFAULT_DB_ALIAS, *settings.POST_SHARDS, *drained]
+    )
+    for source in sources:
+        posts = Post.objects.using(source)
+        if is_enabled():
+            _register(posts, batch_size)
+        author_ids = list(
+            posts.order_by().values_list('author_id', flat=True).distinct()
+        )
+        for author_id in author_ids:
+            target = shard_for(author_id)
+            if target == source:
+                continue
+            count = _move(author_id, source, target, batch_size)
+            moved[source, target] += count
+            if report is not None:
+                report(author_id, source, target, count)
+    return moved
+
+
+class _Descending:
+    """Sort key wrapper reversing the order of one field."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+class ShardedQuerySet:
+    """The part of the QuerySet API feeds use, over several databases.
+
+    A slice asks every shard for its first rows in the feed order and
+    merges them lazily, k-way, on the ordering fields, which end with
+    the pk and so order rows completely. CursorPaginator then asks for
+    one page and one row more from every shard, as deep pages start at
+    their cursor. The archive is asked too only when the rows of a feed
+    by date reach back to its newest post, with ``archived`` if given.
+    """
+
+    def __init__(self, queryset, shards, archive=None, related=(),
+                 archived=None):
+        self._queryset = queryset
+        self._shards = list(shards)
+        self._archive = archive
+        self._related = tuple(related)
+        self._archived = archived
+        self.model = queryset.model
+
+    def _clone(self, queryset, related=None, archived=None):
+        return ShardedQuerySet(
+            queryset, self._shards, self._archive,
+            self._related if related is None else related,
+            self._archived if archived is None else archived,
+        )
+
+    def _chain(self, method, *args, **kwargs):
+        archived = self._archived
+        if archived is not None:
+            archived = getattr(archived, method)(*args, **kwargs)
+        return self._clone(
+            getattr(self._queryset, method)(*args, **kwargs),
+            archived=archived,
+        )
+
+    def _using(self, alias):
+        if alias == self._archive and self._archived is not None:
+            return self._archived.using(alias)
+        return self._queryset.using(alias)
+
+    def _databases(self):
+        if self._archive is None:
+            return self._shards
+        return [*self._shards, self._archive]
+
+    @property
+    def query(self):
+        return self._queryset.query
+
+    @property
+    def ordered(self):
+        return self._queryset.ordered
+
+    @property
+    def ordering(self):
+        return (
+            self._queryset.query.order_by
+            or self.model._meta.ordering
+        )
+
+    def all(self):
+        return self._chain('all')
+
+    def filter(self, *args, **kwargs):
+        return self._chain('filter', *args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self._chain('exclude', *args, **kwargs)
+
+    def order_by(self, *fields):
+        return self._chain('order_by', *fields)
+
+    def select_related(self, *fields):
+        # Joined rows would have to be on the same shard.
+        return self._clone(self._queryset, self._related + fields)
+
+    prefetch_related = select_related
+
+    def count(self):
+        return sum(
+            self._using(alias).count()
+            for alias in self._databases()
+        )
+
+    def exists(self):
+        return any(
+            self._using(alias).exists()
+            for alias in self._databases()
+        )
+
+    def _key(self):
+        fields = [
+            (name.lstrip('-'), name.startswith('-'))
+            for name in self.ordering
+        ]
+
+        def key(row):
+            return tuple(
+                _Descending(getattr(row, name)) if descending
+                else getattr(row, name)
+                for name, descending in fields
+            )
+        return key
+
+    def __getitem__(self, index):
+        if isinstance(index, int):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if index.step or start < 0 or stop is None or stop < 0:
+            raise ValueError('Only [start:stop] slices of a sharded feed.')
+        rows = self._merge(self._shards, stop)
+        if self._reaches_archive(rows, stop):
+            rows = self._merge([self._archive], stop, rows)
+        rows = rows[start:stop]
+        if self._related:
+            prefetch_related_objects(rows, *self._related)
+        return rows
+
+    def _merge(self, databases, stop, rows=()):
+        return list(islice(heapq.merge(
+            rows,
+            *(self._using(alias)[:stop] for alias in databases),
+            key=self._key(),
+        ), stop))
+
+    def _reaches_archive(self, rows, stop):
+        if self._archive is None:
+            return False
+        newest = archive_newest()
+        if newest is None:
+            return False
+        if len(rows) < stop or tuple(self.ordering[:1]) != ('-pub_date',):
+            return True
+        return rows[-1].pub_date <= newest
+
+    def __iter__(self):
+        # Feeds are paginated; a full read loads every database.
+        yield from heapq.merge(
+            *(self._using(alias) for alias in self._databases()),
+            key=self._key(),
+        )
+
+
+class ShardRouter(ReplicaRouter):
+    """ReplicaRouter placing posts and comments on the shard of the author.
+
+    The shard is known when the query comes with an instance: the post
+    or comment itself, the author whose posts are read or the post
+    whose comments are. Other queries of sharded models go to default;
+    views use merged() and for_post() for those.
+    """
+
+    def _shard(self, model, hints):
+        if model not in (Post, Comment):
+            return None
+        instance = hints.get('instance')
+        if isinstance(instance, (Post, Comment)) and not (
+            instance._state.adding
+        ):
+            # Where it was read from: a shard or the archive. Rows of
+            # default may be read from a replica.
+            alias = instance._state.db
+            if alias in (DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS):
+                return DEFAULT_DB_ALIAS if is_enabled() else None
+            return alias
+        if isinstance(instance, Comment):
+            if Comment.post.is_cached(instance):
+                return self._shard(Post, {'instance': instance.post})
+            return locate(instance.post_id)
+        if not is_enabled() or instance is None:
+            return None
+        if isinstance(instance, Post):
+            if instance.author_id is None:
+                return None
+            return shard_for(instance.author_id)
+        if model is Post and isinstance(instance, User):
+            return shard_for(instance.pk)
+        return None
+
+    def _elsewhere(self, hints):
+        # Users and groups of the rows on the shards are on default.
+        instance = hints.get('instance')
+        if isinstance(instance, (Post, Comment)):
+            return None
+        return super()._elsewhere(hints)
+
+    def db_for_read(self, model, **hints):
+        return self._shard(model, hints) or super().db_for_read(
+            model, **hints
+        )
+
+    def db_for_write(self, model, **hints):
+        # Marks the write, and default for the rest of the request.
+        alias = super().db_for_write(model, **hints)
+        return self._shard(model, hints) or alias
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Posts point at users and groups on default by id.
+        databases = {
+            DEFAULT_DB_ALIAS,
+            *settings.DATABASE_REPLICAS,
+            *settings.POST_SHARDS,
+            settings.POST_ARCHIVE,
+        }
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,246 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import ImageField
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_delete, pre_save,
+)
+from django.dispatch import receiver
+
+from posts import (
+    avatars, caching, counters, feeds, search, shards, thumbnails, uploads,
+    workers,
+)
+from posts.caching import scope
+from posts.models import Comment, Follow, Group, Post, Profile, UserStats
+from posts.templatetags.post_cards import card_keys
+
+User = get_user_model()
+
+# Django fills empty width/height fields whenever a model is loaded,
+# opening the file of every row not measured yet. Only new uploads are
+# measured here; existing files are left to fill_image_dimensions.
+for model, field_name in ((Post, 'image'), (Profile, 'avatar')):
+    post_init.disconnect(
+        model._meta.get_field(field_name).update_dimension_fields,
+        sender=model,
+    )
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Profile)
+def measure_upload(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    for field in instance._meta.fields:
+        if isinstance(field, ImageField) and field.width_field:
+            image = getattr(instance, field.attname)
+            if image and not image._committed:
+                field.update_dimension_fields(instance, force=True)
+
+
+# Sharded or not, so that posts written before sharding is turned on
+# never share an id with those written after.
+@receiver(pre_save, sender=Post)
+def allocate_post_id(sender, instance, raw=False, **kwargs):
+    if not raw and instance.pk is None:
+        instance.pk = shards.allocate_id(instance.author_id)
+
+
+# Cascades of users and groups do not reach the shards.
+@receiver(pre_delete, sender=User)
+def delete_sharded_content(sender, instance, **kwargs):
+    shards.delete_user_content(instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def ungroup_sharded_posts(sender, instance, **kwargs):
+    shards.ungroup_posts(instance.pk)
+
+
+@receiver(post_save, sender=User)
+def create_stats(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        UserStats.objects.get_or_create(user=instance)
+
+
+def bump_on_commit(*scopes, using=None):
+    # A page rendered before the commit, from the old rows, would be
+    # cached under the new stamps; a rollback changes no page.
+    transaction.on_commit(partial(caching.bump, *scopes), using=using)
+
+
+# Must run before count_post(), which forgets the previous group.
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_feeds(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_on_commit(
+            *caching.post_scopes(instance), using=instance._state.db
+        )
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def drop_post_cards(sender, instance, created=False, raw=False, **kwargs):
+    if not created and not raw:
+        cache.delete_many(card_keys(instance.pk))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_post_comments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_on_commit(
+            scope('post', instance.post_id), using=instance._state.db
+        )
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_feed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_on_commit(
+            scope('follow', instance.user_id),
+            scope('author', instance.author_id),
+        )
+
+
+@receiver(post_save, sender=Group)
+def invalidate_group_feeds(sender, instance, raw=False, **kwargs):
+    if not raw:
+        bump_on_commit(scope('group', instance.pk), scope('global'))
+
+
+# The avatar is part of every page its owner sees.
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_user_pages(sender, instance, raw=False, **kwargs):
+    if not raw:
+        avatars.forget(instance.user_id)
+        bump_on_commit(scope('user', instance.user_id))
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counters.shift_user(instance.author_id, 'posts_count', 1)
+        counters.shift_group(instance.group_id, 1)
+    else:
+        loaded_group_id = getattr(instance, '_loaded_group_id', None)
+        if loaded_group_id != instance.group_id:
+            counters.shift_group(loaded_group_id, -1)
+            counters.shift_group(instance.group_id, 1)
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.shift_user(instance.author_id, 'posts_count', -1)
+    counters.shift_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.shift_post(instance.post_id, 1, using=instance._state.db)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.shift_post(instance.post_id, -1, using=instance._state.db)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.shift_user(instance.author_id, 'followers_count', 1)
+        counters.shift_user(instance.user_id, 'following_count', 1)
+        feeds.enter_fan_in(instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    counters.shift_user(instance.author_id, 'followers_count', -1)
+    counters.shift_user(instance.user_id, 'following_count', -1)
+    feeds.leave_fan_in(instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def deliver_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feeds.fan_out_post(instance)
+
+
+def release_image(storage, name):
+    # Files uploaded before content addressing are left to be collected.
+    if storage.references(name):
+        storage.delete(name)
+        if not storage.exists(name):
+            uploads.forget_derived(storage, name)
+
+
+# Must run before process_post_image(), which forgets the loaded image.
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, raw=False, **kwargs):
+    loaded = getattr(instance, '_loaded_image', None)
+    if not raw and loaded and loaded != instance.image.name:
+        transaction.on_commit(
+            partial(release_image, instance.image.storage, loaded)
+        )
+
+
+@receiver(post_delete, sender=Post)
+def release_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        transaction.on_commit(partial(
+            release_image, instance.image.storage, instance.image.name
+        ))
+
+
+@receiver(post_save, sender=Post)
+def process_post_image(sender, instance, raw=False, **kwargs):
+    image = instance.image.name
+    if not raw and image and image != getattr(instance, '_loaded_image', None):
+        transaction.on_commit(partial(
+            thumbnails.schedule, instance.pk, uploads.process_post_image
+        ))
+    instance._loaded_image = image
+
+
+@receiver(post_save, sender=Profile)
+def process_avatar(sender, instance, raw=False, **kwargs):
+    avatar = instance.avatar.name
+    if not raw and avatar and avatar != getattr(
+        instance, '_loaded_avatar', None
+    ):
+        transaction.on_commit(partial(
+            workers.submit, uploads.process_avatar, instance.pk
+        ))
+    instance._loaded_avatar = avatar
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    search.unindex_post(instance.pk, using=instance._state.db)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_follower_timeline(sender, instance, created, raw=False,
+                               **kwargs):
+    if created and not raw:
+        feeds.backfill_timeline(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_follower_timeline(sender, instance, **kwargs):
+    feeds.prune_timeline(instance.user_id, instance.author_id)
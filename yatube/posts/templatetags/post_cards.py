@@ -0,0 +1,81 @@
+import hashlib
+
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from posts.thumbnails import post_thumbnails
+from posts.variants import srcsets
+
+register = template.Library()
+
+CARD_KEY = 'post-card:{}:{:d}{:d}'
+CARD_TEMPLATE = 'posts/includes/post.html'
+
+
+def card_keys(post_id):
+    return [
+        CARD_KEY.format(post_id, show_autor, show_group)
+        for show_autor in (False, True) for show_group in (False, True)
+    ]
+
+
+def card_digest(post):
+    """Changes whenever anything the card shows changes."""
+    group = post.group
+    parts = (
+        post.text,
+        post.pub_date.isoformat(),
+        post.image.name,
+        post.image_placeholder,
+        post.author.username,
+        post.author.get_full_name(),
+        group.slug if group else '',
+        group.title if group else '',
+    )
+    return hashlib.md5('\x00'.join(parts).encode()).hexdigest()
+
+
+@register.simple_tag
+def post_cards(posts, show_autor=False, show_group=False):
+    """Rendered post.html of every post, as (post, html) pairs.
+
+    Cards are shared by all feeds and fetched for the whole page with one
+    get_many(). A card is stored with the digest of what it shows, so a
+    stale one is never served; edits and deletes also drop it by signal.
+    Thumbnails and srcset variants of the cards to render are looked up
+    together as well.
+    """
+    posts = list(posts)
+    keys = {
+        post.pk: CARD_KEY.format(post.pk, bool(show_autor), bool(show_group))
+        for post in posts
+    }
+    cached = cache.get_many(keys.values())
+    digests = {post.pk: card_digest(post) for post in posts}
+    html = {}
+    for post in posts:
+        entry = cached.get(keys[post.pk])
+        if entry is not None and entry[0] == digests[post.pk]:
+            html[post.pk] = entry[1]
+    stale = [post for post in posts if post.pk not in html]
+    thumbnails = post_thumbnails(stale)
+    images = srcsets([post.image for post in stale], 'post')
+    missing = {}
+    for post in stale:
+        thumbnail = thumbnails.get(post.pk)
+        html[post.pk] = render_to_string(CARD_TEMPLATE, {
+            'post': post,
+            'thumbnail': thumbnail,
+            'srcsets': images.get(post.image.name, {}),
+            'show_autor': show_autor,
+            'show_group': show_group,
+        })
+        # A card with a placeholder is not kept, the thumbnail is due.
+        if thumbnail is not None or not post.image:
+            missing[keys[post.pk]] = (digests[post.pk], html[post.pk])
+    if missing:
+        cache.set_many(missing, timeout=settings.POST_CARD_CACHE_TIMEOUT)
+    return [(post, mark_safe(html[post.pk])) for post in posts]
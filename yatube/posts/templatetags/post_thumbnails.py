@@ -0,0 +1,12 @@
+from django import template
+
+from posts import thumbnails, variants
+
+register = template.Library()
+
+register.simple_tag(thumbnails.post_thumbnail, name='post_thumbnail')
+
+
+@register.simple_tag
+def post_srcsets(post):
+    return variants.srcsets([post.image], 'post').get(post.image.name, {})
@@ -0,0 +1,12 @@
+from django import template
+
+from posts import avatars
+
+register = template.Library()
+
+
+@register.simple_tag
+def header_avatar(user):
+    if not user.is_authenticated:
+        return None
+    return avatars.header_avatar(user.pk)
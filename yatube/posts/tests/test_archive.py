@@ -0,0 +1,158 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import archive, shards
+from posts.models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+ARCHIVE = 'archive'
+
+
+@override_settings(POST_ARCHIVE=ARCHIVE, POST_ARCHIVE_AFTER_DAYS=50)
+class ArchiveTests(TestCase):
+    databases = {DEFAULT_DB_ALIAS, ARCHIVE}
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.client.force_login(self.author)
+        now = timezone.now()
+        self.posts = []
+        for number in range(6):
+            post = Post.objects.create(
+                text=f'Пост {number}', author=self.author,
+            )
+            # The last three are old enough for the archive.
+            post.pub_date = now - timedelta(days=20 * number)
+            post.save(update_fields=['pub_date'])
+            self.posts.append(post)
+        self.old = self.posts[3:]
+        Comment.objects.create(
+            post=self.old[0], author=self.author, text='Старый комментарий',
+        )
+        call_command('archive_posts', stdout=StringIO())
+
+    def test_old_posts_moved_with_comments(self):
+        """Старые посты уходят в архив вместе с комментариями."""
+        self.assertEqual(
+            sorted(Post.objects.using(ARCHIVE).values_list('pk', flat=True)),
+            [post.pk for post in self.old],
+        )
+        self.assertEqual(Post.objects.using(DEFAULT_DB_ALIAS).count(), 3)
+        self.assertEqual(Comment.objects.using(ARCHIVE).count(), 1)
+        self.assertFalse(Comment.objects.using(DEFAULT_DB_ALIAS).exists())
+        self.assertEqual(
+            shards.archive_newest(), self.old[0].pub_date
+        )
+
+    def test_newest_raised_by_batches(self):
+        """Дата новейшего поста архива растёт с каждой партией."""
+        shards.archive_newest()
+        newest = []
+        archive.archive_posts(
+            days=10, batch_size=1,
+            report=lambda source, count: newest.append(
+                shards.archive_newest()
+            ),
+        )
+        self.assertEqual(
+            newest, [self.posts[2].pub_date, self.posts[1].pub_date]
+        )
+
+    def test_counters_reconciled_with_archive(self):
+        """Сверка счетчиков учитывает посты в архиве."""
+        group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.using(ARCHIVE).filter(pk=self.old[0].pk).update(
+            group=group
+        )
+        Group.objects.filter(pk=group.pk).update(posts_count=1)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 6
+        )
+        self.assertEqual(Group.objects.get(pk=group.pk).posts_count, 1)
+        self.assertEqual(
+            Post.objects.using(ARCHIVE).get(pk=self.old[0].pk).comments_count,
+            1,
+        )
+
+    def test_archived_post_found(self):
+        """Пост из архива открывается и комментируется как обычный."""
+        post = self.old[0]
+        url = reverse('posts:post_detail', args=[post.pk])
+        self.assertContains(self.client.get(url), 'Старый комментарий')
+        self.client.post(
+            reverse('posts:add_comment', args=[post.pk]),
+            {'text': 'Новый комментарий'},
+        )
+        self.assertEqual(
+            Comment.objects.using(ARCHIVE).filter(post_id=post.pk).count(), 2
+        )
+        self.client.post(
+            reverse('posts:post_edit', args=[post.pk]),
+            {'text': 'Исправленный пост'},
+        )
+        post = Post.objects.using(ARCHIVE).get(pk=post.pk)
+        self.assertEqual(post.text, 'Исправленный пост')
+
+    def test_feeds_reach_archive(self):
+        """Профиль и глубокие страницы ленты дочитывают архив."""
+        expected = [post.pk for post in self.posts]
+        with self.settings(POSTS_ON_PAGE=2):
+            for url in (
+                reverse('posts:index'),
+                reverse('posts:profile', args=[self.author.username]),
+            ):
+                pages = []
+                params = {}
+                for _ in range(3):
+                    page = self.client.get(url, params).context['page_obj']
+                    pages.extend(post.pk for post in page)
+                    params = {'cursor': page.next_cursor}
+                self.assertEqual(pages, expected)
+
+    def test_follow_feed_reaches_archive(self):
+        """Лента подписок дочитывает архив, с лентами и без них."""
+        follower = User.objects.create_user(username='follower')
+        Follow.objects.create(user=follower, author=self.author)
+        self.client.force_login(follower)
+        expected = [post.pk for post in self.posts]
+        # Read from the timeline, then at query time as of a fan-in author.
+        for fan_in in (False, True):
+            UserStats.objects.filter(user=self.author).update(fan_in=fan_in)
+            cache.clear()
+            with self.settings(POSTS_ON_PAGE=2):
+                pages = []
+                params = {}
+                for _ in range(3):
+                    page = self.client.get(
+                        reverse('posts:follow_index'), params
+                    ).context['page_obj']
+                    pages.extend(post.pk for post in page)
+                    params = {'cursor': page.next_cursor}
+                self.assertEqual(pages, expected)
+
+    def test_first_page_skips_archive(self):
+        """Первая страница новее архива не читает его."""
+        feed = shards.merged(Post.objects.all())
+        shards.archive_newest()
+        with self.assertNumQueries(0, using=ARCHIVE):
+            self.assertEqual(
+                [post.pk for post in feed[0:2]],
+                [post.pk for post in self.posts[:2]],
+            )
+
+    def test_no_archive(self):
+        """Без архивной базы команда отказывается работать."""
+        with self.settings(POST_ARCHIVE=None):
+            with self.assertRaises(CommandError):
+                call_command('archive_posts', stdout=StringIO())
@@ -1,5 +1,6 @@
 import shutil
 import tempfile
+from hashlib import sha256
 from http import HTTPStatus
 
 from django.conf import settings
@@ -42,7 +43,13 @@ class PostFormTests(TestCase):
             content=small_gif,
             content_type='image/gif'
         )
-        cls.DIR_UPLOAD_TO = cls.post._meta.get_field('image').upload_to
+        image_field = cls.post._meta.get_field('image')
+        cls.DIR_UPLOAD_TO = image_field.upload_to
+        # Images are stored under the hash of their content.
+        cls.image_name = image_field.storage.hashed_name(
+            f'{cls.DIR_UPLOAD_TO}{cls.uploaded}',
+            sha256(small_gif).hexdigest(),
+        )
 
     @classmethod
     def tearDownClass(cls):
@@ -65,7 +72,7 @@ class PostFormTests(TestCase):
                 text=text_for_post,
                 author=self.author,
                 group=self.group.id,
-                image=f'{self.DIR_UPLOAD_TO}{self.uploaded}',
+                image=self.image_name,
             ).exists()
         )
         form_data = {
@@ -88,7 +95,7 @@ class PostFormTests(TestCase):
                 text=text_for_post,
                 author=self.author,
                 group=self.group.id,
-                image=f'{self.DIR_UPLOAD_TO}{self.uploaded}',
+                image=self.image_name,
             ).exists()
         )
 
@@ -1,7 +1,10 @@
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
 from django.test import TestCase
 
-from posts.models import Comment, Follow, Group, Post, Profile
+from posts.models import Comment, Follow, Group, Post, Profile, UserStats
 
 User = get_user_model()
 
@@ -96,3 +99,65 @@ class GroupModelTests(TestCase):
         max_length_slug = self.group._meta.get_field('slug').max_length
         length_slug = len(self.group.slug)
         self.assertEqual(max_length_slug, length_slug)
+
+
+class CountersModelTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestName')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(
+            title='Тестовый заголовок',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-slug',
+            description='Тестовое описание',
+        )
+
+    def refresh(self, *objects):
+        for obj in objects:
+            obj.refresh_from_db()
+
+    def test_counters_follow_changes(self):
+        """Счетчики меняются вместе с постами, комментариями и подписками."""
+        post = Post.objects.create(
+            text='Тестовый пост', author=self.author, group=self.group
+        )
+        Comment.objects.create(post=post, author=self.reader, text='Ок')
+        Follow.objects.create(user=self.reader, author=self.author)
+        stats, reader_stats = self.author.stats, self.reader.stats
+        self.refresh(stats, reader_stats, post, self.group)
+        self.assertEqual(stats.posts_count, 1)
+        self.assertEqual(stats.followers_count, 1)
+        self.assertEqual(reader_stats.following_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        post.group = self.other_group
+        post.save()
+        self.refresh(self.group, self.other_group)
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.other_group.posts_count, 1)
+        post.delete()
+        Follow.objects.all().delete()
+        self.refresh(stats, reader_stats, self.other_group)
+        self.assertEqual(stats.posts_count, 0)
+        self.assertEqual(stats.followers_count, 0)
+        self.assertEqual(reader_stats.following_count, 0)
+        self.assertEqual(self.other_group.posts_count, 0)
+
+    def test_reconcile_counters_command(self):
+        """Команда reconcile_counters исправляет расхождения счетчиков."""
+        Post.objects.bulk_create([
+            Post(text='Тестовый пост', author=self.author, group=self.group)
+            for _ in range(3)
+        ])
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('reconcile_counters', stdout=StringIO())
+        self.refresh(self.author.stats, self.group)
+        self.assertEqual(self.author.stats.posts_count, 3)
+        self.assertEqual(self.group.posts_count, 3)
+        self.assertTrue(UserStats.objects.filter(user=self.reader).exists())
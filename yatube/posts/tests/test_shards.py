@@ -0,0 +1,294 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.queries import QueryRecorder
+from posts import counters, shards
+from posts.models import Comment, Follow, Group, Post, PostLocation
+
+User = get_user_model()
+SHARDS = ['posts_1', 'posts_2']
+ARCHIVE = 'archive'
+
+
+def authors_on_each_shard():
+    """Users landing on different shards, one per shard."""
+    found = {}
+    number = 0
+    while len(found) < len(SHARDS):
+        user = User.objects.create_user(username=f'author{number}')
+        found.setdefault(shards.shard_for(user.pk, SHARDS), user)
+        number += 1
+    return [found[alias] for alias in SHARDS]
+
+
+class ShardForTests(TestCase):
+    def test_stable_and_spread(self):
+        """Автор всегда попадает на один шард, а авторы - на все."""
+        placed = [
+            shards.shard_for(author_id, SHARDS) for author_id in range(1000)
+        ]
+        self.assertEqual(placed, [
+            shards.shard_for(author_id, SHARDS) for author_id in range(1000)
+        ])
+        for alias in SHARDS:
+            self.assertGreater(placed.count(alias), 400)
+
+    def test_new_shard_moves_few_authors(self):
+        """Новый шард забирает авторов только себе."""
+        more = [*SHARDS, 'posts_3']
+        for author_id in range(1000):
+            moved_to = shards.shard_for(author_id, more)
+            if moved_to != shards.shard_for(author_id, SHARDS):
+                self.assertEqual(moved_to, 'posts_3')
+
+    def test_disabled(self):
+        """Без шардов все посты в основной базе."""
+        self.assertEqual(shards.shard_for(1), DEFAULT_DB_ALIAS)
+        self.assertIsNone(shards.locate(1))
+
+
+@override_settings(POST_SHARDS=SHARDS)
+class ShardedPostsTests(TestCase):
+    databases = {DEFAULT_DB_ALIAS, *SHARDS, ARCHIVE}
+
+    def setUp(self):
+        cache.clear()
+        self.first, self.second = authors_on_each_shard()
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание',
+        )
+        self.client.force_login(self.first)
+        now = timezone.now()
+        self.posts = []
+        for number in range(6):
+            author = (self.first, self.second)[number % 2]
+            post = Post.objects.create(
+                text=f'Пост {number}', author=author, group=self.group,
+            )
+            # Alternate the shards along the feed.
+            post.pub_date = now - timedelta(minutes=number)
+            post.save(update_fields=['pub_date'])
+            self.posts.append(post)
+
+    def test_posts_on_author_shard(self):
+        """Посты лежат на шарде автора, номера выдает каталог."""
+        for post in self.posts:
+            alias = shards.shard_for(post.author_id)
+            self.assertEqual(post._state.db, alias)
+            self.assertTrue(Post.objects.using(alias).filter(
+                pk=post.pk
+            ).exists())
+            self.assertEqual(shards.locate(post.pk), alias)
+        self.assertFalse(
+            Post.objects.using(DEFAULT_DB_ALIAS).exists()
+        )
+        self.assertEqual(
+            PostLocation.objects.count(), len(self.posts)
+        )
+        self.first.stats.refresh_from_db()
+        self.assertEqual(self.first.stats.posts_count, 3)
+
+    @override_settings(POST_ARCHIVE=ARCHIVE)
+    def test_budgets_scaled_to_databases(self):
+        """С шардами и архивом бюджет запросов растет по числу баз."""
+        Follow.objects.create(user=self.first, author=self.second)
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'url': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.second}),
+            reverse('posts:post_detail', kwargs={'post_id': self.posts[1].pk}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+        cache.clear()
+        with QueryRecorder().record() as recorder:
+            self.client.get(reverse('posts:index'))
+        # Over the budget of one database.
+        self.assertGreater(
+            len(recorder), settings.QUERY_BUDGETS['posts:index']
+        )
+
+    def test_created_and_commented_through_views(self):
+        """Пост и комментарии к нему создаются на шарде автора поста."""
+        self.client.post(reverse('posts:post_create'), {'text': 'Новый'})
+        alias = shards.shard_for(self.first.pk)
+        post = Post.objects.using(alias).get(text='Новый')
+        self.client.force_login(self.second)
+        self.client.post(
+            reverse('posts:add_comment', args=[post.pk]),
+            {'text': 'Комментарий'},
+        )
+        comment = Comment.objects.using(alias).get()
+        self.assertEqual(comment.author, self.second)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        response = self.client.get(
+            reverse('posts:post_detail', args=[post.pk])
+        )
+        self.assertContains(response, 'Комментарий')
+
+    def test_feeds_merge_shards(self):
+        """Ленты сливают шарды в порядке дат и листаются курсором."""
+        expected = [post.pk for post in self.posts]
+        with self.settings(POSTS_ON_PAGE=4):
+            for url in (
+                reverse('posts:index'),
+                reverse('posts:group_list', args=['group']),
+            ):
+                response = self.client.get(url)
+                page = response.context['page_obj']
+                self.assertEqual(
+                    [post.pk for post in page], expected[:4]
+                )
+                response = self.client.get(
+                    url, {'cursor': page.next_cursor}
+                )
+                self.assertEqual(
+                    [post.pk for post in response.context['page_obj']],
+                    expected[4:],
+                )
+
+    def test_merged_slices(self):
+        """Срез слитого запроса совпадает со срезом общей ленты."""
+        feed = shards.merged(Post.objects.all())
+        expected = [post.pk for post in self.posts]
+        self.assertEqual(feed.count(), 6)
+        self.assertEqual([post.pk for post in feed[1:4]], expected[1:4])
+        self.assertEqual(feed[5].pk, expected[5])
+        oldest_first = feed.order_by('pub_date', 'pk')
+        self.assertEqual(
+            [post.pk for post in oldest_first[0:6]], expected[::-1]
+        )
+
+    def test_profile_and_follow_feed(self):
+        """Профиль читает шард автора, лента подписок - шарды авторов."""
+        response = self.client.get(
+            reverse('posts:profile', args=[self.second.username])
+        )
+        self.assertEqual(
+            [post.author for post in response.context['page_obj']],
+            [self.second] * 3,
+        )
+        Follow.objects.create(user=self.first, author=self.second)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            [post.pk for post in response.context['page_obj']],
+            [post.pk for post in self.posts[1::2]],
+        )
+
+    def test_reconcile_across_shards(self):
+        """Сверка счетчиков считает посты на всех шардах."""
+        self.first.stats.posts_count = 0
+        self.first.stats.save()
+        self.group.posts_count = 0
+        self.group.save()
+        fixed = counters.reconcile()
+        self.assertEqual(fixed['userstats.posts_count'], 1)
+        self.assertEqual(fixed['group.posts_count'], 1)
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 6)
+
+    def test_deleted_user_and_group(self):
+        """Удаление автора и группы доходит до шардов."""
+        self.group.delete()
+        self.assertFalse(any(
+            queryset.filter(group__isnull=False).exists()
+            for queryset in shards.everywhere(Post.objects.all())
+        ))
+        self.second.delete()
+        self.assertEqual(
+            shards.merged(Post.objects.all()).count(), 3
+        )
+
+
+@override_settings(POST_SHARDS=SHARDS)
+class RebalanceTests(TestCase):
+    databases = {DEFAULT_DB_ALIAS, *SHARDS}
+
+    def test_move_to_shards_and_back(self):
+        """Посты, записанные до шардов, переезжают с комментариями и
+        возвращаются обратно."""
+        cache.clear()
+        first, second = authors_on_each_shard()
+        with self.settings(POST_SHARDS=[]):
+            posts = [
+                Post.objects.create(text=f'Старый пост {author}',
+                                    author=author)
+                for author in (first, second)
+            ]
+            Comment.objects.create(
+                post=posts[0], author=second, text='Комментарий',
+            )
+        call_command(
+            'rebalance_shards', '--batch-size=1', stdout=StringIO()
+        )
+        self.assertFalse(Post.objects.using(DEFAULT_DB_ALIAS).exists())
+        for post in posts:
+            alias = shards.shard_for(post.author_id)
+            moved = Post.objects.using(alias).get(pk=post.pk)
+            self.assertEqual(moved.pub_date, post.pub_date)
+            self.assertEqual(shards.locate(post.pk), alias)
+        self.assertEqual(
+            Comment.objects.using(shards.shard_for(first.pk)).count(), 1
+        )
+        response = self.client.get(reverse('posts:index'), {'srch': 'Старый'})
+        self.assertEqual(len(response.context['page_obj']), 2)
+        new = Post.objects.create(text='Новый пост', author=first)
+        self.assertGreater(new.pk, max(post.pk for post in posts))
+
+        with self.settings(POST_SHARDS=[]):
+            call_command(
+                'rebalance_shards', *SHARDS, stdout=StringIO()
+            )
+            self.assertEqual(Post.objects.count(), 3)
+            self.assertEqual(Comment.objects.count(), 1)
+        for alias in SHARDS:
+            self.assertFalse(Post.objects.using(alias).exists())
+
+    def test_shards_enabled_over_existing_posts(self):
+        """Посты после включения шардов не занимают номера старых, а
+        старые видны до переноса."""
+        cache.clear()
+        first, second = authors_on_each_shard()
+        with self.settings(POST_SHARDS=[]):
+            old = Post.objects.create(text='Старый пост', author=first)
+        new = Post.objects.create(text='Новый пост', author=second)
+        self.assertGreater(new.pk, old.pk)
+        self.assertEqual(
+            shards.authors([old.pk, new.pk]),
+            {old.pk: first.pk, new.pk: second.pk},
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', args=[old.pk])
+        )
+        self.assertContains(response, 'Старый пост')
+        call_command('rebalance_shards', stdout=StringIO())
+        self.assertEqual(shards.merged(Post.objects.all()).count(), 2)
+
+    def test_move_refuses_other_row(self):
+        """Перенос не затирает другой пост с тем же номером."""
+        cache.clear()
+        first, second = authors_on_each_shard()
+        with self.settings(POST_SHARDS=[]):
+            post = Post.objects.create(text='Пост', author=first)
+        target = shards.shard_for(first.pk)
+        Post(
+            pk=post.pk, text='Чужой пост', author=second,
+            pub_date=post.pub_date, updated_at=post.updated_at,
+        ).save_base(using=target, raw=True, force_insert=True)
+        with self.assertRaises(IntegrityError):
+            shards.move_posts([post], DEFAULT_DB_ALIAS, target)
+        self.assertTrue(
+            Post.objects.using(DEFAULT_DB_ALIAS).filter(pk=post.pk).exists()
+        )
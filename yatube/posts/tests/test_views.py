@@ -1,22 +1,47 @@
 import shutil
 import tempfile
+from hashlib import sha256
 from http import HTTPStatus
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
+from PIL import Image
 
+from core import locks
+from core.middleware import MicrocacheMiddleware
+from core.queries import QueryBudgetExceeded, query_budget
 from posts.forms import CommentForm, PostForm, ProfileForm
-from posts.models import Comment, Follow, Group, Post
+from posts.models import (
+    Comment, Follow, Group, ImageVariant, Post, Profile, Timeline,
+)
+from posts import caching, feeds, search, thumbnails, uploads, workers
+from posts.templatetags.post_cards import card_keys, post_cards
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
 
 
+def run_commit_hooks():
+    """Run the on_commit() callbacks the transaction of the test holds."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
 class PagesViewsTests(TestCase):
     @classmethod
@@ -60,7 +85,13 @@ class PagesViewsTests(TestCase):
             user=cls.author,
             author=cls.not_author
         )
-        cls.DIR_UPLOAD_TO = cls.post._meta.get_field('image').upload_to
+        image_field = cls.post._meta.get_field('image')
+        cls.DIR_UPLOAD_TO = image_field.upload_to
+        # Images are stored under the hash of their content.
+        cls.image_name = image_field.storage.hashed_name(
+            f'{cls.DIR_UPLOAD_TO}{cls.uploaded}',
+            sha256(small_gif).hexdigest(),
+        )
         cls.name_kwargs_template = {
             'index': ('posts:index', None, 'posts/index.html'),
             'group_list': (
@@ -113,7 +144,7 @@ class PagesViewsTests(TestCase):
         )
         self.assertEqual(first_object.group.title, self.post.group.title)
         self.assertEqual(
-            first_object.image, f'{self.DIR_UPLOAD_TO}{self.uploaded}'
+            first_object.image, self.image_name
         )
 
     def check_PostForm_in_context(self, response):
@@ -181,7 +212,7 @@ class PagesViewsTests(TestCase):
         )
         self.assertEqual(
             response.context['post'].image,
-            f'{self.DIR_UPLOAD_TO}{self.uploaded}'
+            self.image_name
         )
         self.assertIn('user', response.context)
         self.assertEqual(
@@ -261,33 +292,55 @@ class PagesViewsTests(TestCase):
         count = Post.objects.filter(author=self.author).count()
         self.assertEqual(response.context['count'], count)
 
+    def test_profile_and_detail_need_no_count(self):
+        """Профайл и страница поста берут счетчики без COUNT-запросов."""
+        for page in ('profile', 'detail'):
+            viewname, kwargs, _, = self.name_kwargs_template[page]
+            with self.subTest(page=page):
+                with CaptureQueriesContext(connection) as queries:
+                    self.author_client.get(reverse(viewname, kwargs=kwargs))
+                self.assertFalse(
+                    [q for q in queries if 'COUNT(' in q['sql'].upper()]
+                )
+
     def test_cache(self):
-        """Главная страница сайта кеширует содержимое на 20 секунд"""
+        """Ленты кешируются до изменения постов в них."""
         viewname, _, _, = self.name_kwargs_template['index']
         response = self.client.get(reverse(viewname))
         text_for_post = 'Тестирование cache'
         self.assertNotIn(
             text_for_post, response.content.decode('utf-8')
         )
+        with CaptureQueriesContext(connection) as queries:
+            cached_response = self.client.get(reverse(viewname))
+        self.assertEqual(response.content, cached_response.content)
+        self.assertFalse(
+            [q for q in queries if 'posts_post' in q['sql']]
+        )
         Post.objects.create(
             text=text_for_post,
             author=self.author,
             group=self.group,
         )
-        response_after_add_post = self.client.get(reverse(viewname))
-        self.assertEqual(response.content, response_after_add_post.content)
-        self.assertNotIn(
-            text_for_post,
-            response_after_add_post.content.decode('utf-8')
-        )
-        cache.clear()  # time.sleep(20)
-        response_after_clear_cache = self.client.get(reverse(viewname))
-        self.assertNotEqual(
-            response_after_add_post.content, response_after_clear_cache.content
-        )
+        run_commit_hooks()
+        for page in ('index', 'group_list', 'profile'):
+            viewname, kwargs, _, = self.name_kwargs_template[page]
+            with self.subTest(page=page):
+                response_after_add_post = self.client.get(
+                    reverse(viewname, kwargs=kwargs)
+                )
+                self.assertIn(
+                    text_for_post,
+                    response_after_add_post.content.decode('utf-8')
+                )
+
+    def test_cache_depends_on_authentication(self):
+        """Гость и авторизованный пользователь получают разные фрагменты."""
+        viewname, _, _, = self.name_kwargs_template['index']
+        self.client.get(reverse(viewname))
+        response = self.author_client.get(reverse(viewname))
         self.assertIn(
-            text_for_post,
-            response_after_clear_cache.content.decode('utf-8')
+            reverse('posts:follow_index'), response.content.decode('utf-8')
         )
 
 
@@ -356,6 +409,36 @@ class PaginatorViewsTests(TestCase):
             with self.subTest(reverse_name=reverse_name):
                 response = self.not_author_client.get(reverse_name)
 
+    def test_cursor_pages(self):
+        """Курсоры ведут на следующую и предыдущую страницы без COUNT."""
+        url = reverse('posts:index')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse(
+            [q for q in queries if 'COUNT(' in q['sql'].upper()]
+        )
+        first_page = response.context['page_obj']
+        self.assertTrue(first_page.has_next())
+        self.assertFalse(first_page.previous_cursor)
+        response = self.client.get(
+            url, {'cursor': str(first_page.next_cursor)}
+        )
+        second_page = response.context['page_obj']
+        self.assertEqual(second_page.number, 2)
+        self.assertEqual(
+            len(second_page), 13 - settings.POSTS_ON_PAGE
+        )
+        self.assertFalse(second_page.has_next())
+        self.assertFalse(set(first_page) & set(second_page))
+        response = self.client.get(
+            url, {'cursor': str(second_page.previous_cursor)}
+        )
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page)
+        )
+        response = self.client.get(url, {'cursor': 'broken'})
+        self.assertEqual(response.context['page_obj'].number, 1)
+
 
 class PostViewsTests(TestCase):
     @classmethod
@@ -517,3 +600,811 @@ class FollowViewsTests(TestCase):
         self.assertNotIn(
             text_for_post, response.content.decode('utf-8')
         )
+
+    def test_timeline_backfill_and_prune(self):
+        """Подписка переносит посты автора в ленту, отписка убирает их."""
+        Follow.objects.create(user=self.subscriber, author=self.author)
+        self.assertTrue(
+            Timeline.objects.filter(
+                user=self.subscriber, post=self.post
+            ).exists()
+        )
+        Follow.objects.filter(
+            user=self.subscriber, author=self.author
+        ).delete()
+        self.assertFalse(
+            Timeline.objects.filter(user=self.subscriber).exists()
+        )
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_fan_in_author_post_shows_for_subscriber(self):
+        """Посты авторов с большой аудиторией читаются без раскладки."""
+        Follow.objects.create(user=self.subscriber, author=self.author)
+        new_post = Post.objects.create(
+            text='Пост популярного автора',
+            author=self.author,
+        )
+        self.assertFalse(Timeline.objects.filter(post=new_post).exists())
+        response = self.subscriber_client.get(reverse('posts:follow_index'))
+        self.assertIn(new_post, response.context['page_obj'])
+
+    @override_settings(
+        FEED_FANOUT_MAX_FOLLOWERS=2, FEED_FANOUT_RESUME_FOLLOWERS=1
+    )
+    def test_fan_in_author_fanned_out_below_limit(self):
+        """Посты, написанные при большой аудитории, раскладываются в ленты,
+        когда она уменьшается до FEED_FANOUT_RESUME_FOLLOWERS."""
+        other = User.objects.create_user(username='other')
+        for user in (self.subscriber, self.unsubscriber, other):
+            Follow.objects.create(user=user, author=self.author)
+        new_post = Post.objects.create(
+            text='Пост популярного автора',
+            author=self.author,
+        )
+        self.assertFalse(Timeline.objects.filter(post=new_post).exists())
+        for user, fanned_out in ((other, False), (self.unsubscriber, True)):
+            Follow.objects.filter(user=user).delete()
+            run_commit_hooks()
+            self.assertIs(
+                Timeline.objects.filter(
+                    user=self.subscriber, post=new_post
+                ).exists(),
+                fanned_out,
+            )
+            self.assertIs(
+                feeds.is_fan_in_author(self.author.pk), not fanned_out
+            )
+        response = self.subscriber_client.get(reverse('posts:follow_index'))
+        self.assertIn(new_post, response.context['page_obj'])
+
+    def test_rebuild_timelines_command(self):
+        """Команда rebuild_timelines восстанавливает ленты подписок."""
+        Follow.objects.create(user=self.subscriber, author=self.author)
+        Timeline.objects.all().delete()
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.assertTrue(
+            Timeline.objects.filter(
+                user=self.subscriber, post=self.post
+            ).exists()
+        )
+
+
+class SearchViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestName')
+        cls.mixed_case_post = Post.objects.create(
+            text='ПрИвет, МиР кириллицы',
+            author=cls.author,
+        )
+        cls.frequent_post = Post.objects.create(
+            text='мир мир мир',
+            author=cls.author,
+        )
+        cls.other_post = Post.objects.create(
+            text='Совсем другой текст',
+            author=cls.author,
+        )
+
+    def search(self, keyword):
+        response = self.client.get(reverse('posts:index'), {'srch': keyword})
+        return list(response.context['page_obj'])
+
+    def test_search_ignores_case_of_cyrillic(self):
+        """Поиск находит посты независимо от регистра кириллицы."""
+        for keyword in ('привет', 'ПРИВЕТ', 'пРиВеТ'):
+            with self.subTest(keyword=keyword):
+                self.assertEqual(
+                    self.search(keyword), [self.mixed_case_post]
+                )
+
+    def test_search_ranks_by_relevance(self):
+        """Более релевантные посты идут в выдаче первыми."""
+        self.assertEqual(
+            self.search('мир'), [self.frequent_post, self.mixed_case_post]
+        )
+
+    def test_search_index_follows_changes(self):
+        """Индекс обновляется при изменении и удалении поста."""
+        self.other_post.text = 'Теперь про мир'
+        self.other_post.save()
+        self.assertIn(self.other_post, self.search('мир'))
+        self.other_post.delete()
+        self.assertNotIn(self.other_post, self.search('мир'))
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.search('кириллицы'), [self.mixed_case_post])
+
+    @override_settings(SEARCH_STEMMING=True)
+    def test_stemming_without_package_refused(self):
+        """Стемминг без пакета snowballstemmer не отключается молча."""
+        with mock.patch.object(search, 'snowballstemmer', None):
+            with self.assertRaises(ImproperlyConfigured):
+                search.terms('мир')
+
+
+class QueryBudgetViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(
+            title='Тестовый заголовок',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for i in range(settings.POSTS_ON_PAGE + 2):
+            author = User.objects.create_user(username=f'Author{i}')
+            post = Post.objects.create(
+                text=f'Тестовый пост {i}', author=author, group=cls.group
+            )
+            Follow.objects.create(user=cls.reader, author=author)
+        cls.post = post
+        cls.author = author
+        for follow in Follow.objects.all():
+            Comment.objects.create(
+                post=post, author=follow.author, text='Тестовый коммент'
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_hot_views_fit_query_budget(self):
+        """Ленты и страница поста укладываются в бюджет запросов без N+1."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'url': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.id}),
+            reverse('posts:follow_index'),
+        )
+        for client in (self.client, self.reader_client):
+            for url in urls:
+                with self.subTest(url=url):
+                    self.assertIn(
+                        client.get(url).status_code,
+                        (HTTPStatus.OK, HTTPStatus.FOUND),
+                    )
+
+    def test_query_budget_detects_n_plus_one(self):
+        """query_budget находит повторяющиеся запросы."""
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(100):
+                for post in Post.objects.all()[:3]:
+                    post.author.username
+
+
+class PostCardsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestName')
+        cls.post = Post.objects.create(
+            text='Тестовый пост',
+            author=cls.author,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cards_are_shared_between_feeds(self):
+        """Карточка поста рендерится один раз и берется из кеша."""
+        post_cards([self.post], show_group=True)
+        with mock.patch(
+            'posts.templatetags.post_cards.render_to_string'
+        ) as render:
+            (post, card), = post_cards([self.post], show_group=True)
+        render.assert_not_called()
+        self.assertIn(self.post.text, card)
+
+    def test_card_changes_with_post(self):
+        """После правки или удаления поста карточка рендерится заново."""
+        post_cards([self.post])
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        self.assertFalse(cache.get_many(card_keys(self.post.pk)))
+        post = Post.objects.select_related('author').get(pk=self.post.pk)
+        (_, card), = post_cards([post])
+        self.assertIn('Исправленный пост', card)
+        self.post.author.first_name = 'Новое имя'
+        (_, card), = post_cards([self.post], show_autor=True)
+        self.assertIn('Новое имя', card)
+
+
+@override_settings(MICROCACHE_ENABLED=True)
+class MicrocacheViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestName')
+        Post.objects.create(text='Тестовый пост', author=cls.author)
+        cls.url = reverse('posts:index')
+
+    def setUp(self):
+        cache.clear()
+
+    def expire_entry(self):
+        key = MicrocacheMiddleware.cache_key(self.url)
+        _, *entry = cache.get(key)
+        cache.set(key, (0, *entry))
+        return key
+
+    def test_anonymous_page_is_cached(self):
+        """Гость получает страницу из микрокеша, пользователь - нет."""
+        self.assertEqual(self.client.get(self.url)['X-Microcache'], 'MISS')
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Microcache'], 'HIT')
+        author_client = Client()
+        author_client.force_login(self.author)
+        self.assertFalse(author_client.get(self.url).has_header(
+            'X-Microcache'
+        ))
+
+    def test_stale_page_served_while_refreshing(self):
+        """Пока один запрос обновляет страницу, остальные получают старую."""
+        self.client.get(self.url)
+        lock = MicrocacheMiddleware.lock_key(self.expire_entry())
+        locks.acquire(lock, settings.MICROCACHE_LOCK_TTL)
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Microcache'], 'STALE')
+        locks.release(lock)
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Microcache'], 'MISS')
+        self.assertTrue(locks.acquire(lock, settings.MICROCACHE_LOCK_TTL))
+        locks.release(lock)
+
+
+class ConditionalViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestName')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Тестовый пост', author=cls.author, group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def test_unchanged_pages_not_modified(self):
+        """Неизменная страница отдается как 304 без основных запросов."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'url': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                with self.assertNumQueries(1 if url != urls[0] else 0):
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                self.assertEqual(
+                    response.status_code, HTTPStatus.NOT_MODIFIED
+                )
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+                )
+                self.assertEqual(
+                    response.status_code, HTTPStatus.NOT_MODIFIED
+                )
+
+    def test_changed_page_sent_again(self):
+        """После фиксации изменения поста страница отдается заново."""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        run_commit_hooks()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_follow_feed_versioned_by_authors(self):
+        """Лента подписок обновляется по авторам, а не по подписчикам."""
+        reader = User.objects.create_user(username='Reader')
+        Follow.objects.create(user=reader, author=self.author)
+        run_commit_hooks()
+        reader_client = Client()
+        reader_client.force_login(reader)
+        url = reverse('posts:follow_index')
+        etag = reader_client.get(url)['ETag']
+        self.post.text = 'Исправленный пост'
+        self.post.save()
+        self.assertNotIn(
+            caching.scope('follow', reader.pk),
+            caching.post_scopes(self.post),
+        )
+        run_commit_hooks()
+        response = reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Исправленный пост')
+
+    def test_last_modified_from_posts(self):
+        """Last-Modified берется из дат постов и не зависит от кеша."""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'url': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.author}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        self.post.refresh_from_db()
+        modified = http_date(int(self.post.updated_at.timestamp()))
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response['Last-Modified'], modified)
+                cache.clear()
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=modified
+                )
+                self.assertEqual(
+                    response.status_code, HTTPStatus.NOT_MODIFIED
+                )
+
+    @override_settings(FOLLOW_STAMP_TTL=60)
+    def test_follow_feed_stamp_kept(self):
+        """Лента подписок проверяет авторов не чаще FOLLOW_STAMP_TTL."""
+        reader = User.objects.create_user(username='Reader')
+        Follow.objects.create(user=reader, author=self.author)
+        run_commit_hooks()
+        reader_client = Client()
+        reader_client.force_login(reader)
+        url = reverse('posts:follow_index')
+        etag = reader_client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        self.assertFalse(
+            [q for q in queries if 'posts_follow' in q['sql']]
+        )
+        self.post.save()
+        run_commit_hooks()
+        response = reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+        cache.delete(caching.FOLLOWED_CHECKED_KEY.format(reader.pk))
+        response = reader_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_etag_depends_on_user(self):
+        """ETag гостя не подходит авторизованному пользователю."""
+        url = reverse('posts:index')
+        etag = self.client.get(url)['ETag']
+        response = self.author_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        follow_url = reverse('posts:follow_index')
+        etag = self.author_client.get(follow_url)['ETag']
+        response = self.author_client.get(
+            follow_url, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_cache_control(self):
+        """Страницы гостя публичные, персональные страницы - приватные."""
+        url = reverse('posts:index')
+        response = self.client.get(url)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('Cookie', response['Vary'])
+        response = self.author_client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('public', response['Cache-Control'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestName')
+        cls.small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x01\x00'
+            b'\x01\x00\x00\x00\x00\x21\xf9\x04'
+            b'\x01\x0a\x00\x01\x00\x2c\x00\x00'
+            b'\x00\x00\x01\x00\x01\x00\x00\x02'
+            b'\x02\x4c\x01\x00\x3b'
+        )
+        cls.post = Post.objects.create(
+            text='Пост с картинкой',
+            author=cls.author,
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=cls.small_gif,
+                content_type='image/gif',
+            ),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(MEDIA_BACKGROUND=True)
+    def test_placeholder_until_thumbnail_ready(self):
+        """Страница не создает миниатюру сама, а ставит ее в очередь."""
+        url = reverse('posts:index')
+        with mock.patch.object(workers, 'pool') as pool:
+            response = self.client.get(url)
+            self.client.get(url)
+        self.assertContains(response, 'img/placeholder.svg')
+        pool.return_value.submit.assert_called_once_with(
+            thumbnails.generate, self.post.pk
+        )
+        self.assertIsNone(thumbnails.ready_thumbnail(self.post.image))
+        self.assertTrue(thumbnails.generate(self.post.pk))
+        response = self.client.get(url)
+        self.assertNotContains(response, 'img/placeholder.svg')
+        self.assertContains(
+            response, thumbnails.ready_thumbnail(self.post.image).url
+        )
+
+    @override_settings(MEDIA_BACKGROUND=True)
+    def test_new_image_processed_despite_queued_thumbnail(self):
+        """Обработка новой картинки ставится в очередь, даже если там уже
+        есть миниатюра."""
+        with mock.patch.object(workers, 'pool') as pool:
+            thumbnails.schedule(self.post.pk)
+            thumbnails.schedule(self.post.pk)
+            thumbnails.schedule(self.post.pk, uploads.process_post_image)
+        self.assertEqual(pool.return_value.submit.call_args_list, [
+            mock.call(thumbnails.generate, self.post.pk),
+            mock.call(uploads.process_post_image, self.post.pk),
+        ])
+
+    def test_generate_thumbnails_command(self):
+        """Команда создает миниатюры всех картинок."""
+        call_command('generate_thumbnails', workers=0, stdout=StringIO())
+        self.assertIsNotNone(thumbnails.ready_thumbnail(self.post.image))
+
+    def test_page_thumbnails_looked_up_at_once(self):
+        """Миниатюры всей страницы ищутся одним запросом к кешу и базе."""
+        posts = [self.post] + [
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=self.author,
+                image=SimpleUploadedFile(
+                    name=f'thumb{number}.gif',
+                    content=self.small_gif,
+                    content_type='image/gif',
+                ),
+            )
+            for number in range(3)
+        ]
+        call_command('generate_thumbnails', workers=0, stdout=StringIO())
+        cache.clear()
+        with mock.patch.object(
+            cache, 'get_many', wraps=cache.get_many
+        ) as get_many:
+            with self.assertNumQueries(1):
+                found = thumbnails.post_thumbnails(posts)
+            with self.assertNumQueries(0):
+                cached = thumbnails.post_thumbnails(posts)
+        self.assertEqual(get_many.call_count, 2)
+        self.assertEqual(len(found), len(posts))
+        for post in posts:
+            self.assertEqual(found[post.pk].name, cached[post.pk].name)
+
+    def test_image_variants_made_on_first_request(self):
+        """Варианты картинки для srcset создаются при первом запросе."""
+        url = reverse('posts:image_variant', kwargs={
+            'kind': 'post', 'width': 320, 'fmt': 'webp',
+            'name': self.post.image.name,
+        })
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'{url} 320w')
+        response = self.client.get(url)
+        variant = ImageVariant.objects.get(
+            source=self.post.image.name, width=320, format='webp'
+        )
+        self.assertRedirects(
+            response, default_storage.url(variant.name),
+            fetch_redirect_response=False,
+        )
+        with default_storage.open(variant.name) as image_file:
+            self.assertEqual(Image.open(image_file).size, (320, 160))
+        cache.clear()
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(
+            response, f'{default_storage.url(variant.name)} 320w'
+        )
+
+    def test_cards_dropped_with_variants(self):
+        """Карточки со ссылками на удаленные варианты рендерятся заново."""
+        call_command('generate_thumbnails', workers=0, stdout=StringIO())
+        post = Post.objects.select_related('author').get(pk=self.post.pk)
+        post_cards([post])
+        self.assertTrue(cache.get_many(card_keys(post.pk)))
+        uploads.forget_derived(default_storage, post.image.name)
+        self.assertFalse(cache.get_many(card_keys(post.pk)))
+
+    def test_unknown_image_variant(self):
+        """Варианты создаются только заданных размеров и картинок постов."""
+        for kind, width, name in (
+            ('post', 100, self.post.image.name),
+            ('avatar', 48, self.post.image.name),
+            ('post', 320, 'posts/missing.gif'),
+        ):
+            with self.subTest(kind=kind, width=width, name=name):
+                response = self.client.get(reverse(
+                    'posts:image_variant', kwargs={
+                        'kind': kind, 'width': width, 'fmt': 'jpeg',
+                        'name': name,
+                    }
+                ))
+                self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, IMAGE_MAX_EDGE=200)
+class UploadNormalizationTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestName')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        photo = Image.new('RGB', (400, 300), 'red')
+        exif = photo.getexif()
+        exif[0x0112] = 6
+        content = BytesIO()
+        photo.save(content, 'JPEG', exif=exif)
+        self.post = Post.objects.create(
+            text='Пост с фотографией',
+            author=self.author,
+            image=SimpleUploadedFile(
+                name='photo.jpg',
+                content=content.getvalue(),
+                content_type='image/jpeg',
+            ),
+        )
+
+    def test_image_normalized(self):
+        """Картинка уменьшается, поворачивается и теряет метаданные."""
+        name = self.post.image.name
+        self.assertTrue(uploads.process_post_image(self.post.pk))
+        self.post.refresh_from_db()
+        # The new content is stored under its own hash, the old is gone.
+        self.assertNotEqual(self.post.image.name, name)
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(
+            (self.post.image_width, self.post.image_height), (150, 200)
+        )
+        with default_storage.open(self.post.image.name) as image_file:
+            photo = Image.open(image_file)
+            self.assertEqual(photo.size, (150, 200))
+            self.assertFalse(photo.getexif())
+        self.assertIsNotNone(thumbnails.ready_thumbnail(self.post.image))
+        self.assertFalse(uploads.process_post_image(self.post.pk))
+
+    def test_normalize_media_command(self):
+        """Команда обрабатывает уже загруженные картинки."""
+        out = StringIO()
+        call_command('normalize_media', workers=0, stdout=out)
+        self.assertIn('Картинок обработано: 1', out.getvalue())
+
+    def test_dimensions_stored_on_upload(self):
+        """Размеры картинки сохраняются при загрузке и выводятся в ленте."""
+        self.assertEqual(
+            (self.post.image_width, self.post.image_height), (400, 300)
+        )
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'width="960"')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_fill_image_dimensions_command(self):
+        """Старые картинки не читаются при загрузке, их меряет команда."""
+        Post.objects.update(image_width=None, image_height=None)
+        with mock.patch.object(default_storage, 'open') as storage_open:
+            post = Post.objects.get(pk=self.post.pk)
+        storage_open.assert_not_called()
+        self.assertIsNone(post.image_width)
+        call_command('fill_image_dimensions', workers=0, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (400, 300))
+
+    @override_settings(MEDIA_BACKGROUND=True)
+    def test_placeholder_rendered_inline(self):
+        """Пока миниатюры нет, в карточке выводится размытая копия."""
+        uploads.fill_placeholders([self.post.pk])
+        self.post.refresh_from_db()
+        placeholder = self.post.image_placeholder
+        self.assertTrue(placeholder.startswith('data:image/webp;base64,'))
+        self.assertLess(len(placeholder), 1000)
+        with mock.patch.object(workers, 'pool'):
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, f'src="{placeholder}"')
+
+    def test_fill_placeholders_command(self):
+        """Команда создает заглушки пачками."""
+        call_command(
+            'fill_placeholders', workers=0, batch_size=1, stdout=StringIO()
+        )
+        self.post.refresh_from_db()
+        self.assertTrue(self.post.image_placeholder)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class MediaCollectorTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestName')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        content = BytesIO()
+        Image.new('RGB', (40, 20), 'blue').save(content, 'PNG')
+        self.post = Post.objects.create(
+            text='Пост с картинкой',
+            author=self.author,
+            image=SimpleUploadedFile('kept.png', content.getvalue()),
+        )
+        thumbnails.generate(self.post.pk)
+        self.thumbnail = thumbnails.ready_thumbnail(self.post.image).name
+        self.orphans = [
+            default_storage.save('posts/deleted.png', ContentFile(b'1')),
+            default_storage.save('cache/00/00/gone.png', ContentFile(b'2')),
+            default_storage.save(
+                'variants/post/320/gone.webp', ContentFile(b'3')
+            ),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_orphans_deleted(self):
+        """Файлы без ссылок удаляются, используемые остаются."""
+        out = StringIO()
+        call_command('collect_media', min_age=0, batch_size=2, stdout=out)
+        self.assertIn('Файлов удалено: 3', out.getvalue())
+        for name in self.orphans:
+            self.assertFalse(default_storage.exists(name))
+        self.assertTrue(default_storage.exists(self.post.image.name))
+        self.assertTrue(default_storage.exists(self.thumbnail))
+
+    def test_dry_run(self):
+        """В пробном режиме файлы только перечисляются."""
+        out = StringIO()
+        call_command('collect_media', min_age=0, dry_run=True, stdout=out)
+        for name in self.orphans:
+            self.assertIn(name, out.getvalue())
+            self.assertTrue(default_storage.exists(name))
+
+    def test_recent_files_kept(self):
+        """Свежие файлы не трогаются: их пост мог еще не сохраниться."""
+        call_command('collect_media', stdout=StringIO())
+        for name in self.orphans:
+            self.assertTrue(default_storage.exists(name))
+
+    def test_rate_limited(self):
+        """Удаление замедляется до заданной скорости."""
+        with mock.patch('posts.collector.time.sleep') as sleep:
+            call_command(
+                'collect_media', min_age=0, rate=1, stdout=StringIO()
+            )
+        self.assertEqual(sleep.call_count, 2)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class AvatarPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestName')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        content = BytesIO()
+        Image.new('RGB', (300, 200), 'green').save(content, 'JPEG')
+        self.profile = Profile.objects.create(
+            user=self.user,
+            avatar=SimpleUploadedFile('face.jpg', content.getvalue()),
+        )
+        self.client.force_login(self.user)
+
+    def test_avatar_cropped_and_prerendered(self):
+        """Аватарка обрезается до квадрата и сразу уменьшается."""
+        self.assertTrue(uploads.process_avatar(self.profile.pk))
+        self.profile.refresh_from_db()
+        self.assertEqual(
+            (self.profile.avatar_width, self.profile.avatar_height),
+            (200, 200),
+        )
+        self.assertEqual(
+            ImageVariant.objects.filter(
+                kind='avatar', source=self.profile.avatar.name
+            ).count(),
+            len(settings.IMAGE_VARIANTS['avatar']['widths']) * 2,
+        )
+        self.assertFalse(uploads.process_avatar(self.profile.pk))
+
+    def test_header_avatar_cached(self):
+        """Аватарка в шапке берется из кеша, без запроса профиля."""
+        uploads.process_avatar(self.profile.pk)
+        self.client.get(reverse('posts:index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        self.assertFalse([
+            query for query in queries.captured_queries
+            if 'posts_profile' in query['sql']
+        ])
+        self.assertContains(response, 'sizes="45px"')
+        self.assertContains(response, '.jpeg 48w')
+        self.assertContains(response, '/media/variants/avatar/48/')
+        self.assertNotContains(response, self.profile.avatar.url + '"')
+
+    def test_header_avatar_forgotten_on_change(self):
+        """Новая аватарка сразу появляется в шапке."""
+        self.client.get(reverse('posts:index'))
+        self.profile.avatar = ''
+        self.profile.save()
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, 'img/avatar_3.png')
+
+
+class AdviseIndexesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(username='TestName')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(
+            title='Тестовый заголовок',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Post.objects.bulk_create([
+            Post(text=f'Пост {number}', author=cls.author, group=cls.group)
+            for number in range(30)
+        ])
+        Group.objects.update(posts_count=30)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def test_feeds_use_indexes(self):
+        """Запросы лент не просматривают таблицы целиком."""
+        out = StringIO()
+        call_command('advise_indexes', stdout=out)
+        for label in ('index', 'group_posts', 'profile', 'post_detail'):
+            self.assertIn(f'{label}: запросов', out.getvalue())
+        self.assertIn('индексов предложено: 0', out.getvalue())
+
+    def test_missing_index_suggested(self):
+        """Без индекса ленты автора предлагается его создать."""
+        with connection.cursor() as cursor:
+            cursor.execute('DROP INDEX "post_author_feed_idx"')
+        out = StringIO()
+        call_command('advise_indexes', stdout=out)
+        self.assertIn(
+            'ON "posts_post" (author_id, pub_date DESC, id DESC)',
+            out.getvalue(),
+        )
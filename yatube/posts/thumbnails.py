@@ -0,0 +1,149 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE, KVStore as CachedDBKVStore,
+)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core.queries import unbudgeted
+from posts import caching, shards, workers
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+GEOMETRY = '960x480'
+OPTIONS = {'crop': 'center', 'upscale': True}
+QUEUED_KEY = 'thumbnail-queued:{}'
+
+
+def thumbnail_file(image):
+    """The file sorl stores the thumbnail of the image as.
+
+    Mirrors the first half of ThumbnailBackend.get_thumbnail(), so the
+    name matches the one a {% thumbnail %} tag would use, without
+    touching the original image.
+    """
+    backend = default.backend
+    source = ImageFile(image)
+    options = dict(OPTIONS)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(default_settings, attr):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, GEOMETRY, options),
+        default.storage,
+    )
+
+
+def ready_thumbnails(images):
+    """ready_thumbnail() of every image, keyed by the image name.
+
+    sorl asks its key-value store once per image. Here the records of all
+    images are read with one get_many() from the cache sorl keeps them in
+    and the misses with one query, as sorl's cached_db store would.
+    """
+    images = {image.name: image for image in images if image}
+    if not images:
+        return {}
+    if not isinstance(default.kvstore, CachedDBKVStore):
+        return {
+            name: default.kvstore.get(thumbnail_file(image))
+            for name, image in images.items()
+        }
+    keys = {
+        name: add_prefix(thumbnail_file(image).key)
+        for name, image in images.items()
+    }
+    kv_cache = default.kvstore.cache
+    values = kv_cache.get_many(keys.values())
+    missing = [key for key in keys.values() if key not in values]
+    if missing:
+        values.update(
+            KVStoreModel.objects.filter(key__in=missing)
+            .values_list('key', 'value')
+        )
+        # Remember the misses too, as sorl does, until a worker sets them.
+        kv_cache.set_many({
+            key: values.setdefault(key, EMPTY_VALUE) for key in missing
+        }, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+    return {
+        name: (
+            None if values[key] == EMPTY_VALUE
+            else deserialize_image_file(values[key])
+        )
+        for name, key in keys.items()
+    }
+
+
+def ready_thumbnail(image):
+    """The thumbnail of the image if it was generated, else None."""
+    return ready_thumbnails([image]).get(image.name) if image else None
+
+
+def post_thumbnails(posts):
+    """Generated thumbnails of the post images, keyed by the post pk.
+
+    A missing thumbnail is None and is queued for the worker pool; the
+    page shows a placeholder meanwhile instead of resizing the image in
+    the request. Without MEDIA_BACKGROUND it is made right away, as sorl
+    would.
+    """
+    posts = [post for post in posts if post.image]
+    ready = ready_thumbnails(post.image for post in posts)
+    thumbnails = {}
+    for post in posts:
+        thumbnail = ready[post.image.name]
+        if thumbnail is None:
+            if settings.MEDIA_BACKGROUND:
+                schedule(post.pk)
+            else:
+                with unbudgeted():
+                    thumbnail = get_thumbnail(post.image, GEOMETRY, **OPTIONS)
+        thumbnails[post.pk] = thumbnail
+    return thumbnails
+
+
+def post_thumbnail(post):
+    return post_thumbnails([post]).get(post.pk)
+
+
+def generate(post_id):
+    """Make the thumbnail of the post and refresh the pages showing it."""
+    post = shards.for_post(Post.objects.filter(pk=post_id), post_id).first()
+    if post is None or not post.image:
+        return False
+    try:
+        get_thumbnail(post.image, GEOMETRY, **OPTIONS)
+    except Exception:
+        logger.exception('Thumbnail of post %s failed', post_id)
+        return False
+    finally:
+        cache.delete(QUEUED_KEY.format(post_id))
+    caching.bump(*caching.post_scopes(post))
+    return True
+
+
+def schedule(post_id, job=None):
+    """Queue the thumbnail of the post unless it is queued already.
+
+    ``job`` replaces generate() when the image needs more work first. It
+    is queued in any case: a queued generate() may predate the new image.
+    """
+    key = QUEUED_KEY.format(post_id)
+    if job is not None:
+        cache.set(key, True, 60)
+        workers.submit(job, post_id)
+    elif cache.add(key, True, 60):
+        workers.submit(generate, post_id)
@@ -0,0 +1,210 @@
+import base64
+import logging
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import router
+from PIL import Image, ImageOps
+from sorl.thumbnail import delete as delete_thumbnails
+from sorl.thumbnail.images import ImageFile
+
+from posts import avatars, caching, shards, thumbnails, variants
+from posts.caching import scope
+from posts.models import Post, Profile
+from posts.templatetags.post_cards import card_keys
+
+logger = logging.getLogger(__name__)
+
+# Formats re-encoded on upload; anything else is kept as uploaded.
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 85, 'method': 6},
+}
+METADATA = ('exif', 'xmp', 'XML:com.adobe.xmp', 'comment', 'photoshop')
+# Inline placeholder: the 2:1 card crop at 20 pixels wide, as WebP.
+PLACEHOLDER_SIZE = (20, 10)
+PLACEHOLDER_QUALITY = 40
+
+
+def normalize(image, max_edge=None, square=False):
+    """Downscale, orient and strip the image file in place.
+
+    Only files larger than ``max_edge``, IMAGE_MAX_EDGE by default, or
+    carrying metadata are rewritten, in their own format and under their
+    own name, so running it again changes nothing. With ``square`` the
+    picture is also cropped to its centered square. Returns True if the
+    file was rewritten.
+    """
+    max_edge = max_edge or settings.IMAGE_MAX_EDGE
+    with image.storage.open(image.name) as image_file:
+        picture = Image.open(image_file)
+        options = SAVE_OPTIONS.get(picture.format)
+        if options is None or getattr(picture, 'n_frames', 1) > 1:
+            return False
+        has_metadata = bool(picture.getexif()) or any(
+            key in picture.info for key in METADATA
+        )
+        width, height = picture.size
+        if (
+            max(width, height) <= max_edge and not has_metadata
+            and not (square and width != height)
+        ):
+            return False
+        picture_format = picture.format
+        icc_profile = picture.info.get('icc_profile')
+        # JPEG can decode at a fraction of the size, much faster.
+        picture.draft(picture.mode, (max_edge, max_edge))
+        picture = ImageOps.exif_transpose(picture)
+        if square:
+            side = min(*picture.size, max_edge)
+            picture = ImageOps.fit(picture, (side, side), Image.LANCZOS)
+        else:
+            picture.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        picture.info = {}
+        content = BytesIO()
+        picture.save(
+            content, picture_format, icc_profile=icc_profile, **options
+        )
+    name = image.name
+    image.storage.delete(name)
+    # A content-addressed storage gives the new content a new name.
+    image.name = image.storage.save(name, ContentFile(content.getvalue()))
+    _store_dimensions(image, picture.size)
+    return True
+
+
+def _store_dimensions(image, size):
+    field = image.field
+    width, height = size
+    instance = image.instance
+    # Where the row was read from: the shard of a post.
+    using = router.db_for_write(type(instance), instance=instance)
+    type(instance).objects.using(using).filter(pk=instance.pk).update(**{
+        field.name: image.name,
+        field.width_field: width,
+        field.height_field: height,
+    })
+
+
+def measure(source):
+    """Store the dimensions of an image uploaded before they were kept.
+
+    ``source`` is a (kind, pk) pair of posts.variants.SOURCES.
+    """
+    kind, pk = source
+    model, field_name = variants.SOURCES[kind]
+    instance = shards.for_post(model.objects.filter(pk=pk), pk).first()
+    image = getattr(instance, field_name, None)
+    if not image:
+        return False
+    try:
+        with image.storage.open(image.name) as image_file:
+            size = Image.open(image_file).size
+    except (OSError, ValueError):
+        logger.warning('Cannot measure %s %s', kind, pk)
+        return False
+    _store_dimensions(image, size)
+    return True
+
+
+def forget_derived(storage, name):
+    """Drop thumbnails and variants made from a file that is gone.
+
+    Cached cards of posts still showing the file link to them, and are
+    dropped too.
+    """
+    delete_thumbnails(ImageFile(name, storage), delete_file=False)
+    variants.forget(name)
+    post_ids = shards.iterator(
+        Post.objects.filter(image=name).values_list('pk', flat=True)
+    )
+    cache.delete_many([
+        key for post_id in post_ids for key in card_keys(post_id)
+    ])
+
+
+def _normalize(image, label, **options):
+    previous = image.name
+    try:
+        if normalize(image, **options):
+            # The previous file stays while other posts still share it.
+            if image.name == previous or not image.storage.exists(previous):
+                forget_derived(image.storage, previous)
+            return True
+    except Exception:
+        logger.exception('Normalizing %s failed', label)
+    return False
+
+
+def placeholder_uri(image):
+    """A ~20px blurry copy of the image as a data URI."""
+    with image.storage.open(image.name) as image_file:
+        picture = Image.open(image_file)
+        # Decoding at 1/8 of the size is all a 20px copy needs.
+        picture.draft('RGB', PLACEHOLDER_SIZE)
+        picture = ImageOps.fit(
+            ImageOps.exif_transpose(picture).convert('RGB'),
+            PLACEHOLDER_SIZE, Image.BOX,
+        )
+    content = BytesIO()
+    picture.save(content, 'WEBP', quality=PLACEHOLDER_QUALITY)
+    return 'data:image/webp;base64,' + base64.b64encode(
+        content.getvalue()
+    ).decode()
+
+
+def _fill_placeholders(post_ids):
+    posts = []
+    for alias, ids in shards.by_database(post_ids).items():
+        batch = list(
+            Post.objects.using(alias).filter(pk__in=ids).exclude(image='')
+        )
+        for post in batch:
+            try:
+                post.image_placeholder = placeholder_uri(post.image)
+            except Exception:
+                logger.exception('Placeholder of post %s failed', post.pk)
+        Post.objects.using(alias).bulk_update(batch, ['image_placeholder'])
+        posts.extend(batch)
+    return posts
+
+
+def fill_placeholders(post_ids):
+    """Store placeholders of a batch of posts, with one UPDATE per batch."""
+    posts = _fill_placeholders(post_ids)
+    scopes = set()
+    for post in posts:
+        scopes.update(caching.post_scopes(post))
+    caching.bump(*scopes)
+    return len(posts)
+
+
+def process_post_image(post_id):
+    """Normalize a new post image, then make its placeholder and thumbnail."""
+    post = shards.for_post(Post.objects.filter(pk=post_id), post_id).first()
+    normalized = (
+        post is not None and bool(post.image)
+        and _normalize(post.image, f'image of post {post_id}')
+    )
+    _fill_placeholders([post_id])
+    thumbnails.generate(post_id)
+    return normalized
+
+
+def process_avatar(profile_id):
+    """Crop a new avatar to a square and make its small sizes."""
+    profile = Profile.objects.filter(pk=profile_id).first()
+    if profile is None or not profile.avatar:
+        return False
+    normalized = _normalize(
+        profile.avatar, f'avatar {profile_id}',
+        max_edge=settings.AVATAR_MAX_EDGE, square=True,
+    )
+    avatars.prerender(profile.avatar)
+    # The header now links to the files made, not to the variant view.
+    avatars.forget(profile.user_id)
+    caching.bump(scope('user', profile.user_id))
+    return normalized
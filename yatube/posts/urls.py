@@ -29,4 +29,9 @@ urlpatterns = [
         name='profile_unfollow'
     ),
     path('profile/<str:username>/avatar/', views.avatar_create, name='avatar'),
+    path(
+        'variants/<str:kind>/<int:width>/<str:fmt>/<path:name>',
+        views.image_variant,
+        name='image_variant'
+    ),
 ]
@@ -1,12 +1,179 @@
+import base64
+import binascii
+import datetime
+import json
+from functools import partial
+
 from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.core.mail import send_mail
-from django.core.paginator import Paginator
+from django.core.paginator import Page, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.functional import SimpleLazyObject, cached_property
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        # DjangoJSONEncoder cuts microseconds, keyset needs exact values.
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorPaginator(Paginator):
+    """Keyset pagination over the queryset ordering.
+
+    Pages are addressed by opaque tokens holding the ordering values of the
+    boundary row, so a deep page costs the same as the first one: neither
+    COUNT(*) nor OFFSET is issued. The returned object is a plain ``Page``
+    whose rows are fetched on first use, so a page rendered from a cached
+    fragment costs no query at all. ``num_pages`` only reports whether
+    there is a page after the current one.
+    """
+
+    def __init__(self, object_list, per_page, ordering=None):
+        super().__init__(object_list, per_page)
+        ordering = ordering or object_list.query.order_by or (
+            object_list.model._meta.ordering
+        )
+        self.ordering = tuple(ordering)
+        self._number = 1
+        self._fetch = None
+        self._rows = None
+
+    def _evaluate(self):
+        if self._rows is None:
+            self._rows, self._has_next, self._has_previous = self._fetch()
+        return self._rows
+
+    @cached_property
+    def count(self):
+        self._evaluate()
+        if not self._has_next:
+            return (self._number - 1) * self.per_page + len(self._rows)
+        return super().count
+
+    @property
+    def num_pages(self):
+        self._evaluate()
+        return self._number + 1 if self._has_next else self._number
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            return 1
+        return max(number, 1)
+
+    def get_page(self, number=None, cursor=None):
+        position = self.decode_cursor(cursor)
+        if position is not None:
+            number, values, backward = position
+            self._fetch = partial(self._keyset_rows, number, values, backward)
+        else:
+            number = self.validate_number(number)
+            self._fetch = partial(self._offset_rows, number)
+        self._number = number
+        page = Page(SimpleLazyObject(self._evaluate), number, self)
+        page.next_cursor = SimpleLazyObject(self._next_cursor)
+        page.previous_cursor = SimpleLazyObject(self._previous_cursor)
+        return page
+
+    def _fields(self):
+        for name in self.ordering:
+            yield name.lstrip('-'), name.startswith('-')
+
+    def _keyset_rows(self, number, values, backward):
+        condition = Q()
+        for index, (name, descending) in reversed(
+            list(enumerate(self._fields()))
+        ):
+            lookup = 'lt' if descending != backward else 'gt'
+            step = Q(**{f'{name}__{lookup}': values[index]})
+            if condition:
+                step |= Q(**{name: values[index]}) & condition
+            condition = step
+        queryset = self.object_list.filter(condition)
+        if backward:
+            queryset = queryset.order_by(*(
+                name if descending else f'-{name}'
+                for name, descending in self._fields()
+            ))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backward:
+            rows.reverse()
+            return rows, True, more
+        return rows, more, number > 1
+
+    def _offset_rows(self, number):
+        bottom = (number - 1) * self.per_page
+        rows = list(
+            self.object_list.order_by(*self.ordering)
+            [bottom:bottom + self.per_page + 1]
+        )
+        more = len(rows) > self.per_page
+        return rows[:self.per_page], more, number > 1
+
+    def _next_cursor(self):
+        rows = self._evaluate()
+        if rows and self._has_next:
+            return self.encode_cursor(self._number + 1, rows[-1])
+        return ''
+
+    def _previous_cursor(self):
+        rows = self._evaluate()
+        if rows and self._has_previous:
+            return self.encode_cursor(self._number - 1, rows[0], backward=True)
+        return ''
+
+    def encode_cursor(self, number, row, backward=False):
+        values = [getattr(row, name) for name, _ in self._fields()]
+        payload = json.dumps(
+            [number, values, backward],
+            cls=CursorEncoder,
+            separators=(',', ':'),
+        )
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def _to_python(self, name, value):
+        opts = self.object_list.model._meta
+        if name == 'pk':
+            return opts.pk.to_python(value)
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            return value
+        return field.to_python(value)
+
+    def decode_cursor(self, cursor):
+        if not cursor:
+            return None
+        try:
+            padding = '=' * (-len(cursor) % 4)
+            number, values, backward = json.loads(
+                base64.urlsafe_b64decode(cursor + padding)
+            )
+            if len(values) != len(self.ordering):
+                return None
+            values = [
+                self._to_python(name, value)
+                for (name, _), value in zip(self._fields(), values)
+            ]
+        except (binascii.Error, ValueError, TypeError, ValidationError):
+            return None
+        return self.validate_number(number), values, bool(backward)
 
 
 def page_obj_create(request, posts):
-    paginator = Paginator(posts, settings.POSTS_ON_PAGE)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = CursorPaginator(posts, settings.POSTS_ON_PAGE)
+    page_obj = paginator.get_page(
+        request.GET.get('page'), cursor=request.GET.get('cursor')
+    )
     return page_obj
 
 
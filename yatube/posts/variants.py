@@ -0,0 +1,129 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from posts import shards
+from posts.models import ImageVariant, Post, Profile
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+SOURCES = {
+    'post': (Post, 'image'),
+    'avatar': (Profile, 'avatar'),
+}
+
+
+def variant_name(kind, width, fmt, source):
+    return f'variants/{kind}/{width}/{source}.{fmt}'
+
+
+def is_known(kind, width, fmt, source):
+    """Only configured sizes of images that belong to a model are made."""
+    if kind not in SOURCES or fmt not in FORMATS:
+        return False
+    if width not in settings.IMAGE_VARIANTS[kind]['widths']:
+        return False
+    model, field = SOURCES[kind]
+    queryset = model.objects.filter(**{field: source})
+    return any(queryset.exists() for queryset in shards.everywhere(queryset))
+
+
+def make_variant(kind, width, fmt, source):
+    """Name of the variant file, resized from the source if not there."""
+    variant = ImageVariant.objects.filter(
+        source=source, kind=kind, width=width, format=fmt
+    ).first()
+    if variant is not None and default_storage.exists(variant.name):
+        return variant.name
+    ratio_width, ratio_height = settings.IMAGE_VARIANTS[kind]['ratio']
+    size = (width, width * ratio_height // ratio_width)
+    with default_storage.open(source) as image_file:
+        image = ImageOps.exif_transpose(Image.open(image_file))
+        image = ImageOps.fit(image.convert('RGB'), size, Image.LANCZOS)
+    content = BytesIO()
+    image.save(
+        content, FORMATS[fmt], quality=settings.IMAGE_VARIANT_QUALITY
+    )
+    name = variant_name(kind, width, fmt, source)
+    if default_storage.exists(name):
+        default_storage.delete(name)
+    name = default_storage.save(name, ContentFile(content.getvalue()))
+    try:
+        ImageVariant.objects.update_or_create(
+            source=source, kind=kind, width=width, format=fmt,
+            defaults={'name': name},
+        )
+    except IntegrityError:
+        # A concurrent request recorded the same variant first.
+        pass
+    return name
+
+
+def variant_widths(image, kind):
+    """Configured widths, without those wider than the stored source."""
+    widths = settings.IMAGE_VARIANTS[kind]['widths']
+    source_width = getattr(image.instance, image.field.width_field, None)
+    if not source_width:
+        return widths
+    return [width for width in widths if width <= source_width] or widths[:1]
+
+
+def variant_urls(images, kind):
+    """(width, url) of every format for the images, keyed by the name.
+
+    Variants made already link to their files; the others to the view
+    that makes them on first request. One query for all images.
+    """
+    images = [image for image in images if image]
+    names = [image.name for image in images]
+    if not names:
+        return {}
+    made = {
+        (variant.source, variant.format, variant.width): variant.name
+        for variant in ImageVariant.objects.filter(
+            kind=kind, source__in=names
+        )
+    }
+    result = {}
+    for image in images:
+        name = image.name
+        widths = variant_widths(image, kind)
+        result[name] = {}
+        for fmt in FORMATS:
+            urls = []
+            for width in widths:
+                variant = made.get((name, fmt, width))
+                if variant is not None:
+                    url = default_storage.url(variant)
+                else:
+                    url = reverse('posts:image_variant', kwargs={
+                        'kind': kind, 'width': width, 'fmt': fmt,
+                        'name': name,
+                    })
+                urls.append((width, url))
+            result[name][fmt] = urls
+    return result
+
+
+def srcset(urls):
+    return ', '.join(f'{url} {width}w' for width, url in urls)
+
+
+def srcsets(images, kind):
+    """srcset of every format for the images, keyed by the image name."""
+    return {
+        name: {fmt: srcset(urls) for fmt, urls in formats.items()}
+        for name, formats in variant_urls(images, kind).items()
+    }
+
+
+def forget(source):
+    """Delete the variants of a source whose file was replaced."""
+    made = ImageVariant.objects.filter(source=source)
+    for name in made.values_list('name', flat=True):
+        default_storage.delete(name)
+    made.delete()
@@ -1,54 +1,151 @@
+from functools import partial
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.http import Http404
 from django.shortcuts import get_object_or_404, redirect, render
 
+from core.decorators import microcache
+from posts import shards, variants
+from posts.caching import (
+    conditional_page, feed_cache, follow_feed_scopes, last_change, scope,
+)
+from posts.feeds import follow_feed
 from posts.forms import CommentForm, PostForm, ProfileForm
-from posts.models import Follow, Group, Post, Profile
+from posts.models import Comment, Follow, Group, Post, Profile
+from posts.search import search_posts
 from posts.utils import page_obj_create
 
 User = get_user_model()
 
 
+def get_post_or_404(post_id, *related):
+    """The post from its shard or from the archive, else Http404."""
+    post = shards.find_post(Post.objects.all(), post_id, related)
+    if post is None:
+        raise Http404('No Post matches the given query.')
+    return post
+
+
+def index_scopes(request):
+    return [scope('global')], partial(last_change, Post.objects.all())
+
+
+def group_scopes(request, url):
+    group_id = Group.objects.filter(slug=url).values_list(
+        'pk', flat=True
+    ).first()
+    if group_id is None:
+        return None
+    return [scope('group', group_id)], partial(
+        last_change, Post.objects.filter(group_id=group_id)
+    )
+
+
+def profile_scopes(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    return [scope('author', author_id), scope('follow', author_id)], partial(
+        last_change, Post.objects.filter(author_id=author_id)
+    )
+
+
+def detail_scopes(request, post_id):
+    # Comments are on the database of their post.
+    commented = Comment.objects.filter(post=OuterRef('pk')).order_by(
+        '-pub_date'
+    ).values('pub_date')[:1]
+    post = shards.find_post(
+        Post.objects.annotate(commented=Subquery(commented)).values_list(
+            'author_id', 'group_id', 'updated_at', 'commented'
+        ),
+        post_id,
+    )
+    if post is None:
+        return None
+    author_id, group_id, updated_at, commented = post
+    scopes = [scope('post', post_id), scope('author', author_id)]
+    if group_id is not None:
+        scopes.append(scope('group', group_id))
+    return scopes, lambda: max(filter(None, (updated_at, commented)))
+
+
+def follow_scopes(request):
+    # Asked for by conditional_page() and then by the view.
+    if not hasattr(request, 'follow_scopes'):
+        # Read once, whoever needs it first.
+        author_ids = Follow.objects.filter(user=request.user).values_list(
+            'author_id', flat=True
+        )
+        request.follow_scopes = (
+            follow_feed_scopes(request.user, author_ids),
+            partial(_followed_change, author_ids),
+        )
+    return request.follow_scopes
+
+
+def _followed_change(author_ids):
+    if shards.is_sharded(Post) or shards.is_archived(Post):
+        # The follows are on default alone.
+        author_ids = list(author_ids)
+    return last_change(Post.objects.filter(author_id__in=author_ids))
+
+
+@microcache(ttl=5)
+@conditional_page(index_scopes)
 def index(request):
     keyword = request.GET.get('srch')
     if keyword:
-        posts = (
-            Post.objects.select_related('author', 'group').
-            filter(
-                Q(text__contains=keyword.lower())
-                | Q(text__contains=keyword.upper())
-                | Q(text__contains=keyword.capitalize())
-            ).all()
-        )
+        posts = search_posts(keyword)
     else:
         posts = Post.objects.all()
+    posts = shards.merged(posts).select_related('author', 'group')
     page_obj = page_obj_create(request, posts)
     context = {
         'page_obj': page_obj,
         'keyword': keyword,
+        **feed_cache(request, scope('global')),
     }
     template = 'posts/index.html'
     return render(request, template, context)
 
 
+@microcache(ttl=10)
+@conditional_page(group_scopes)
 def group_posts(request, url):
     selected_group = get_object_or_404(Group, slug=url)
-    group_posts = selected_group.posts.all()
+    group_posts = shards.merged(selected_group.posts.all()).select_related(
+        'author', 'group'
+    )
     page_obj = page_obj_create(request, group_posts)
     context = {
         'page_obj': page_obj,
         'group': selected_group,
+        **feed_cache(request, scope('group', selected_group.pk)),
     }
     template = 'posts/group_list.html'
     return render(request, template, context)
 
 
+@microcache(ttl=10)
+@conditional_page(profile_scopes)
 def profile(request, username):
-    selected_author = get_object_or_404(User, username=username)
-    author_posts = selected_author.posts.all()
+    selected_author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    # The author's posts are all on one shard, the old ones archived.
+    author_posts = shards.merged(
+        selected_author.posts.all(),
+        shards.author_databases(selected_author.pk),
+    ).select_related('author', 'group')
     page_obj = page_obj_create(request, author_posts)
-    count = selected_author.posts.all().count()
+    count = selected_author.stats.posts_count
     following = (
         request.user.is_authenticated
         and Follow.objects.filter(
@@ -61,14 +158,19 @@ def profile(request, username):
         'author': selected_author,
         'count': count,
         'following': following,
+        **feed_cache(request, scope('author', selected_author.pk)),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@microcache(ttl=10)
+@conditional_page(detail_scopes)
 def post_detail(request, post_id):
-    selected_post = get_object_or_404(Post, id=post_id)
-    count = selected_post.author.posts.all().count()
-    comments = selected_post.comments.all()
+    selected_post = get_post_or_404(post_id, 'author__stats', 'group')
+    count = selected_post.author.stats.posts_count
+    comments = shards.select_related(
+        selected_post.comments.all(), 'author'
+    )
     form = CommentForm()
     context = {
         'post': selected_post,
@@ -82,13 +184,14 @@ def post_detail(request, post_id):
 
 @login_required
 def add_comment(request, post_id):
-    selected_post = get_object_or_404(Post, id=post_id)
+    selected_post = get_post_or_404(post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = selected_post
-        comment.save()
+        with transaction.atomic():
+            comment.save()
     return redirect('posts:post_detail', post_id=post_id)
 
 
@@ -101,14 +204,15 @@ def post_create(request):
     if form.is_valid():
         new_post = form.save(commit=False)
         new_post.author = request.user
-        new_post.save()
+        with transaction.atomic():
+            new_post.save()
         return redirect('posts:profile', username=request.user)
     return render(request, 'posts/create_post.html', {'form': form})
 
 
 @login_required
 def post_edit(request, post_id):
-    selected_post = get_object_or_404(Post, id=post_id)
+    selected_post = get_post_or_404(post_id)
     if selected_post.author != request.user:
         return redirect('posts:post_detail', post_id=post_id)
     form = PostForm(
@@ -117,7 +221,14 @@ def post_edit(request, post_id):
         instance=selected_post
     )
     if form.is_valid():
-        selected_post.save()
+        with transaction.atomic():
+            # Counters are maintained by UPDATE ... F(), don't overwrite.
+            selected_post.save(
+                update_fields=[
+                    *PostForm.Meta.fields,
+                    'image_width', 'image_height', 'updated_at',
+                ]
+            )
         return redirect('posts:post_detail', post_id=post_id)
     context = {
         'form': form,
@@ -129,20 +240,23 @@ def post_edit(request, post_id):
 
 @login_required
 def post_delete(request, post_id):
-    selected_post = get_object_or_404(Post, id=post_id)
+    selected_post = get_post_or_404(post_id)
     author = selected_post.author
     if author != request.user:
         return redirect('posts:post_detail', post_id=post_id)
-    selected_post.delete()
+    with transaction.atomic():
+        selected_post.delete()
     return redirect('posts:profile', username=author)
 
 
 @login_required
+@conditional_page(follow_scopes)
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user).all()
+    posts = follow_feed(request.user).select_related('author', 'group')
     page_obj = page_obj_create(request, posts)
     context = {
         'page_obj': page_obj,
+        **feed_cache(request, *follow_scopes(request)[0]),
     }
     return render(request, 'posts/follow.html', context)
 
@@ -152,26 +266,30 @@ def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author == request.user:
         return redirect('posts:profile', username=request.user)
-    Follow.objects.get_or_create(
-        user=request.user,
-        author=author,
-    )
+    with transaction.atomic():
+        Follow.objects.get_or_create(
+            user=request.user,
+            author=author,
+        )
     return redirect('posts:profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    Follow.objects.filter(
-        user=request.user,
-        author__username=username
-    ) .delete()
+    with transaction.atomic():
+        Follow.objects.filter(
+            user=request.user,
+            author__username=username
+        ).delete()
     return redirect('posts:profile', username=username)
 
 
 @login_required
 def avatar_create(request, username):
-    author = get_object_or_404(User, username=username)
-    count = author.posts.all().count()
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    count = author.stats.posts_count
     if author != request.user:
         return redirect('posts:profile', username=username)
     if Profile.objects.filter(user=author).exists():
@@ -182,7 +300,9 @@ def avatar_create(request, username):
             instance=selected_profile,
         )
         if form.is_valid():
-            selected_profile.save()
+            selected_profile.save(update_fields=[
+                *ProfileForm.Meta.fields, 'avatar_width', 'avatar_height',
+            ])
             return redirect('posts:profile', username=request.user)
     else:
         form = ProfileForm(
@@ -200,3 +320,10 @@ def avatar_create(request, username):
         'form': form,
     }
     return render(request, 'posts/avatar.html', context)
+
+
+def image_variant(request, kind, width, fmt, name):
+    if not variants.is_known(kind, width, fmt, name):
+        raise Http404
+    variant = variants.make_variant(kind, width, fmt, name)
+    return redirect(default_storage.url(variant))
@@ -0,0 +1,46 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+
+from core.queries import unbudgeted
+
+_executor = None
+
+
+def _new_pool(workers):
+    # Spawned workers don't share the parent's database connections.
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    )
+
+
+def pool():
+    """Process pool of the web process for media jobs, made on first use."""
+    global _executor
+    if _executor is None:
+        _executor = _new_pool(settings.MEDIA_WORKERS)
+    return _executor
+
+
+def submit(job, *args):
+    """Run the job in the pool, or right away without MEDIA_BACKGROUND."""
+    if not settings.MEDIA_BACKGROUND:
+        with unbudgeted():
+            job(*args)
+        return
+    pool().submit(job, *args)
+
+
+def run_all(job, items, workers):
+    """Yield (item, result) of the job for every item, in a new pool."""
+    if not workers:
+        for item in items:
+            yield item, job(item)
+        return
+    with _new_pool(workers) as executor:
+        items = list(items)
+        yield from zip(items, executor.map(job, items, chunksize=16))
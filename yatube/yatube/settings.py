@@ -41,10 +41,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.ReplicaMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.MicrocacheMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
@@ -85,9 +89,63 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Keep connections, and the pragmas set on them, across requests.
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {'timeout': 20},
     }
 }
 
+# Reads of GET requests go to one of DATABASE_REPLICAS, everything else
+# to default. For local testing the replica below is a copy of default
+# kept fresh by "manage.py refresh_replicas"; list it to use it.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+    'TEST': {'MIRROR': 'default'},
+}
+DATABASE_ROUTERS = ['posts.shards.ShardRouter']
+DATABASE_REPLICAS = []
+# Seconds between the copies refresh_replicas makes.
+REPLICA_REFRESH_INTERVAL = 5
+# How long a browser that wrote keeps reading from default: the copy in
+# progress may miss the write, the next one has it.
+REPLICA_PIN_SECONDS = 2 * REPLICA_REFRESH_INTERVAL
+
+# Posts and their comments are spread over POST_SHARDS by author when it
+# lists databases, see posts.shards. To turn it on, "manage.py migrate
+# --database=<alias>" every shard, list them and run "manage.py
+# rebalance_shards"; run it again whenever the list changes.
+for number in (1, 2):
+    DATABASES[f'posts_{number}'] = {
+        **DATABASES['default'],
+        'NAME': os.path.join(BASE_DIR, f'db.posts_{number}.sqlite3'),
+    }
+POST_SHARDS = []
+
+# Posts older than POST_ARCHIVE_AFTER_DAYS, with their comments, are
+# moved by "manage.py archive_posts" to the POST_ARCHIVE database, when
+# set, keeping the tables read by recent feeds small. Migrate it first.
+DATABASES['archive'] = {
+    **DATABASES['default'],
+    'NAME': os.path.join(BASE_DIR, 'db.archive.sqlite3'),
+}
+POST_ARCHIVE = None
+POST_ARCHIVE_AFTER_DAYS = 365
+
+# Set by core.db on every new SQLite connection. With the WAL journal
+# readers do not wait for a writer, nor a writer for readers, and
+# synchronous=NORMAL is then still safe from corruption. The journal
+# mode is kept in the database file, and db.sqlite3 is tracked by git:
+# add 'journal_mode': 'wal' where the database is not.
+SQLITE_PRAGMAS = {
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    # Negative means KiB: 64 MB of page cache per connection.
+    'cache_size': -64000,
+    'temp_store': 'memory',
+    'busy_timeout': 20000,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -139,14 +197,107 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 POSTS_ON_PAGE = 10
 
+# Posts of authors with more followers are not copied into timelines,
+# follow feeds read them at query time instead. They are copied again,
+# in the background, once the author is down to
+# FEED_FANOUT_RESUME_FOLLOWERS, so that an audience around the limit
+# does not copy them over and over.
+FEED_FANOUT_MAX_FOLLOWERS = 1000
+FEED_FANOUT_RESUME_FOLLOWERS = 900
+FEED_BATCH_SIZE = 500
+# Seconds a follow feed is validated by the newest stamp of the authors
+# followed, as it was last looked up: their posts show up that late.
+FOLLOW_STAMP_TTL = 5
+
+# Russian stemming of the search index, needs the snowballstemmer package,
+# which is not in requirements.txt. Run "manage.py rebuild_search_index"
+# after switching it.
+SEARCH_STEMMING = False
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# core.views.serve_media serves MEDIA_URL. Behind nginx or Apache set
+# MEDIA_SENDFILE to 'x-accel-redirect' or 'x-sendfile' to let them send the
+# files; nginx then needs an internal location at MEDIA_ACCEL_PREFIX.
+MEDIA_SENDFILE = None
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+# Files named by a hash are cached for a year, the others for this long.
+MEDIA_MAX_AGE = 60 * 60
+
+# Uploads are hashed as they arrive, for core.storage.
+FILE_UPLOAD_HANDLERS = [
+    'core.storage.HashingMemoryFileUploadHandler',
+    'core.storage.HashingTemporaryFileUploadHandler',
+]
+
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Max SQL queries per view, session and user lookups included, and the
+# three lookups of a page with images on a cold cache: its thumbnails,
+# its variants and its Last-Modified date, one query each.
+QUERY_BUDGETS = {
+    'posts:index': 7,
+    'posts:group_list': 8,
+    'posts:profile': 10,
+    'posts:post_detail': 8,
+    'posts:follow_index': 7,
+}
+# Databases the posts are read from, the budgets are multiplied by their
+# number: feeds read every shard and the archive.
+QUERY_BUDGET_DATABASES = 'posts.shards.all_databases'
+# The same statement shape this many times in one request on one
+# database is an N+1.
+QUERY_BUDGET_REPEAT_THRESHOLD = 3
+# Log overruns when False, raise QueryBudgetExceeded when True (tests).
+QUERY_BUDGET_RAISE = False
+
+# Feed fragments are invalidated by version stamps, the timeout only
+# bounds memory usage.
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Uploads are processed and thumbnails are made by a process pool, not by
+# the request that gets or shows them.
+MEDIA_BACKGROUND = True
+MEDIA_WORKERS = 2
+# Originals are downscaled to this longest edge on upload.
+IMAGE_MAX_EDGE = 2048
+
+# Widths of the srcset variants, cropped to the ratio, in WebP and JPEG.
+IMAGE_VARIANTS = {
+    'post': {'widths': (320, 640, 960), 'ratio': (2, 1)},
+    'avatar': {'widths': (48, 96, 192), 'ratio': (1, 1)},
+}
+IMAGE_VARIANT_QUALITY = 80
+# Avatars are cropped to a square of at most this side on upload.
+AVATAR_MAX_EDGE = 512
+# The header avatar of a user is looked up once per this period.
+AVATAR_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Whole-page cache for anonymous visitors, TTLs are set by @microcache.
+MICROCACHE_ENABLED = True
+# How long an expired page may still be served while it is re-rendered.
+MICROCACHE_STALE_TTL = 60
+MICROCACHE_LOCK_TTL = 10
+# Lock files of core.locks, shared by the processes of the host.
+LOCK_DIR = os.path.join(BASE_DIR, 'cache', 'locks')
+# How long a request waits for a page another request is rendering.
+MICROCACHE_WAIT = 1
+
+# Per-process LRU in front of a file cache shared by all workers.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'core.cache.TieredCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+        'OPTIONS': {
+            'LOCAL_MAX_ENTRIES': 1000,
+            'LOCAL_MAX_BYTES': 16 * 1024 * 1024,
+            # Feed fragments, post cards, pages and stamps of all workers.
+            'SHARED_MAX_ENTRIES': 100000,
+            'SHARED_CULL_FREQUENCY': 10,
+            'GENERATION_BUCKETS': 64,
+            'GENERATION_INTERVAL': 1.0,
+        },
     }
 }
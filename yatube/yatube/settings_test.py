@@ -0,0 +1,27 @@
+"""Settings of the test runs: manage.py test and pytest use them.
+
+Tests read pages right after changing the data and check media files
+right after uploading them, so nothing is served from the microcache or
+deferred to the worker pool, and follow feeds look up their authors on
+every request. The cache and the locks are kept out of
+the project.
+Views over their query budget, or running N+1 queries, fail the test.
+"""
+import os
+import tempfile
+
+from yatube.settings import *  # noqa: F401,F403
+from yatube.settings import CACHES
+
+QUERY_BUDGET_RAISE = True
+MEDIA_BACKGROUND = False
+MICROCACHE_ENABLED = False
+FOLLOW_STAMP_TTL = 0
+LOCK_DIR = os.path.join(tempfile.gettempdir(), 'yatube-test-locks')
+
+CACHES = {
+    'default': {
+        **CACHES['default'],
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'yatube-test-cache'),
+    }
+}